@@ -5,6 +5,8 @@ setup.py file for SWIG-ified wndchrm
 """
 
 from setuptools import setup, Extension
+# The swig wrapper uses numpy.i typemaps, so numpy headers are needed at build time
+from numpy import get_include as get_numpy_include
 
 # Need to subclass setuptools/distutils objects to change build order
 # such that dynamically-generated swig files will be present when MANIFEST is created.
@@ -67,6 +69,12 @@ if not os.path.exists( 'config.h' ):
 	import sys
 	sys.exit(p)
 
+libraries = ['tiff','fftw3','pthread']
+import sys
+if sys.platform.startswith( 'linux' ):
+    # for shm_open() and shm_unlink(), part of libc only as of glibc 2.34
+    libraries.append( 'rt' )
+
 wndchrm_module = Extension('_wndcharm',
 	sources=[
 		'wndcharm/swig/wndcharm.i',
@@ -95,6 +103,7 @@ wndchrm_module = Extension('_wndcharm',
 		'src/transforms/wavelet/WaveletMedium.cpp',
 		'src/transforms/wavelet/wt.cpp',
 		'src/cmatrix.cpp',
+		'src/cmatrix_shm.cpp',
 		'src/wndchrm_error.cpp',
 		'src/ImageTransforms.cpp',
 		'src/FeatureAlgorithms.cpp',
@@ -102,9 +111,9 @@ wndchrm_module = Extension('_wndcharm',
 		'src/FeatureNames.cpp',
 		'src/gsl/specfunc.cpp',
 	],
-	include_dirs=['./','src/', '/usr/local/include'],
+	include_dirs=['./','src/', '/usr/local/include', get_numpy_include()],
 	swig_opts=['-threads', '-c++', '-I./', '-I./src', '-outdir', 'wndcharm'],
-	libraries=['tiff','fftw3'],
+	libraries=libraries,
 )
 
 setup (
@@ -27,7 +27,10 @@
 /*~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~*/
 #include <assert.h>
 #include <string>
+#include <stdexcept>
+#include <new>
 #include <iostream>
+#include <cmath>
 #include "Tasks.h"
 #include "FeatureNames.h"
 #include "ImageTransforms.h"
@@ -35,6 +38,8 @@
 #include "cmatrix.h"
 
 #include "sys/time.h"
+#include <time.h> // for clock_gettime()
+#include <unistd.h> // for sysconf()
 
 // This file contains base classes for computation tasks, plans and executors.
 // Also an implementation of a feature calculation plan and executor.
@@ -57,6 +62,57 @@ void ComputationTask::print_info () const {
 	std::cout << typeLabel () << " '" << name << "'" << std::endl;
 }
 
+// Calibration table for task cost estimates, keyed by task name.
+// Seconds for a 1 megapixel image on a single core, and the exponent of the number of megapixels
+// the run-time scales with.  Measured with the long feature set on a 301x300 image, except Fourier,
+// which is based on FFTW with FFTW_ESTIMATE plans.
+// Chebyshev's run-time is proportional to the number of pixels times the image's smaller dimension.
+// Tasks not in the table get the default at the end.
+static const struct {
+	const char *name;
+	double secs_per_Mpx;
+	double exponent;
+} task_costs[] = {
+	// ImageTransforms
+	{"Fourier",                         0.05, 1.0},
+	{"Chebyshev",                       8.0,  1.5},
+	{"Wavelet",                         0.06, 1.0},
+	{"Edge",                            0.02, 1.0},
+	{"Color",                           0.05, 1.0},
+	{"Hue",                             0.05, 1.0},
+	// FeatureAlgorithms
+	{"Gabor Textures",                 24.7,  1.0},
+	{"Chebyshev-Fourier Coefficients",  1.8,  1.0},
+	{"Haralick Textures",               1.05, 1.0},
+	{"Tamura Textures",                 0.45, 1.0},
+	{"Otsu Object Features",            0.39, 1.0},
+	{"Inverse-Otsu Object Features",    0.30, 1.0},
+	{"Zernike Coefficients",            0.31, 1.0},
+	{"Comb Moments",                    0.21, 1.0},
+	{"Edge Features",                   0.17, 1.0},
+	{"Gini Coefficient",                0.16, 1.0},
+	{"Fractal Features",                0.10, 1.0},
+	{"Chebyshev Coefficients",          0.10, 1.0},
+	{"Radon Coefficients",              0.08, 1.0},
+	{"Color Histogram",                 0.05, 1.0},
+	{"Pixel Intensity Statistics",      0.02, 1.0},
+	{"Multiscale Histograms",           0.015, 1.0},
+	// default
+	{NULL,                              0.1,  1.0}
+};
+
+void ComputationTask::init_cost () {
+	size_t idx;
+	for (idx = 0; task_costs[idx].name; idx++)
+		if (name == task_costs[idx].name) break;
+	secs_per_Mpx = task_costs[idx].secs_per_Mpx;
+	cost_exponent = task_costs[idx].exponent;
+}
+
+double ComputationTask::cost_estimate (unsigned int width, unsigned int height) const {
+	return (secs_per_Mpx * pow ((double(width) * double(height)) / 1.0e6, cost_exponent));
+}
+
 
 bool ComputationTaskInstances::initialized () {
 	static std::vector<const ComputationTask *> &instances = getInstances();
@@ -115,6 +171,42 @@ size_t ComputationTaskNode::get_num_dependent_nodes () {
 }
 
 
+double ComputationPlan::predicted_cost (unsigned int width, unsigned int height) const {
+	double cost = 0;
+	nodemap_t::const_iterator nodemap_it;
+	for (nodemap_it = nodemap.begin(); nodemap_it != nodemap.end(); nodemap_it++) {
+		if (nodemap_it->second->task) cost += nodemap_it->second->task->cost_estimate (width, height);
+	}
+	return (cost);
+}
+
+size_t ComputationPlan::predicted_peak_bytes (unsigned int width, unsigned int height) const {
+	size_t n_planes = 1; // the input
+	nodemap_t::const_iterator nodemap_it;
+	for (nodemap_it = nodemap.begin(); nodemap_it != nodemap.end(); nodemap_it++) {
+		if (nodemap_it->second->task && nodemap_it->second->task->type == ComputationTask::ImageTransformTask) n_planes++;
+	}
+	return (n_planes * width * height * sizeof(double));
+}
+
+double ComputationPlan::critical_path_cost (unsigned int width, unsigned int height) const {
+	node_costs_t node_costs;
+	return (get_critical_path_costs (root, width, height, node_costs));
+}
+
+double ComputationPlan::get_critical_path_costs (const ComputationTaskNode *node, unsigned int width, unsigned int height, node_costs_t &node_costs) const {
+	double max_dependent_cost = 0, cost;
+	for (size_t i = 0; i < node->dependent_tasks.size(); i++) {
+		cost = get_critical_path_costs (node->dependent_tasks[i], width, height, node_costs);
+		if (cost > max_dependent_cost) max_dependent_cost = cost;
+	}
+	cost = max_dependent_cost;
+	if (node->task) cost += node->task->cost_estimate (width, height);
+	node_costs[node->node_key] = cost;
+	return (cost);
+}
+
+
 void FeatureComputationPlan::add (const FeatureGroup *fg) {
 	const ComputationTaskNode *source_node = root;
 	nodemap_t::iterator nodemap_it;
@@ -179,19 +271,41 @@ const FeatureGroup *FeatureComputationPlan::getFeatureGroupByIndex (size_t offse
 
 
 
-bool compare_dependencies (const ComputationTaskNode *first, const ComputationTaskNode *second) {
+// By default, deeper nodes go first, so a transform's dependents finish and release it before its sibling
+// transforms are computed.  With critical_path_first, the nodes with the most expensive chain of dependents
+// go first, so the long chains (e.g. Zernike or Haralick on big transforms) aren't left to the end.
+// Remaining ties go to the nodes with more dependents.
+bool ComputationPlanExecutor::compare_nodes (const ComputationTaskNode *first, const ComputationTaskNode *second) const {
+	double first_cost = 0, second_cost = 0;
+	ComputationPlan::node_costs_t::const_iterator costs_it;
+	if ( (costs_it = critical_path_costs.find (first->node_key)) != critical_path_costs.end() ) first_cost = costs_it->second;
+	if ( (costs_it = critical_path_costs.find (second->node_key)) != critical_path_costs.end() ) second_cost = costs_it->second;
+
+	if (critical_path_first && first_cost != second_cost) return first_cost < second_cost;
+	if (first->depth != second->depth) return first->depth < second->depth;
+	if (first_cost != second_cost) return first_cost < second_cost;
 	return first->num_dependent_nodes < second->num_dependent_nodes;
 }
+
+// Heap comparison functor for executable_nodes
+struct compare_executable_nodes {
+	const ComputationPlanExecutor *executor;
+	compare_executable_nodes (const ComputationPlanExecutor *executor_in) : executor (executor_in) {}
+	bool operator() (const ComputationTaskNode *first, const ComputationTaskNode *second) const {
+		return executor->compare_nodes (first, second);
+	}
+};
+
 void ComputationPlanExecutor::make_dependencies_executable (const ComputationTaskNode *exec_node) {
 	// add dependencies to executable_nodes
 	executable_nodes.insert (executable_nodes.end(), exec_node->dependent_tasks.begin(), exec_node->dependent_tasks.end());
-	make_heap (executable_nodes.begin(), executable_nodes.end(), compare_dependencies);
+	make_heap (executable_nodes.begin(), executable_nodes.end(), compare_executable_nodes (this));
 };
 
 const ComputationTaskNode *ComputationPlanExecutor::get_next_executable_node () {
 // get the first node off the heap and pop it off the vector
 
-	pop_heap (executable_nodes.begin(), executable_nodes.end(), compare_dependencies);
+	pop_heap (executable_nodes.begin(), executable_nodes.end(), compare_executable_nodes (this));
 	const ComputationTaskNode *exec_node = executable_nodes.back();
 	executable_nodes.pop_back();
 	return (exec_node);
@@ -201,28 +315,72 @@ void FeatureComputationPlanExecutor::execute_node (const ComputationTaskNode *ex
 	// Put it in the executing nodes set
 	ComputationPlanExecutor::execute_node (exec_node);
 
+	// The ImageMatrix cache is keyed by node_key
+	assert (IM_map.find(exec_node->node_key) == IM_map.end() && "Attempt to execute a transform which is already cached.");
+	NodeTiming timing;
+	const ImageMatrix *IM_out = compute_node (exec_node, IM_map[exec_node->source_task->node_key], record_timings ? &timing : NULL);
+	if (IM_out) cache_IM (exec_node, IM_out);
+	if (record_timings) timings.push_back (timing);
+}
+
+void FeatureComputationPlanExecutor::cache_IM (const ComputationTaskNode *node, const ImageMatrix *IM) {
+	IM_map[node->node_key] = IM;
+	IM_readers[node->node_key] = node->dependent_tasks.size();
+	IM_bytes += IM->data_bytes();
+	if (IM_bytes > peak_IM_bytes) peak_IM_bytes = IM_bytes;
+}
+
+// Called by each dependent node when it's done reading the node's ImageMatrix.
+// The last reader deletes it, except for the root, which belongs to the caller of run().
+void FeatureComputationPlanExecutor::release_IM (const ComputationTaskNode *node) {
+	IM_readers_t::iterator readers_it = IM_readers.find (node->node_key);
+	if (readers_it == IM_readers.end()) return; // feature algorithm nodes have no ImageMatrix
+	if (readers_it->second) readers_it->second--;
+	if (readers_it->second) return;
+
+	IM_map_t::iterator IM_map_it = IM_map.find (node->node_key);
+	assert (IM_map_it != IM_map.end() && "Attempt to release an ImageMatrix that isn't cached.");
+	IM_readers.erase (readers_it);
+	if (node == plan->root) return;
+
+	if (verbosity > 7) std::cout << "FeatureComputationPlanExecutor::release_IM(): deleting IM for node_key=" << node->node_key << std::endl;
+	IM_bytes -= IM_map_it->second->data_bytes();
+	delete (IM_map_it->second);
+	IM_map.erase (IM_map_it);
+}
+
+// CPU time used by the calling thread, in seconds
+static double thread_cpu_time () {
+#ifdef CLOCK_THREAD_CPUTIME_ID
+	struct timespec ts;
+	if (clock_gettime (CLOCK_THREAD_CPUTIME_ID, &ts) == 0) return (ts.tv_sec + (ts.tv_nsec / 1000000000.0));
+#endif
+	return (double (clock()) / CLOCKS_PER_SEC);
+}
+
+const ImageMatrix *FeatureComputationPlanExecutor::compute_node (const ComputationTaskNode *exec_node, const ImageMatrix *IM_in, NodeTiming *timing) const {
 	const ComputationTask *task = exec_node->task;
-	const ImageMatrix *IM_in = IM_map[exec_node->source_task->node_key];
+	const ImageMatrix *IM_out = NULL;
 	assert (IM_in != NULL && "Attempt to execute a FeatureComputationPlan node with a NULL source ImageMatrix");
 
     struct timeval tim;
-    double t1;
-    if( verbosity > 4 ){
+    double t1 = 0, cpu_t1 = 0;
+    if( verbosity > 4 || timing ){
         gettimeofday(&tim, NULL);
         t1=tim.tv_sec+(tim.tv_usec/1000000.0);
     }
+    if (timing) cpu_t1 = thread_cpu_time();
 	if (verbosity > 5) std::cout << "** executing node '" << exec_node->name << "' with " << exec_node->num_dependent_nodes << " total dependents. IM_in=" << IM_in;
 	switch (task->type) {
 		case ComputationTask::ImageTransformTask: {
 			const ImageTransform *IT_task = dynamic_cast<const ImageTransform *>(exec_node->task);
 			assert (IT_task && "Attempt to cast task as a (const ImageTransform *) failed.");
-			// The ImageMatrix cache is keyed by node_key
-			assert (IM_map.find(exec_node->node_key) == IM_map.end() && "Attempt to execute a transform which is already cached.");
 			
-			ImageMatrix *IM_out = new ImageMatrix;
+			ImageMatrix *IM_new = new ImageMatrix;
 			if (verbosity > 5) std::cout << " ImageTransform task '" << IT_task->name << "'" << std::endl;
-			IT_task->execute (*IM_in, *IM_out);
-			IM_map[exec_node->node_key] = IM_out;
+			IT_task->execute (*IM_in, *IM_new);
+			IM_out = IM_new;
+			if (timing) timing->output_bytes = IM_out->data_bytes();
 		} break;
 		
 		case ComputationTask::FeatureAlgorithmTask: {
@@ -238,6 +396,7 @@ void FeatureComputationPlanExecutor::execute_node (const ComputationTaskNode *ex
 			// construct a vector for the result
 			std::vector<double> res_vec = FA_task->execute (*IM_in);
 			for (int idx = 0; idx < FA_task->n_features; idx++) feature_mat[mat_offset+idx] = res_vec[idx];
+			if (timing) timing->output_bytes = FA_task->n_features * sizeof (double);
 		} break;
 		
 		default:
@@ -246,11 +405,21 @@ void FeatureComputationPlanExecutor::execute_node (const ComputationTaskNode *ex
 		break;
 	}
 
-    if( verbosity > 4 ){
+    if( verbosity > 4 || timing ){
         gettimeofday(&tim, NULL);
         double t2=tim.tv_sec+(tim.tv_usec/1000000.0);
-        std::cout << "TIME\t" << exec_node->name << "\t" << (t2 - t1) << std::endl;
+        if (verbosity > 4) std::cout << "TIME\t" << exec_node->name << "\t" << (t2 - t1) << std::endl;
+        if (timing) {
+            timing->node_name = exec_node->name;
+            timing->task_type = task->type;
+            timing->feature_mat_row = current_feature_mat_row;
+            timing->wall_time = t2 - t1;
+            timing->cpu_time = thread_cpu_time() - cpu_t1;
+            timing->width = IM_in->width;
+            timing->height = IM_in->height;
+        }
     }
+	return (IM_out);
 }
 
 // FIXME: this can go into the base class (?) if its not specialized for task types
@@ -259,6 +428,10 @@ void FeatureComputationPlanExecutor::finish_node_execution (const ComputationTas
 	// remove it from executing_nodes
 	ComputationPlanExecutor::finish_node_execution (exec_node);
 
+	// This node is done reading its source's ImageMatrix.  A transform without dependents is never read.
+	if (exec_node->source_task) release_IM (exec_node->source_task);
+	if (exec_node->dependent_tasks.empty()) release_IM (exec_node);
+
 	// N.B.:  The execute_node() method is responsible for storing the execution results
 	make_dependencies_executable (exec_node);
 
@@ -273,13 +446,58 @@ void FeatureComputationPlanExecutor::finish_node_execution (const ComputationTas
 
 
 void FeatureComputationPlanExecutor::run (const ImageMatrix *source_mat, std::vector<double> &feature_mat_in, size_t dest_row) {
+	timings.clear();
+	execute_plan (source_mat, &feature_mat_in[0], dest_row);
+}
+
+void FeatureComputationPlanExecutor::run_to_array (const ImageMatrix *source_mat, double *feature_mat_in, int n_rows, int n_cols, size_t dest_row) {
+	// The matrix comes from the caller (e.g. numpy), so these can't be asserts
+	if (n_cols < 0 || (size_t)n_cols != plan->n_features)
+		throw std::invalid_argument ("run_to_array() called with a matrix that has the wrong number of columns for the plan");
+	if (n_rows < 0 || dest_row >= (size_t)n_rows)
+		throw std::invalid_argument ("run_to_array() called with a destination row outside of the matrix");
+	timings.clear();
+	execute_plan (source_mat, feature_mat_in, dest_row);
+}
+
+int FeatureComputationPlanExecutor::run_rects_to_array (const ImageMatrix *source_mat, int *rects_in, int n_rects, int rect_dims,
+	double *feature_mat_in, int n_rows, int n_cols) {
+	// As in run_to_array(), the arrays come from the caller
+	if (rect_dims != 4)
+		throw std::invalid_argument ("run_rects_to_array() called with rectangles that don't have 4 elements (x, y, width, height)");
+	if (n_cols < 0 || (size_t)n_cols != plan->n_features)
+		throw std::invalid_argument ("run_rects_to_array() called with a matrix that has the wrong number of columns for the plan");
+	if (n_rects > n_rows)
+		throw std::invalid_argument ("run_rects_to_array() called with more rectangles than rows in the matrix");
+	timings.clear();
+
+	ImageMatrix region_mat;
+	size_t max_peak_IM_bytes = 0;
+	int rect_idx;
+	for (rect_idx = 0; rect_idx < n_rects; rect_idx++) {
+		const int *rect = rects_in + (rect_idx * rect_dims);
+		if (rect[0] < 0 || rect[1] < 0 || rect[2] < 1 || rect[3] < 1) break;
+		// N.B.: submatrix() takes inclusive bottom-right corner coordinates
+		if (! region_mat.submatrix (*source_mat, rect[0], rect[1], rect[0] + rect[2] - 1, rect[1] + rect[3] - 1)) break;
+		region_mat.finish();
+		execute_plan (&region_mat, feature_mat_in, rect_idx);
+		if (peak_IM_bytes > max_peak_IM_bytes) max_peak_IM_bytes = peak_IM_bytes;
+	}
+	// region_mat goes out of scope here, so it can't stay in the cache
+	IM_map.erase ("root");
+	peak_IM_bytes = max_peak_IM_bytes;
+	return (rect_idx);
+}
+
+void FeatureComputationPlanExecutor::execute_plan (const ImageMatrix *source_mat, double *feature_mat_in, size_t dest_row) {
 
 	reset();
 
-	feature_mat = &feature_mat_in[0];
+	feature_mat = feature_mat_in;
 	current_feature_mat_row = dest_row;
+	set_node_costs (source_mat);
 	// put the source_mat into the cache
-	IM_map["root"] = source_mat;
+	cache_IM (plan->root, source_mat);
 
 	finish_node_execution(plan->root);
 
@@ -294,9 +512,20 @@ void FeatureComputationPlanExecutor::run (const ImageMatrix *source_mat, std::ve
 	if (verbosity > 5) std::cout << "Finished running execution plan '" << plan->name << "'" << std::endl;
 }
 
+void FeatureComputationPlanExecutor::set_node_costs (const ImageMatrix *source_mat) {
+	if (source_mat->width == costs_width && source_mat->height == costs_height) return;
+	critical_path_costs.clear();
+	plan->get_critical_path_costs (plan->root, source_mat->width, source_mat->height, critical_path_costs);
+	costs_width = source_mat->width;
+	costs_height = source_mat->height;
+	if (verbosity > 5) std::cout << "Predicted cost of execution plan '" << plan->name << "' on a " << costs_width << "x" << costs_height
+		<< " image: " << plan->predicted_cost (costs_width, costs_height) << " s; critical path: " << critical_path_costs[plan->root->node_key] << " s" << std::endl;
+}
+
 void FeatureComputationPlanExecutor::reset () {
-	// The ImageMatrixes in IM_map were all created within the execution, so they must all be deleted.
-	// EXCEPT the root node, which was a parameter to run().
+	// Intermediate ImageMatrixes are normally released as soon as their last dependent finishes,
+	// so anything left here is from an incomplete run.  They were all created within the execution,
+	// so they must all be deleted, EXCEPT the root node, which was a parameter to run().
 	// The root node must be called 'root'
 	IM_map.erase ("root");
 	IM_map_t::iterator IM_map_it;
@@ -305,11 +534,142 @@ void FeatureComputationPlanExecutor::reset () {
 		delete (IM_map_it->second);
 	}
 	IM_map.clear();
+	IM_readers.clear();
+	// Only left over if a node threw
+	executable_nodes.clear();
+	executing_nodes.clear();
+	IM_bytes = peak_IM_bytes = 0;
 	feature_mat = NULL;
 	current_feature_mat_row = size_t(-1);
 	// note that the plan stays.
 }
 
+
+FeatureComputationPlanConcurrentExecutor::FeatureComputationPlanConcurrentExecutor (const FeatureComputationPlan *plan_in, size_t n_threads_in)
+	: FeatureComputationPlanExecutor (plan_in) {
+	n_threads = n_threads_in;
+	if (! n_threads) {
+		long n_cpus = sysconf (_SC_NPROCESSORS_ONLN);
+		n_threads = n_cpus > 0 ? n_cpus : 1;
+	}
+	worker_error = no_worker_error;
+	pthread_mutex_init (&state_mutex, NULL);
+	pthread_cond_init (&state_changed, NULL);
+}
+
+FeatureComputationPlanConcurrentExecutor::~FeatureComputationPlanConcurrentExecutor () {
+	pthread_cond_destroy (&state_changed);
+	pthread_mutex_destroy (&state_mutex);
+}
+
+void *FeatureComputationPlanConcurrentExecutor::worker_thread (void *executor) {
+	static_cast<FeatureComputationPlanConcurrentExecutor *>(executor)->work();
+	return (NULL);
+}
+
+void FeatureComputationPlanConcurrentExecutor::work () {
+	const ComputationTaskNode *exec_node;
+	const ImageMatrix *IM_in, *IM_out;
+	NodeTiming timing;
+
+	pthread_mutex_lock (&state_mutex);
+	while (true) {
+		// Nothing to do until executing nodes make more nodes executable.
+		// When nothing is executable or executing, the plan is done.
+		// After an error, nothing new is started.
+		while (executable_nodes.empty() && ! executing_nodes.empty() && ! worker_error)
+			pthread_cond_wait (&state_changed, &state_mutex);
+		if (executable_nodes.empty() || worker_error) break;
+
+		exec_node = get_next_executable_node();
+		ComputationPlanExecutor::execute_node (exec_node);
+		IM_in = IM_map[exec_node->source_task->node_key];
+		pthread_mutex_unlock (&state_mutex);
+
+		// An exception can't be allowed to leave the thread: that would terminate the process.
+		worker_error_t error = no_worker_error;
+		std::string what;
+		IM_out = NULL;
+		try {
+			IM_out = compute_node (exec_node, IM_in, record_timings ? &timing : NULL);
+		} catch (const std::bad_alloc &) {
+			error = worker_bad_alloc;
+		} catch (const std::invalid_argument &e) {
+			error = worker_invalid_argument;
+			what = e.what();
+		} catch (const std::exception &e) {
+			error = worker_runtime_error;
+			what = e.what();
+		} catch (...) {
+			error = worker_runtime_error;
+			what = "Unknown exception while computing '" + exec_node->name + "'";
+		}
+
+		pthread_mutex_lock (&state_mutex);
+		if (error) {
+			if (! worker_error) {
+				worker_error = error;
+				worker_error_what = what;
+			}
+			// Its dependents never become executable
+			ComputationPlanExecutor::finish_node_execution (exec_node);
+		} else {
+			if (IM_out) cache_IM (exec_node, IM_out);
+			if (record_timings) timings.push_back (timing);
+			finish_node_execution (exec_node);
+		}
+		pthread_cond_broadcast (&state_changed);
+	}
+	pthread_mutex_unlock (&state_mutex);
+}
+
+void FeatureComputationPlanConcurrentExecutor::execute_plan (const ImageMatrix *source_mat, double *feature_mat_in, size_t dest_row) {
+	// A single thread might as well use the memory-saving order
+	critical_path_first = (n_threads > 1);
+	if (n_threads < 2) {
+		FeatureComputationPlanExecutor::execute_plan (source_mat, feature_mat_in, dest_row);
+		return;
+	}
+
+	reset();
+
+	feature_mat = feature_mat_in;
+	current_feature_mat_row = dest_row;
+	set_node_costs (source_mat);
+	// put the source_mat into the cache
+	cache_IM (plan->root, source_mat);
+
+	finish_node_execution(plan->root);
+	worker_error = no_worker_error;
+
+	// This thread is a worker too.
+	// If threads can't be created, the ones that were (if any) do the work.
+	std::vector<pthread_t> threads (n_threads - 1);
+	size_t n_started;
+	for (n_started = 0; n_started < threads.size(); n_started++)
+		if (pthread_create (&threads[n_started], NULL, worker_thread, this)) break;
+	if (verbosity > 5) std::cout << "Running execution plan '" << plan->name << "' with " << n_started + 1 << " threads" << std::endl;
+
+	work();
+	for (size_t i = 0; i < n_started; i++)
+		pthread_join (threads[i], NULL);
+
+	if (worker_error) {
+		worker_error_t error = worker_error;
+		std::string what = worker_error_what;
+		worker_error = no_worker_error;
+		worker_error_what.clear();
+		// Free the intermediates now rather than at the next run
+		reset();
+		if (error == worker_bad_alloc) throw std::bad_alloc();
+		if (error == worker_invalid_argument) throw std::invalid_argument (what);
+		throw std::runtime_error (what);
+	}
+
+	// The caches get cleaned up in reset() above, or in the destructor
+	if (verbosity > 5) std::cout << "Finished running execution plan '" << plan->name << "'" << std::endl;
+}
+
 const FeatureComputationPlan *StdFeatureComputationPlans::getFeatureSet () {
 	static FeatureComputationPlan *the_plan = new FeatureComputationPlan ("Standard Feature Set");
 	if ( the_plan->isFinalized() ) return the_plan;
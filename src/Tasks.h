@@ -29,6 +29,7 @@
 #define __TASKS_H_
 
 #include <assert.h>
+#include <pthread.h>
 #include <vector>
 #include <string>
 // defines OUR_UNORDERED_MAP based on what's available
@@ -51,6 +52,10 @@ class ComputationTask {
 		};
 		std::string name;
 		TaskType type;
+		// Calibrated run-time: the seconds to process a 1 megapixel image,
+		// and the power of the number of megapixels the run-time scales with (see task_costs in Tasks.cpp)
+		double secs_per_Mpx;
+		double cost_exponent;
 
 		virtual ~ComputationTask() {};
 		virtual bool register_task() const = 0;
@@ -58,9 +63,12 @@ class ComputationTask {
 		virtual void print_info() const;
 		static const char *typeLabels (size_t type_idx);
 		const char *typeLabel () const {return (typeLabels(type));}
+		// Estimated seconds to run this task on a width x height image
+		double cost_estimate (unsigned int width, unsigned int height) const;
 	// Protected so inherited classes can still call the parent constructor
 	protected:
-		ComputationTask (const std::string &s, TaskType t) { name = s; type = t;}
+		ComputationTask (const std::string &s, TaskType t) { name = s; type = t; init_cost(); }
+		void init_cost ();
 	private:
         ComputationTask(ComputationTask const&);              // Don't Implement
         void operator=(ComputationTask const&); // Don't implement
@@ -169,6 +177,20 @@ class ComputationPlan {
 		}
 		bool isFinalized() { return isFinal; }
 
+		// Cost estimates (in seconds) for running the plan on a width x height image, based on the task calibrations.
+		// Transforms are assumed to return an image the same size as their input.
+		// predicted_cost() is the total for a serial run
+		double predicted_cost (unsigned int width, unsigned int height) const;
+		// critical_path_cost() is the most expensive chain of dependent nodes, so the least a concurrent run can take
+		double critical_path_cost (unsigned int width, unsigned int height) const;
+		// predicted_peak_bytes() is an upper bound on the pixel memory held by an executor running the plan
+		// (see FeatureComputationPlanExecutor::peak_IM_bytes): the input plus every transform's output.
+		size_t predicted_peak_bytes (unsigned int width, unsigned int height) const;
+		// Fills node_costs with the critical path cost of node and all of its dependents (keyed by node_key):
+		// the node's own cost plus the largest critical path cost of its dependents.
+		typedef OUR_UNORDERED_MAP<std::string, double> node_costs_t;
+		double get_critical_path_costs (const ComputationTaskNode *node, unsigned int width, unsigned int height, node_costs_t &node_costs) const;
+
 		ComputationPlan (const std::string &name_in) {
 			name = name_in;
 			// the root isn't in the maps - this is its one reference.
@@ -215,6 +237,9 @@ class ComputationPlanExecutor {
 		const ComputationPlan *plan;
 		
 		const ComputationTaskNode *get_next_executable_node ();
+		// Ordering of executable_nodes: true if first should be executed after second.
+		// Uses critical_path_costs if they were set, otherwise only the plan's structure.
+		virtual bool compare_nodes (const ComputationTaskNode *first, const ComputationTaskNode *second) const;
 		// Call once per iteration, supplying iteration parameters.
 		// Pure virtual - must have override in inherited class
 		virtual void run () = 0;
@@ -233,6 +258,7 @@ class ComputationPlanExecutor {
 		// N.B.: It is very wrong to end up with an executor with no plan.  Not sure how to best enforce this in C++
 		ComputationPlanExecutor(const ComputationPlan *plan_in) {
 			plan = plan_in;
+			critical_path_first = false;
 		}
 		virtual ~ComputationPlanExecutor () {
 			reset();
@@ -245,6 +271,12 @@ class ComputationPlanExecutor {
 		// The executing_nodes is a map of node pointers keyed on node_key
 		typedef OUR_UNORDERED_MAP<std::string, const ComputationTaskNode *> executing_nodes_t;
 		executing_nodes_t executing_nodes;
+		// Estimated critical path costs of the nodes for the current input (see ComputationPlan::get_critical_path_costs())
+		ComputationPlan::node_costs_t critical_path_costs;
+		// If false (the default), nodes are executed depth-first, so intermediate results can be released early,
+		// using critical path costs to break ties. If true, the node with the most expensive critical path goes
+		// first regardless of depth, which keeps concurrent workers busy at the expense of memory.
+		bool critical_path_first;
 
 		// execute_node in the parent only knows about executing_nodes, so it inserts it into its executing_nodes map
 		// Also, it asserts that this node isn't already in the executing_nodes map
@@ -315,14 +347,46 @@ class FeatureComputationPlan : public ComputationPlan {
 
 };
 
+// Instrumentation record for one node executed by a FeatureComputationPlanExecutor (see record_timings)
+struct NodeTiming {
+	std::string node_name;
+	int task_type;                // ComputationTask::TaskType
+	size_t feature_mat_row;       // the feature matrix row (i.e. sample) being computed
+	double wall_time;             // seconds
+	double cpu_time;              // CPU seconds used by the thread executing the node
+	unsigned int width, height;   // of the node's input ImageMatrix
+	size_t output_bytes;          // allocated for the output: a transformed ImageMatrix or feature values
+};
+
 class FeatureComputationPlanExecutor : public ComputationPlanExecutor {
 	public:
 		const FeatureComputationPlan *plan;
 		double *feature_mat;
 		size_t current_feature_mat_row;
+		// If record_timings is set, a NodeTiming for every executed node is added to timings.
+		// timings is cleared at the start of each call to run(), run_to_array() or run_rects_to_array(),
+		// so after run_rects_to_array() it has the nodes for all of the regions.
+		bool record_timings;
+		std::vector<NodeTiming> timings;
+		// Memory held by cached ImageMatrix pixel planes (including the source image) during the
+		// current run, and its high-water mark.  peak_IM_bytes remains valid after run() returns.
+		size_t IM_bytes;
+		size_t peak_IM_bytes;
 
 		virtual void finish_node_execution (const ComputationTaskNode *exec_node);
 		virtual void run (const ImageMatrix *source_mat, std::vector<double> &feature_mat_in, size_t dest_row);
+		// Same as above, but features are written straight into row dest_row of a caller-owned
+		// row-major n_rows x n_cols matrix (e.g., a numpy array), where n_cols == plan->n_features.
+		// Throws std::invalid_argument if the matrix doesn't fit.
+		virtual void run_to_array (const ImageMatrix *source_mat, double *feature_mat_in, int n_rows, int n_cols, size_t dest_row);
+		// Features for many rectangular regions (ROIs or tiles) of one source image, one region per row of a caller-owned
+		// row-major n_rows x n_cols matrix.  rects_in is a row-major n_rects x rect_dims (== 4) matrix of x, y, width, height
+		// for each region, and region i goes to row i.  The region ImageMatrix is reused from one region to the next,
+		// so it is only re-allocated when the region size changes.
+		// Returns the number of regions computed, which is less than n_rects if a region is outside of source_mat.
+		// Throws std::invalid_argument if the rectangles or the matrix have the wrong shape.
+		virtual int run_rects_to_array (const ImageMatrix *source_mat, int *rects_in, int n_rects, int rect_dims,
+			double *feature_mat_in, int n_rows, int n_cols);
 		// in the parent, the run method signature has no parameters and is pure virtual
 		// this class has to have run parameters, so we override the paren't virtual run() with a noop
 		virtual void run () {}
@@ -334,23 +398,67 @@ class FeatureComputationPlanExecutor : public ComputationPlanExecutor {
 			plan = plan_in;
 			feature_mat = NULL;
 			current_feature_mat_row = size_t(-1);
+			IM_bytes = peak_IM_bytes = 0;
+			costs_width = costs_height = 0;
+			record_timings = false;
 		}
 	protected:
 		// ImageMatrix cache
 		// IM_map keys are node_keys for transform nodes (source->node_key)
 		typedef OUR_UNORDERED_MAP<std::string, const ImageMatrix *> IM_map_t;
 		IM_map_t IM_map;
+		// The number of dependent nodes that haven't finished reading each cached ImageMatrix.
+		// Intermediate transforms are deleted as soon as this goes to 0 rather than in reset().
+		typedef OUR_UNORDERED_MAP<std::string, size_t> IM_readers_t;
+		IM_readers_t IM_readers;
+		void cache_IM (const ComputationTaskNode *node, const ImageMatrix *IM);
+		void release_IM (const ComputationTaskNode *node);
 
 		virtual void execute_node (const ComputationTaskNode *exec_node);
+		// Does the actual work for a node given its input ImageMatrix, without touching any executor state.
+		// Transform nodes return their (new) output ImageMatrix, feature algorithm nodes write their
+		// features to their own columns in feature_mat and return NULL.
+		// If timing is not NULL, it gets filled in for this node.
+		const ImageMatrix *compute_node (const ComputationTaskNode *exec_node, const ImageMatrix *IM_in, NodeTiming *timing = NULL) const;
 		// This resets the object for the next call to run() (run() calls reset)
 		virtual void reset ();
+		// Common to both run() methods: execute the plan with features going to feature_mat_in
+		virtual void execute_plan (const ImageMatrix *source_mat, double *feature_mat_in, size_t dest_row);
+		// Sets critical_path_costs for the size of source_mat, unless they're already set for that size
+		void set_node_costs (const ImageMatrix *source_mat);
+		unsigned int costs_width, costs_height;
+
+};
+
+// Derived from the plan-specific executor, this runs independent nodes of the plan concurrently, e.g. the
+// Fourier, Wavelet, Chebyshev and Edge transforms, and all of the feature algorithms that depend on them.
+// The calling thread and n_threads - 1 worker threads pull the next node off the executable_nodes heap
+// (critical path first), compute it outside of the lock, then make its dependents executable.
+// Each feature algorithm node writes to its own columns of the feature matrix, so those writes aren't locked.
+class FeatureComputationPlanConcurrentExecutor : public FeatureComputationPlanExecutor {
+	public:
+		// Number of threads used per run; 0 in the constructor means one per online CPU
+		size_t n_threads;
 
+		FeatureComputationPlanConcurrentExecutor (const FeatureComputationPlan *plan_in, size_t n_threads_in = 0);
+		virtual ~FeatureComputationPlanConcurrentExecutor ();
+	protected:
+		// state_mutex protects executable_nodes, executing_nodes and IM_map during a run
+		pthread_mutex_t state_mutex;
+		// state_changed is signalled when nodes finish executing
+		pthread_cond_t state_changed;
+		// The first exception thrown by a node in any thread.  The other threads stop starting nodes,
+		// and execute_plan() rethrows it once they have all been joined.  Without C++11's exception_ptr,
+		// only its kind and message are kept.
+		enum worker_error_t { no_worker_error = 0, worker_bad_alloc, worker_invalid_argument, worker_runtime_error };
+		worker_error_t worker_error;
+		std::string worker_error_what;
+
+		virtual void execute_plan (const ImageMatrix *source_mat, double *feature_mat_in, size_t dest_row);
+		// run nodes until there are none executable or executing
+		void work ();
+		static void *worker_thread (void *executor);
 };
-// two options for concurrent executors:  Derive from ConcurrentExecutor, or derive from plan-specific executor.
-// class FeatureComputationPlanConcurrentExecutor : public ConcurrentPlanExecutor
-//   -- and --  class ConcurrentPlanExecutor : public ComputationPlanExecutor
-// -- or --
-// class FeatureCalculationConcurrentExecutor : public FeatureComputationPlanExecutor
 
 class StdFeatureComputationPlans {
 	private:
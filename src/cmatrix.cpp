@@ -30,6 +30,7 @@
 #define DEBUG 0
 
 #include <vector>
+#include <map>
 #include <math.h>
 #include <stdio.h>
 #include "cmatrix.h"
@@ -59,10 +60,12 @@
 #include <sys/stat.h>
 #include <sys/types.h> // for dev_t, ino_t
 #include <fcntl.h>     // for O_RDONLY
+#include <sys/mman.h>  // for munmap
 
 #include <stdlib.h>
 #include <string.h>
 #include <tiffio.h>
+#include <pthread.h>
 
 
 using namespace std;
@@ -341,17 +344,28 @@ void ImageMatrix::remap_clr_plane(HSVcolor *ptr, const unsigned int w, const uns
 	_is_clr_writeable = true;
 }
 
+// Deallocate the pixel plane, or unmap it if it's a shared memory mapping.
+// Leaves the pixel plane empty.
+void ImageMatrix::free_pix_plane () {
+	if (verbosity > 7 && _pix_plane.data()) fprintf (stdout, "deallocating grayscale %p\n",(void *)_pix_plane.data());
+	if (_shm_bytes) munmap (_pix_plane.data(), _shm_bytes);
+	else if (_pix_plane.data()) Eigen::aligned_allocator<double>().deallocate (_pix_plane.data(), _pix_plane.size());
+	_shm_bytes = 0;
+	_shm_name.clear();
+	remap_pix_plane (NULL, 0, 0);
+}
+
 // If the image are changed size, then reallocate.
 // If the image changed color mode, reallocate.
 // Ensure that anything that's reallocated is deallocated first.
 void ImageMatrix::allocate (unsigned int w, unsigned int h) {
 
-	if ((unsigned int) _pix_plane.cols() != w || (unsigned int)_pix_plane.rows() != h) {
+	// Pixels mapped from shared memory are never written to in place.
+	if (_shm_bytes || (unsigned int) _pix_plane.cols() != w || (unsigned int)_pix_plane.rows() != h) {
 		// These throw exceptions, which we don't catch (catch in main?)
 		// FIXME: We could check for shrinkage and simply remap instead of allocating.
-		if (verbosity > 7 && _pix_plane.data()) fprintf (stdout, "deallocating grayscale %p\n",(void *)_pix_plane.data());
 		//std::cout <<  "ImageMatrix::allocate(): deallocating grayscale pix_plane pointer=" << (void *)_pix_plane.data() << std::endl;
-		if (_pix_plane.data()) Eigen::aligned_allocator<double>().deallocate (_pix_plane.data(), _pix_plane.size());
+		free_pix_plane();
 		remap_pix_plane (Eigen::aligned_allocator<double>().allocate (w * h), w, h);
 		if (verbosity > 7 && _pix_plane.data()) fprintf (stdout, "allocated grayscale %p (%d,%d)\n",(void *)_pix_plane.data(), w, h);
 		//std::cout << "ImageMatrix::allocate(): allocated grayscale pix_plane pointer=" << (void *)_pix_plane.data() << " w:" << w << " h:" << h << std::endl;
@@ -498,9 +512,7 @@ int ImageMatrix::submatrix( const ImageMatrix &matrix_IN, const unsigned int x1,
 */
 ImageMatrix::~ImageMatrix() {
 	finish();
-	if (verbosity > 7 && _pix_plane.data()) fprintf (stdout, "deallocating grayscale %p\n",(void *)_pix_plane.data());
-	if (_pix_plane.data()) Eigen::aligned_allocator<double>().deallocate (_pix_plane.data(), _pix_plane.size());
-	remap_pix_plane (NULL, 0, 0);
+	free_pix_plane();
 
 	if (verbosity > 7 && _clr_plane.data()) fprintf (stdout, "deallocating color %p\n",(void *)_clr_plane.data());
 	if (_clr_plane.data()) Eigen::aligned_allocator<HSVcolor>().deallocate (_clr_plane.data(), _clr_plane.size());
@@ -1102,6 +1114,70 @@ void ImageMatrix::histogram(double *bins,unsigned short nbins, bool imhist, cons
 	return;
 }
 
+// Only fftw_execute() and its new-array variants are thread-safe in FFTW; making and destroying plans
+// and using wisdom has to be serialized when features are calculated by a concurrent executor.
+static pthread_mutex_t fftw_planner_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+// FFTW_MEASURE planning can take longer than the transform itself, so fft2() makes one plan per image size
+// and reuses it for every image of that size, in any thread, with fftw_execute_dft_r2c().
+// Guarded by fftw_planner_mutex.
+typedef std::map<std::pair<unsigned int, unsigned int>, fftw_plan> fft2_plans_t;
+static fft2_plans_t fft2_plans;
+
+static fftw_plan get_fft2_plan (unsigned int width, unsigned int height) {
+	fftw_plan p;
+	pthread_mutex_lock (&fftw_planner_mutex);
+	fft2_plans_t::iterator plans_it = fft2_plans.find (std::make_pair (width, height));
+	if (plans_it != fft2_plans.end()) {
+		p = plans_it->second;
+	} else {
+		// Planning with FFTW_MEASURE overwrites the arrays, so use scratch ones.
+		// Arrays from fftw_malloc() all have the alignment the plan needs for new-array execution.
+		double *in = (double*) fftw_malloc(sizeof(double) * width*height);
+		fftw_complex *out = (fftw_complex*) fftw_malloc(sizeof(fftw_complex) * width*height);
+		p = fftw_plan_dft_r2c_2d(width,height,in,out, FFTW_MEASURE); // FFTW_ESTIMATE: deterministic
+		fftw_free(in);
+		fftw_free(out);
+		fft2_plans[std::make_pair (width, height)] = p;
+	}
+	pthread_mutex_unlock (&fftw_planner_mutex);
+	return (p);
+}
+
+void fft_plan_cache_clear () {
+	pthread_mutex_lock (&fftw_planner_mutex);
+	for (fft2_plans_t::iterator plans_it = fft2_plans.begin(); plans_it != fft2_plans.end(); plans_it++)
+		fftw_destroy_plan (plans_it->second);
+	fft2_plans.clear();
+	pthread_mutex_unlock (&fftw_planner_mutex);
+}
+
+size_t fft_plan_cache_size () {
+	pthread_mutex_lock (&fftw_planner_mutex);
+	size_t size = fft2_plans.size();
+	pthread_mutex_unlock (&fftw_planner_mutex);
+	return (size);
+}
+
+bool fft_wisdom_save (const std::string &path) {
+	FILE *wisdom_file = fopen (path.c_str(), "w");
+	if (!wisdom_file) return (false);
+	pthread_mutex_lock (&fftw_planner_mutex);
+	fftw_export_wisdom_to_file (wisdom_file);
+	pthread_mutex_unlock (&fftw_planner_mutex);
+	return (fclose (wisdom_file) == 0);
+}
+
+bool fft_wisdom_load (const std::string &path) {
+	FILE *wisdom_file = fopen (path.c_str(), "r");
+	if (!wisdom_file) return (false);
+	pthread_mutex_lock (&fftw_planner_mutex);
+	int imported = fftw_import_wisdom_from_file (wisdom_file);
+	pthread_mutex_unlock (&fftw_planner_mutex);
+	fclose (wisdom_file);
+	return (imported != 0);
+}
+
 /* fft 2 dimensional transform */
 // http://www.fftw.org/doc/
 double ImageMatrix::fft2 (const ImageMatrix &matrix_IN) {
@@ -1127,14 +1203,14 @@ double ImageMatrix::fft2 (const ImageMatrix &matrix_IN) {
 
     double *in = (double*) fftw_malloc(sizeof(double) * width*height);
  	fftw_complex *out = (fftw_complex*) fftw_malloc(sizeof(fftw_complex) * width*height);
-	p = fftw_plan_dft_r2c_2d(width,height,in,out, FFTW_MEASURE); // FFTW_ESTIMATE: deterministic
+	p = get_fft2_plan (width, height);
 
 	unsigned int x,y;
  	for (x=0;x<width;x++)
  		for (y=0;y<height;y++)
  			in[height*x+y]=in_plane.coeff(y,x);
  
- 	fftw_execute(p);
+ 	fftw_execute_dft_r2c(p, in, out);
 
 	// The resultant image uses the modulus (sqrt(nrm)) of the complex numbers for pixel values
 	unsigned long idx;
@@ -1154,8 +1230,7 @@ double ImageMatrix::fft2 (const ImageMatrix &matrix_IN) {
  		for (x=1;x<width;x++)   // 1 because the first column is already completed
  			out_plane (y,x) = stats.add (out_plane (height - y, width - x));
 
-	// clean up
-	fftw_destroy_plan(p);
+	// clean up (the plan stays in fft2_plans)
 	fftw_free(in);
 	fftw_free(out);
 
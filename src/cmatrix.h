@@ -173,10 +173,17 @@ private:
 	bool _is_clr_writeable;
 	double _median;
 
+	// If the pixel plane is a mapping of a POSIX shared memory object (see cmatrix_shm.cpp),
+	// the size of the mapping, otherwise 0. The name is set only in the process that shared it.
+	size_t _shm_bytes;
+	std::string _shm_name;
+	// deallocate or unmap the pixel plane
+	void free_pix_plane ();
+
 public:
 
 	// N.B.: Re: ctor, see note in implementation
-	ImageMatrix () : _pix_plane (NULL,0,0), _clr_plane (NULL,0,0), downsampled(0),
+	ImageMatrix () : _pix_plane (NULL,0,0), _clr_plane (NULL,0,0), _shm_bytes(0), downsampled(0),
         norm_mean(0), norm_stdev(0) { init(); };
 	virtual ~ImageMatrix();
 
@@ -206,6 +213,8 @@ public:
 
 	const double *data_ptr() const { return _pix_plane.data(); }
 	double *writable_data_ptr() { return _pix_plane.data(); }
+	// memory allocated for the pixel and color planes
+	size_t data_bytes() const { return (_pix_plane.size() * sizeof(double) + _clr_plane.size() * sizeof(HSVcolor)); }
 	inline writeablePixels WriteablePixels() {
 		assert(_is_pix_writeable && "Attempt to write to read-only pixels");
 		has_median = false;
@@ -256,6 +265,19 @@ public:
 	void remap_clr_plane (HSVcolor *ptr, const unsigned int w, const unsigned int h);
 	virtual void allocate (unsigned int w, unsigned int h);
 	void copyFields(const ImageMatrix &copy);
+
+	// Zero-copy transport of grayscale pixel planes to other processes (see cmatrix_shm.cpp).
+	// share_pix_plane() moves the pixels into a new POSIX shared memory object with the given name
+	// (e.g. "/wndcharm-1234-1"), and keeps using them from there.
+	// open_shared_pix_plane() maps a shared pixel plane read-only in place of this one's pixels.
+	// unlink_shared_pix_plane() removes the shared memory object's name, so no more processes can open it;
+	// the process that shared the pixels has to call it before they're reallocated or destroyed.
+	// The memory itself goes away when the last ImageMatrix mapping it is reallocated or destroyed.
+	bool share_pix_plane (const std::string &name);
+	bool open_shared_pix_plane (const std::string &name, const unsigned int w, const unsigned int h);
+	bool unlink_shared_pix_plane ();
+	const std::string &shared_pix_plane_name() const { return _shm_name; }
+	bool is_pix_plane_mapped() const { return _shm_bytes > 0; }
 	void copyData(const ImageMatrix &copy);
 	void copy(const ImageMatrix &copy);
 	int submatrix(const ImageMatrix &matrix_IN,
@@ -338,4 +360,13 @@ private:
 	};
 };
 
+// ImageMatrix::fft2() keeps its FFTW plans, one per image size, for the life of the process.
+// FFTW wisdom (what it learned making plans) can be saved to a file and loaded by other processes,
+// so they don't have to measure plans again. These return false if the file can't be read or written.
+bool fft_wisdom_save (const std::string &path);
+bool fft_wisdom_load (const std::string &path);
+// Destroys the cached plans; don't call while features are being calculated.
+void fft_plan_cache_clear ();
+size_t fft_plan_cache_size ();
+
 #endif
@@ -0,0 +1,100 @@
+/*~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~*/
+/*                                                                               */
+/* Copyright (C) 2016                                                            */
+/*       National Institutes of Health                                           */
+/*                                                                               */
+/*                                                                               */
+/*                                                                               */
+/*    This library is free software; you can redistribute it and/or              */
+/*    modify it under the terms of the GNU Lesser General Public                 */
+/*    License as published by the Free Software Foundation; either               */
+/*    version 2.1 of the License, or (at your option) any later version.         */
+/*                                                                               */
+/*    This library is distributed in the hope that it will be useful,            */
+/*    but WITHOUT ANY WARRANTY; without even the implied warranty of             */
+/*    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU          */
+/*    Lesser General Public License for more details.                            */
+/*                                                                               */
+/*    You should have received a copy of the GNU Lesser General Public           */
+/*    License along with this library; if not, write to the Free Software        */
+/*    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA  */
+/*                                                                               */
+/*~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~*/
+// Zero-copy transport of ImageMatrix pixel planes between processes through POSIX shared memory.
+// These live apart from cmatrix.cpp because shm_open() and shm_unlink() need librt on older
+// Linux systems, and programs that link libchrm statically without using them shouldn't have to.
+#include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include "cmatrix.h"
+
+bool ImageMatrix::share_pix_plane (const std::string &name) {
+	if (! _shm_name.empty()) return (_shm_name == name);
+	// Color planes stay where they are, and only a whole grayscale image can be shared.
+	if (ColorMode != cmGRAY || ! _pix_plane.data()) return false;
+
+	size_t bytes = (size_t)width * height * sizeof (double);
+	int fd = shm_open (name.c_str(), O_RDWR | O_CREAT | O_EXCL, S_IRUSR | S_IWUSR);
+	if (fd < 0) return false;
+	void *shm = MAP_FAILED;
+	// Allocate the pages up front: if /dev/shm is too small, ftruncate() alone succeeds
+	// and the memcpy() below dies with SIGBUS instead of falling back to pickling.
+	// OS X has no posix_fallocate(), nor a size-limited /dev/shm.
+#ifdef __APPLE__
+	if (ftruncate (fd, bytes) == 0)
+#else
+	if (posix_fallocate (fd, 0, bytes) == 0)
+#endif
+		shm = mmap (NULL, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+	close (fd);
+	if (shm == MAP_FAILED) {
+		shm_unlink (name.c_str());
+		return false;
+	}
+	memcpy (shm, _pix_plane.data(), bytes);
+
+	// Keep the stats and whether the pixels can be written across the remap.
+	unsigned int w = width, h = height;
+	bool was_writeable = _is_pix_writeable;
+	Moments2 old_stats = stats;
+	bool old_has_median = has_median;
+	free_pix_plane();
+	remap_pix_plane ((double *)shm, w, h);
+	_shm_bytes = bytes;
+	_shm_name = name;
+	_is_pix_writeable = was_writeable;
+	stats = old_stats;
+	has_median = old_has_median;
+	return true;
+}
+
+bool ImageMatrix::open_shared_pix_plane (const std::string &name, const unsigned int w, const unsigned int h) {
+	size_t bytes = (size_t)w * h * sizeof (double);
+	int fd = shm_open (name.c_str(), O_RDONLY, 0);
+	if (fd < 0) return false;
+	struct stat shm_stat;
+	void *shm = MAP_FAILED;
+	if (fstat (fd, &shm_stat) == 0 && (size_t)shm_stat.st_size == bytes)
+		shm = mmap (NULL, bytes, PROT_READ, MAP_SHARED, fd, 0);
+	close (fd);
+	if (shm == MAP_FAILED) return false;
+
+	free_pix_plane();
+	if (_clr_plane.data()) Eigen::aligned_allocator<HSVcolor>().deallocate (_clr_plane.data(), _clr_plane.size());
+	remap_clr_plane (NULL, 0, 0);
+	ColorMode = cmGRAY;
+	remap_pix_plane ((double *)shm, w, h);
+	_shm_bytes = bytes;
+	// The mapping is read-only
+	WriteablePixelsFinish();
+	return true;
+}
+
+bool ImageMatrix::unlink_shared_pix_plane () {
+	if (_shm_name.empty()) return false;
+	int res = shm_unlink (_shm_name.c_str());
+	_shm_name.clear();
+	return (res == 0);
+}
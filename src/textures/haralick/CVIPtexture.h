@@ -49,4 +49,9 @@ typedef struct  {
 TEXTURE * Extract_Texture_Features(int distance, int angle,
 		 		register u_int8_t **grays, unsigned int nrows, unsigned int ncols);
 
+/* eigenvalues of a non-symmetric matrix, for the maximal correlation coefficient (1-based arrays) */
+void mkbalanced (double **a, int n);
+void reduction (double **a, int n);
+int hessenberg (double **a, int n, double wr[], double wi[]);
+
 #endif
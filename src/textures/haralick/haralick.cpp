@@ -1,15 +1,123 @@
 //---------------------------------------------------------------------------
 
 #include <stdlib.h>
+#include <math.h>
+#include <pthread.h>
+#include <vector>
 #include "haralick.h"
 #include "CVIPtexture.h"
 
+// the same as in CVIPtexture.cpp (cmatrix.h has its own EPSILON)
+#define LOG_EPSILON 0.000000001
+#define PGM_MAXMAXVAL 255
+
+//---------------------------------------------------------------------------
+// Adds the features for one direction to the sums, minima and maxima over the 4 directions
+static void accumulate_texture (const TEXTURE *features, double *min, double *max, double *sum) {
+	/*  (1) Angular Second Moment */
+	sum[0] += features->ASM;
+	if (features->ASM < min[0]) min[0] = features->ASM;
+	if (features->ASM > max[0]) max[0] = features->ASM;
+	/*  (2) Contrast */
+	sum[1] += features->contrast;
+	if (features->contrast < min[1]) min[1] = features->contrast;
+	if (features->contrast > max[1]) max[1] = features->contrast;
+	/*  (3) Correlation */
+	sum[2] += features->correlation;
+	if (features->correlation < min[2]) min[2] = features->correlation;
+	if (features->correlation > max[2]) max[2] = features->correlation;
+	/*  (4) Variance */
+	sum[3] += features->variance;
+	if (features->variance < min[3]) min[3] = features->variance;
+	if (features->variance > max[3]) max[3] = features->variance;
+	/*  (5) Inverse Diffenence Moment */
+	sum[4] += features->IDM;
+	if (features->IDM < min[4]) min[4] = features->IDM;
+	if (features->IDM > max[4]) max[4] = features->IDM;
+	/*  (6) Sum Average */
+	sum[5] += features->sum_avg;
+	if (features->sum_avg < min[5]) min[5] = features->sum_avg;
+	if (features->sum_avg > max[5]) max[5] = features->sum_avg;
+	/*  (7) Sum Variance */
+	sum[6] += features->sum_var;
+	if (features->sum_var < min[6]) min[6] = features->sum_var;
+	if (features->sum_var > max[6]) max[6] = features->sum_var;
+	/*  (8) Sum Entropy */
+	sum[7] += features->sum_entropy;
+	if (features->sum_entropy < min[7]) min[7] = features->sum_entropy;
+	if (features->sum_entropy > max[7]) max[7] = features->sum_entropy;
+	/*  (9) Entropy */
+	sum[8] += features->entropy;
+	if (features->entropy < min[8]) min[8] = features->entropy;
+	if (features->entropy > max[8]) max[8] = features->entropy;
+	/* (10) Difference Variance */
+	sum[9] += features->diff_var;
+	if (features->diff_var < min[9]) min[9] = features->diff_var;
+	if (features->diff_var > max[9]) max[9] = features->diff_var;
+	/* (11) Diffenence Entropy */
+	sum[10] += features->diff_entropy;
+	if (features->diff_entropy < min[10]) min[10] = features->diff_entropy;
+	if (features->diff_entropy > max[10]) max[10] = features->diff_entropy;
+	/* (12) Measure of Correlation 1 */
+	sum[11] += features->meas_corr1;
+	if (features->meas_corr1 < min[11]) min[11] = features->meas_corr1;
+	if (features->meas_corr1 > max[11]) max[11] = features->meas_corr1;
+	/* (13) Measure of Correlation 2 */
+	sum[12] += features->meas_corr2;
+	if (features->meas_corr2 < min[12]) min[12] = features->meas_corr2;
+	if (features->meas_corr2 > max[12]) max[12] = features->meas_corr2;
+	/* (14) Maximal Correlation Coefficient */
+	sum[13] += features->max_corr_coef;
+	if (features->max_corr_coef < min[13]) min[13] = features->max_corr_coef;
+	if (features->max_corr_coef > max[13]) max[13] = features->max_corr_coef;
+}
+
+// Copies the averages and ranges over the 4 directions to the output vector in the right output order
+static void haralick_output (const double *min, const double *max, const double *sum, double *out) {
+	unsigned int a;
+	double temp[28];
+	for (a = 0; a < 14; a++) {
+		temp[a] = sum[a]/4;
+		temp[a+14] = max[a]-min[a];
+	}
+
+	out[ 0] = temp[ 0];
+	out[ 1] = temp[14];
+	out[ 2] = temp[ 1];
+	out[ 3] = temp[15];
+	out[ 4] = temp[ 2];
+	out[ 5] = temp[16];
+	out[ 6] = temp[ 9];
+	out[ 7] = temp[23];
+	out[ 8] = temp[10];
+	out[ 9] = temp[24];
+	out[10] = temp[ 8];
+	out[11] = temp[22];
+	out[12] = temp[11];
+	out[13] = temp[25];
+	out[14] = temp[ 4];
+	out[15] = temp[18];
+	out[16] = temp[13];
+	out[17] = temp[27];
+	out[18] = temp[12];
+	out[19] = temp[26];
+	out[20] = temp[ 5];
+	out[21] = temp[19];
+	out[22] = temp[ 7];
+	out[23] = temp[21];
+	out[24] = temp[ 6];
+	out[25] = temp[20];
+	out[26] = temp[ 3];
+	out[27] = temp[17];
+}
+
 //---------------------------------------------------------------------------
 /* haralick
    output -array of double- a pre-allocated array of 28 doubles
+   The original implementation, which calls Extract_Texture_Features() for each direction.
 */
 
-void haralick2D(const ImageMatrix &Im, double distance, double *out) {
+void haralick2D_OLD(const ImageMatrix &Im, double distance, double *out) {
 	unsigned int a,x,y;
 	unsigned char **p_gray;
 	TEXTURE *features;
@@ -43,62 +151,7 @@ void haralick2D(const ImageMatrix &Im, double distance, double *out) {
 	}
 	for (angle = 0; angle <= 135; angle = angle+45) {
 		features = Extract_Texture_Features((int)distance, angle, p_gray, Im.height,Im.width);
-		/*  (1) Angular Second Moment */
-		sum[0] += features->ASM;
-		if (features->ASM < min[0]) min[0] = features->ASM;
-		if (features->ASM > max[0]) max[0] = features->ASM;
-		/*  (2) Contrast */
-		sum[1] += features->contrast;
-		if (features->contrast < min[1]) min[1] = features->contrast;
-		if (features->contrast > max[1]) max[1] = features->contrast;
-		/*  (3) Correlation */
-		sum[2] += features->correlation;
-		if (features->correlation < min[2]) min[2] = features->correlation;
-		if (features->correlation > max[2]) max[2] = features->correlation;
-		/*  (4) Variance */
-		sum[3] += features->variance;
-		if (features->variance < min[3]) min[3] = features->variance;
-		if (features->variance > max[3]) max[3] = features->variance;
-		/*  (5) Inverse Diffenence Moment */
-		sum[4] += features->IDM;
-		if (features->IDM < min[4]) min[4] = features->IDM;
-		if (features->IDM > max[4]) max[4] = features->IDM;
-		/*  (6) Sum Average */
-		sum[5] += features->sum_avg;
-		if (features->sum_avg < min[5]) min[5] = features->sum_avg;
-		if (features->sum_avg > max[5]) max[5] = features->sum_avg;
-		/*  (7) Sum Variance */
-		sum[6] += features->sum_var;
-		if (features->sum_var < min[6]) min[6] = features->sum_var;
-		if (features->sum_var > max[6]) max[6] = features->sum_var;
-		/*  (8) Sum Entropy */
-		sum[7] += features->sum_entropy;
-		if (features->sum_entropy < min[7]) min[7] = features->sum_entropy;
-		if (features->sum_entropy > max[7]) max[7] = features->sum_entropy;
-		/*  (9) Entropy */
-		sum[8] += features->entropy;
-		if (features->entropy < min[8]) min[8] = features->entropy;
-		if (features->entropy > max[8]) max[8] = features->entropy;
-		/* (10) Difference Variance */
-		sum[9] += features->diff_var;
-		if (features->diff_var < min[9]) min[9] = features->diff_var;
-		if (features->diff_var > max[9]) max[9] = features->diff_var;
-		/* (11) Diffenence Entropy */
-		sum[10] += features->diff_entropy;
-		if (features->diff_entropy < min[10]) min[10] = features->diff_entropy;
-		if (features->diff_entropy > max[10]) max[10] = features->diff_entropy;
-		/* (12) Measure of Correlation 1 */
-		sum[11] += features->meas_corr1;
-		if (features->meas_corr1 < min[11]) min[11] = features->meas_corr1;
-		if (features->meas_corr1 > max[11]) max[11] = features->meas_corr1;
-		/* (13) Measure of Correlation 2 */
-		sum[12] += features->meas_corr2;
-		if (features->meas_corr2 < min[12]) min[12] = features->meas_corr2;
-		if (features->meas_corr2 > max[12]) max[12] = features->meas_corr2;
-		/* (14) Maximal Correlation Coefficient */
-		sum[13] += features->max_corr_coef;
-		if (features->max_corr_coef < min[13]) min[13] = features->max_corr_coef;
-		if (features->max_corr_coef > max[13]) max[13] = features->max_corr_coef;
+		accumulate_texture (features, min, max, sum);
 		free(features);
 	}
 
@@ -106,39 +159,291 @@ void haralick2D(const ImageMatrix &Im, double distance, double *out) {
 		delete [] p_gray[y];
 	delete [] p_gray;
 
-	/* copy the values to the output vector in the right output order */
-	double temp[28];
+	haralick_output (min, max, sum, out);
+}
+
+//---------------------------------------------------------------------------
+/* haralick2D() calculates the same features as haralick2D_OLD(), but:
+   - the gray tones are found once per image, not once per direction
+   - the co-occurrence matrices for all 4 directions are counted in one pass over the pixels
+   - the 14 statistics share the marginal probabilities they have in common, and only visit
+     the non-zero cells of the (usually sparse) co-occurrence matrices where that's all that matters
+   - all the memory is in a per-thread workspace that's reused from call to call
+   Each statistic adds up its terms in the same order as the f*() functions in CVIPtexture.cpp,
+   leaving out only terms that are zero, so the features don't change.
+*/
+
+// Reused by every call to haralick2D() in a thread
+struct haralick_workspace {
+	std::vector<unsigned char> grays;   // the quantized image, row-major
+	std::vector<unsigned int> counts;   // co-occurrence counts: 4 directions of Ng x Ng
+	std::vector<double> P;              // the normalized co-occurrence matrix for one direction, Ng x Ng
+	std::vector<int> nz_cells;          // indexes of the non-zero cells of P, in row-major order
+	std::vector<int> nz_row_start;      // where each row of P starts in nz_cells
+	std::vector<double> px, py;         // marginal probabilities
+	std::vector<double> Pxpy, Pxmy;     // probabilities of x+y and |x-y|
+	std::vector<double> Q_data, x, iy;  // for the maximal correlation coefficient (1-based arrays)
+	std::vector<double *> Q;
+};
+
+static pthread_key_t haralick_workspace_key;
+static pthread_once_t haralick_workspace_once = PTHREAD_ONCE_INIT;
+
+static void delete_haralick_workspace (void *workspace) {
+	delete ((haralick_workspace *) workspace);
+}
+
+static void init_haralick_workspace_key () {
+	pthread_key_create (&haralick_workspace_key, delete_haralick_workspace);
+}
+
+static haralick_workspace &get_haralick_workspace () {
+	pthread_once (&haralick_workspace_once, init_haralick_workspace_key);
+	haralick_workspace *workspace = (haralick_workspace *) pthread_getspecific (haralick_workspace_key);
+	if (!workspace) {
+		workspace = new haralick_workspace;
+		pthread_setspecific (haralick_workspace_key, workspace);
+	}
+	return (*workspace);
+}
+
+// Haralick's 14 statistics of the normalized co-occurrence matrix ws.P with Ng gray tones.
+static void texture_statistics (haralick_workspace &ws, int Ng, TEXTURE *texture) {
+	int i, j, k, n, cell;
+	size_t c, n_nz;
+	double p;
+	const double *P = &ws.P[0];
+
+	ws.nz_cells.clear();
+	ws.nz_row_start.assign (Ng+1, 0);
+	for (i = 0; i < Ng; ++i) {
+		ws.nz_row_start[i] = ws.nz_cells.size();
+		for (cell = i*Ng; cell < (i+1)*Ng; ++cell)
+			if (P[cell] != 0) ws.nz_cells.push_back (cell);
+	}
+	ws.nz_row_start[Ng] = ws.nz_cells.size();
+	n_nz = ws.nz_cells.size();
+	const int *nz = n_nz ? &ws.nz_cells[0] : NULL;
+
+	// Marginal probabilities
+	ws.px.assign (Ng, 0);
+	ws.py.assign (Ng, 0);
+	ws.Pxpy.assign (2*Ng, 0);
+	ws.Pxmy.assign (Ng, 0);
+	double *px = &ws.px[0], *py = &ws.py[0], *Pxpy = &ws.Pxpy[0], *Pxmy = &ws.Pxmy[0];
+	for (c = 0; c < n_nz; ++c) {
+		i = nz[c] / Ng;
+		j = nz[c] % Ng;
+		p = P[nz[c]];
+		px[i] += p;
+		py[j] += p;
+		Pxpy[i + j] += p;
+		Pxmy[abs (i - j)] += p;
+	}
+
+	/*  (1) Angular Second Moment */
+	double ASM = 0;
+	for (c = 0; c < n_nz; ++c)
+		ASM += P[nz[c]] * P[nz[c]];
+	texture->ASM = ASM;
+
+	/*  (2) Contrast */
+	double contrast = 0;
+	for (n = 0; n < Ng; ++n)
+		contrast += n * n * Pxmy[n];
+	texture->contrast = contrast;
+
+	/*  (3) Correlation */
+	double meanx = 0, sum_sqrx = 0, stddevx, tmp = 0;
+	for (i = 0; i < Ng; ++i) {
+		meanx += px[i]*i;
+		sum_sqrx += px[i]*i*i;
+	}
+	stddevx = sqrt (sum_sqrx - (meanx * meanx));
+	for (c = 0; c < n_nz; ++c)
+		tmp += (nz[c] / Ng) * (nz[c] % Ng) * P[nz[c]];
+	if (stddevx * stddevx == 0) texture->correlation = 1;
+	else texture->correlation = (tmp - meanx * meanx) / (stddevx * stddevx);
+
+	/*  (4) Variance */
+	double mean = 0, var = 0;
+	for (c = 0; c < n_nz; ++c)
+		mean += (nz[c] / Ng) * P[nz[c]];
+	for (c = 0; c < n_nz; ++c) {
+		i = nz[c] / Ng;
+		var += (i - mean) * (i - mean) * P[nz[c]];
+	}
+	texture->variance = var;
+
+	/*  (5) Inverse Diffenence Moment */
+	double IDM = 0;
+	for (c = 0; c < n_nz; ++c) {
+		i = nz[c] / Ng;
+		j = nz[c] % Ng;
+		IDM += P[nz[c]] / (1 + (i - j) * (i - j));
+	}
+	texture->IDM = IDM;
+
+	/*  (6) Sum Average */
+	double sum_avg = 0;
+	for (i = 0; i <= (2 * Ng - 2); ++i)
+		sum_avg += i * Pxpy[i];
+	texture->sum_avg = sum_avg;
+
+	/*  (8) Sum Entropy */
+	double sum_entropy = 0;
+	for (i = 0; i <= (2 * Ng - 2); ++i)
+		sum_entropy -= Pxpy[i] * log10 (Pxpy[i] + LOG_EPSILON)/log10(2.0) ;
+	texture->sum_entropy = sum_entropy;
+
+	/*  (7) Sum Variance (of the sum entropy rather than the sum average, as it always has been) */
+	double sum_var = 0;
+	for (i = 0; i <= (2 * Ng - 2); ++i)
+		sum_var += (i - sum_entropy) * (i - sum_entropy) * Pxpy[i];
+	texture->sum_var = sum_var;
+
+	/*  (9) Entropy */
+	double entropy = 0;
+	for (c = 0; c < n_nz; ++c)
+		entropy += P[nz[c]] * log10 (P[nz[c]] + LOG_EPSILON)/log10(2.0) ;
+	texture->entropy = -entropy;
+
+	/* (10) Difference Variance */
+	double diff_sum = 0, diff_sum_sqr = 0;
+	for (i = 0; i < Ng; ++i) {
+		diff_sum += i * Pxmy[i] ;
+		diff_sum_sqr += i * i * Pxmy[i] ;
+	}
+	texture->diff_var = diff_sum_sqr - diff_sum*diff_sum;
+
+	/* (11) Diffenence Entropy */
+	double diff_entropy = 0;
+	for (i = 0; i < Ng; ++i)
+		diff_entropy += Pxmy[i] * log10 (Pxmy[i] + LOG_EPSILON)/log10(2.0) ;
+	texture->diff_entropy = -diff_entropy;
+
+	/* (12) and (13) Information Measures of Correlation */
+	// hxy, the entropy of P, is the same as (9), with the same rounding.
+	double hx = 0, hy = 0, hxy = -entropy, hxy1 = 0, hxy2 = 0;
+	for (c = 0; c < n_nz; ++c) {
+		i = nz[c] / Ng;
+		j = nz[c] % Ng;
+		hxy1 -= P[nz[c]] * log10 (px[i] * py[j] + LOG_EPSILON)/log10(2.0);
+	}
+	for (i = 0; i < Ng; ++i) {
+		if (px[i] == 0) continue;
+		for (j = 0; j < Ng; ++j) {
+			if (py[j] == 0) continue;
+			hxy2 -= px[i] * py[j] * log10 (px[i] * py[j] + LOG_EPSILON)/log10(2.0);
+		}
+	}
+	for (i = 0; i < Ng; ++i) {
+		hx -= px[i] * log10 (px[i] + LOG_EPSILON)/log10(2.0);
+		hy -= py[i] * log10 (py[i] + LOG_EPSILON)/log10(2.0);
+	}
+	if ((hx > hy ? hx : hy) == 0) texture->meas_corr1 = 1;
+	else texture->meas_corr1 = (hxy - hxy1) / (hx > hy ? hx : hy);
+	texture->meas_corr2 = sqrt (fabs (1 - exp (-2.0 * (hxy2 - hxy))));
+
+	/* (14) Maximal Correlation Coefficient */
+	// The Q matrix and the eigenvalue arrays are 1-based for mkbalanced(), reduction() and hessenberg()
+	ws.Q_data.assign ((Ng+2) * (Ng+2), 0);
+	ws.Q.resize (Ng+2);
+	for (i = 0; i < Ng+2; ++i)
+		ws.Q[i] = &ws.Q_data[i * (Ng+2)];
+	ws.x.assign (Ng+1, 0);
+	ws.iy.assign (Ng+1, 0);
+	double **Q = &ws.Q[0];
+	for (i = 0; i < Ng; ++i) {
+		for (j = 0; j < Ng; ++j) {
+			for (c = ws.nz_row_start[i]; c < (size_t)ws.nz_row_start[i+1]; ++c) {
+				k = nz[c] % Ng;
+				if (P[j*Ng + k] != 0)
+					Q[i + 1][j + 1] += P[nz[c]] * P[j*Ng + k] / px[i] / py[k];
+			}
+		}
+	}
+	mkbalanced (Q, Ng);
+	reduction (Q, Ng);
+	texture->max_corr_coef = 0.0;
+	if (hessenberg (Q, Ng, &ws.x[0], &ws.iy[0]) && ws.x[Ng - 1] >= 0)
+		texture->max_corr_coef = sqrt (ws.x[Ng - 1]);
+}
+
+void haralick2D(const ImageMatrix &Im, double distance, double *out) {
+	haralick_workspace &ws = get_haralick_workspace ();
+	int row, col, rows = Im.height, cols = Im.width;
+	int a, d, Ng, g, tone;
+	double min[14],max[14],sum[14];
+	double min_value,max_value;
+	double scale255;
+	readOnlyPixels pix_plane = Im.ReadablePixels();
+
+	if (distance <= 0) distance = 1;
+	d = (int)distance;
+
+	// to keep this method from modifying the const Im, we use GetStats on a local Moments2 object
+	Moments2 local_stats;
+	Im.GetStats (local_stats);
+	min_value = local_stats.min();
+	max_value = local_stats.max();
+
+	ws.grays.resize (rows * cols);
+	unsigned char *grays = &ws.grays[0];
+	scale255 = (255.0/(max_value-min_value));
+	for (row = 0; row < rows; row++)
+		for (col = 0; col < cols; col++)
+			grays[row*cols + col] = (unsigned char)((pix_plane(row,col) - min_value) * scale255);
+
+	// The co-occurrence matrices only have rows and columns for the gray tones in the image
+	int tone_LUT[PGM_MAXMAXVAL+1];
+	for (g = 0; g <= PGM_MAXMAXVAL; g++)
+		tone_LUT[g] = -1;
+	for (row = 0; row < rows*cols; row++)
+		tone_LUT[grays[row]] = 0;
+	for (g = 0, Ng = 0; g <= PGM_MAXMAXVAL; g++)
+		if (tone_LUT[g] != -1) tone_LUT[g] = Ng++;
+
+	// Count co-occurrences of non-zero pixels at distance d for all 4 directions at once:
+	// [0] -> 0 degrees, [1] -> 45 degrees, [2] -> 90 degrees, [3] -> 135 degrees
+	ws.counts.assign (4 * Ng * Ng, 0);
+	unsigned int *counts[4];
+	unsigned int count[4] = {0, 0, 0, 0};
+	for (a = 0; a < 4; a++)
+		counts[a] = &ws.counts[a * Ng * Ng];
+	for (row = 0; row < rows; ++row) {
+		const unsigned char *gray_row = grays + row*cols;
+		const unsigned char *next_row = row + d < rows ? grays + (row + d)*cols : NULL;
+		for (col = 0; col < cols; ++col) {
+			if (gray_row[col] == 0)
+				continue;
+			tone = tone_LUT[gray_row[col]];
+			if (col + d < cols && gray_row[col + d])
+				{ g = tone_LUT[gray_row[col + d]]; counts[0][tone*Ng + g]++; counts[0][g*Ng + tone]++; count[0] += 2; }
+			if (!next_row)
+				continue;
+			if (col - d >= 0 && next_row[col - d])
+				{ g = tone_LUT[next_row[col - d]]; counts[1][tone*Ng + g]++; counts[1][g*Ng + tone]++; count[1] += 2; }
+			if (next_row[col])
+				{ g = tone_LUT[next_row[col]]; counts[2][tone*Ng + g]++; counts[2][g*Ng + tone]++; count[2] += 2; }
+			if (col + d < cols && next_row[col + d])
+				{ g = tone_LUT[next_row[col + d]]; counts[3][tone*Ng + g]++; counts[3][g*Ng + tone]++; count[3] += 2; }
+		}
+	}
+
 	for (a = 0; a < 14; a++) {
-		temp[a] = sum[a]/4;
-		temp[a+14] = max[a]-min[a];
+		min[a] = INF;
+		max[a] = -INF;
+		sum[a] = 0;
+	}
+	TEXTURE features;
+	ws.P.resize (Ng * Ng);
+	for (a = 0; a < 4; a++) {
+		for (g = 0; g < Ng * Ng; g++)
+			ws.P[g] = count[a] ? counts[a][g] / (double) count[a] : 0;
+		texture_statistics (ws, Ng, &features);
+		accumulate_texture (&features, min, max, sum);
 	}
 
-	out[ 0] = temp[ 0];
-	out[ 1] = temp[14];
-	out[ 2] = temp[ 1];
-	out[ 3] = temp[15];
-	out[ 4] = temp[ 2];
-	out[ 5] = temp[16];
-	out[ 6] = temp[ 9];
-	out[ 7] = temp[23];
-	out[ 8] = temp[10];
-	out[ 9] = temp[24];
-	out[10] = temp[ 8];
-	out[11] = temp[22];
-	out[12] = temp[11];
-	out[13] = temp[25];
-	out[14] = temp[ 4];
-	out[15] = temp[18];
-	out[16] = temp[13];
-	out[17] = temp[27];
-	out[18] = temp[12];
-	out[19] = temp[26];
-	out[20] = temp[ 5];
-	out[21] = temp[19];
-	out[22] = temp[ 7];
-	out[23] = temp[21];
-	out[24] = temp[ 6];
-	out[25] = temp[20];
-	out[26] = temp[ 3];
-	out[27] = temp[17];
+	haralick_output (min, max, sum, out);
 }
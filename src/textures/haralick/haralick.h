@@ -7,5 +7,6 @@
 #include "cmatrix.h"
 
 void haralick2D(const ImageMatrix &Im, double distance, double *out);
+void haralick2D_OLD(const ImageMatrix &Im, double distance, double *out);
 
 #endif
@@ -30,6 +30,7 @@
 #include <cfloat> // Has definition of DBL_EPSILON
 #include <assert.h>
 #include <stdio.h>
+#include <pthread.h>
 #include "gsl/specfunc.h"
 
 #include "cmatrix.h"
@@ -49,6 +50,30 @@
 
 //---------------------------------------------------------------------------
 
+// Look-up tables for mb_Znl(), filled in once by init_Znl_LUT().
+// pthread_once() makes it safe for concurrent executors to call mb_Znl() from several threads.
+static double LUT[MAX_LUT];
+static int n_s[MAX_Z], l_s[MAX_Z];
+static pthread_once_t Znl_LUT_once = PTHREAD_ONCE_INIT;
+
+static void init_Znl_LUT () {
+	int n, l, m, theZ = 0, theLUT = 0;
+	for (n = 0; n <= MAX_D; n++) {
+		for (l = 0; l <= n; l++) {
+			if ( (n-l) % 2 == 0 ) {
+				for (m = 0; m <= (n-l)/2; m++) {
+					LUT[theLUT] = pow((double)-1.0,(double)m) * ( (long double) gsl_sf_fact(n-m) / ( (long double)gsl_sf_fact(m) * (long double)gsl_sf_fact((n - 2*m + l) / 2) *
+						(long double)gsl_sf_fact((n - 2*m - l) / 2) ) );
+					theLUT++;
+				}
+				n_s[theZ] = n;
+				l_s[theZ] = l;
+				theZ++;
+			}
+		}
+	}
+}
+
 /* mb_Znl
   Zernike moment generating function.  The moment of degree n and
   angular dependence l for the pixels defined by coordinate vectors
@@ -56,10 +81,6 @@
   length
 */
 void mb_Znl(double *X, double *Y, double *P, int size, double D, double m10_m00, double m01_m00, double R, double psum, double *zvalues, long *output_size) {
-	static double LUT[MAX_LUT];
-	static int n_s[MAX_Z], l_s[MAX_Z];
-	static char init_lut=0;
-
 	double x, y, p ;   /* individual values of X, Y, P */
 	int i,m, theZ, theLUT, numZ=0;
 	int n=0,l=0;
@@ -74,25 +95,7 @@ void mb_Znl(double *X, double *Y, double *P, int size, double D, double m10_m00,
 // Other hard-coded D values should just need changing MAX_D, MAX_Z and MAX_LUT above.
 	assert (D == MAX_D);
 
-	if (!init_lut) {
-		theZ=0;
-		theLUT=0;
-		for (n = 0; n <= MAX_D; n++) {
-			for (l = 0; l <= n; l++) {
-				if ( (n-l) % 2 == 0 ) {
-					for (m = 0; m <= (n-l)/2; m++) {
-						LUT[theLUT] = pow((double)-1.0,(double)m) * ( (long double) gsl_sf_fact(n-m) / ( (long double)gsl_sf_fact(m) * (long double)gsl_sf_fact((n - 2*m + l) / 2) *
-							(long double)gsl_sf_fact((n - 2*m - l) / 2) ) );
-						theLUT++;
-					}
-					n_s[theZ] = n;
-					l_s[theZ] = l;
-					theZ++;
-				}
-			}
-		}
-		init_lut = 1;
-	}
+	pthread_once (&Znl_LUT_once, init_Znl_LUT);
 
 // Get the number of Z values, and clear the sums.
 	for (n = 0; n <= D; n++) {
@@ -204,6 +207,25 @@ void mb_zernike2D_OLD(const ImageMatrix &Im, double D, double R, double *zvalues
   better on average than the previous version, and they produce better classification in problems
   where zernike features are useful.
 */
+// Recurrence coefficients for mb_zernike2D(), filled in once by init_zernike2D_coefficients()
+static double H1[MAX_L][MAX_L];
+static double H2[MAX_L][MAX_L];
+static double H3[MAX_L][MAX_L];
+static pthread_once_t zernike2D_coefficients_once = PTHREAD_ONCE_INIT;
+
+static void init_zernike2D_coefficients () {
+	int n, m;
+	for (n = 0; n < MAX_L; n++) {
+		for (m = 0; m <= n; m++) {
+			if (n != m) {
+				H3[n][m] = -(double)(4.0 * (m+2.0) * (m + 1.0) ) / (double)( (n+m+2.0) * (n - m) ) ;
+				H2[n][m] = ( (double)(H3[n][m] * (n+m+4.0)*(n-m-2.0)) / (double)(4.0 * (m+3.0)) ) + (m+2.0);
+				H1[n][m] = ( (double)((m+4.0)*(m+3.0))/2.0) - ( (m+4.0)*H2[n][m] ) + ( (double)(H3[n][m]*(n+m+6.0)*(n-m-4.0)) / 8.0 );
+			}
+		}
+	}
+}
+
 void mb_zernike2D (const ImageMatrix &Im, double order, double rad, double *zvalues, long *output_size) {
 	int L, N, D;
 
@@ -216,11 +238,6 @@ void mb_zernike2D (const ImageMatrix &Im, double order, double rad, double *zval
 	if (! (rad > 0.0) ) rad = N;
 	D = (int)(rad * 2);
 
-	static double H1[MAX_L][MAX_L];
-	static double H2[MAX_L][MAX_L];
-	static double H3[MAX_L][MAX_L];
-	static char init=1;
-
 	double COST[MAX_L], SINT[MAX_L], R[MAX_L];
 	double Rn, Rnm, Rnm2, Rnnm2, Rnmp2, Rnmp4;
 
@@ -235,6 +252,8 @@ void mb_zernike2D (const ImageMatrix &Im, double order, double rad, double *zval
 	readOnlyPixels I_pix_plane = Im.ReadablePixels();
 
 // compute x/0, y/0 and 0/0 moments to center the unit circle on the centroid
+// N.B.: Because of this, the Zernike basis over the pixel grid is different for every image, even images
+// of the same size, so it can't be precomputed and cached.
 	double moment10 = 0.0, moment00 = 0.0, moment01 = 0.0;
 	double intensity;
 	for (i = 0; i < cols; i++)
@@ -250,32 +269,39 @@ void mb_zernike2D (const ImageMatrix &Im, double order, double rad, double *zval
 			
 
 // Pre-initialization of statics
-	if (init) {
-		for (n = 0; n < MAX_L; n++) {
-			for (m = 0; m <= n; m++) {
-				if (n != m) {
-					H3[n][m] = -(double)(4.0 * (m+2.0) * (m + 1.0) ) / (double)( (n+m+2.0) * (n - m) ) ;
-					H2[n][m] = ( (double)(H3[n][m] * (n+m+4.0)*(n-m-2.0)) / (double)(4.0 * (m+3.0)) ) + (m+2.0);
-					H1[n][m] = ( (double)((m+4.0)*(m+3.0))/2.0) - ( (m+4.0)*H2[n][m] ) + ( (double)(H3[n][m]*(n+m+6.0)*(n-m-4.0)) / 8.0 );
-				}
-			}
-		}
-		init = 0;
-	}
+	pthread_once (&zernike2D_coefficients_once, init_zernike2D_coefficients);
+
+// A blank image has no centroid (0/0).  Every pixel then added NaN to every moment (its f = intensity/sum
+// was 0/0 too), so all of the coefficients were NaN.  Keep that, without looking for the rows inside a
+// circle with a NaN center.
+	bool no_centroid = std::isnan (m10_m00) || std::isnan (m01_m00);
 
 // Zero-out the Zernike moment accumulators
 	for (n = 0; n <= L; n++) {
 		for (m = 0; m <= n; m++) {
-			AR[n][m] = AI[n][m] = 0.0;
+			if (no_centroid) AR[n][m] = AI[n][m] = sum / moment00;
+			else AR[n][m] = AI[n][m] = 0.0;
 		}
 	}
 
 	area = PI * rad * rad;
-	for (i = 0; i < cols; i++) {
+	int j_first, j_last;
+	double half_chord;
+	for (i = 0; i < cols && ! no_centroid; i++) {
 	// In the paper, the center of the unit circle was the center of the image
 	//	x = (double)(2*i+1-N)/(double)D;
 		x = (i+1 - m10_m00) / rad;
-		for (j = 0; j < rows; j++) {
+	// Only visit the rows of this column that can be inside the unit circle.
+	// The bounds have a margin; the r > 1.0 test below still decides.
+		if (fabs (x) > 1.0) continue;
+		half_chord = sqrt (1.0 - x*x) * rad;
+		j_first = (int) floor (m01_m00 - half_chord) - 2;
+		j_last = (int) ceil (m01_m00 + half_chord) + 1;
+		if (j_first < 0) j_first = 0;
+		if (j_last > rows - 1) j_last = rows - 1;
+		for (j = j_first; j <= j_last; j++) {
+		// Black pixels don't contribute anything
+			if (I_pix_plane(j,i) == 0) continue;
 		// In the paper, the center of the unit circle was the center of the image
 		//	y = (double)(2*j+1-N)/(double)D;
 			y = (j+1 - m01_m00) / rad;
@@ -298,26 +324,26 @@ void mb_zernike2D (const ImageMatrix &Im, double order, double rad, double *zval
 		// In the paper, the intensity was the raw image intensity
 			f = I_pix_plane(j,i) / sum;
 
-			Rnmp2 = Rnm2 = 0;
 			for (n = 0; n <= L; n++) {
 			// In the paper, this was divided by the area in pixels
 			// seemed that pi was supposed to be the area of a unit circle.
 				const_t = (n+1) * f/PI;
 				Rn = R[n];
-				if (n >= 2) Rnm2 = R[n-2];
-				for (m = n; m >= 0; m -= 2) {
-					if (m == n) {
-						Rnm = Rn;
-						Rnmp4 = Rn;
-					} else if (m == n-2) {
-						Rnnm2 = n*Rn - (n-1)*Rnm2;
-						Rnm = Rnnm2;
-						Rnmp2 = Rnnm2;
-					} else {
-						Rnm = H1[n][m] * Rnmp4 + ( H2[n][m] + (H3[n][m]/r2) ) * Rnmp2;
-						Rnmp4 = Rnmp2;
-						Rnmp2 = Rnm;
-					}
+			// m == n
+				Rnmp4 = Rn;
+				AR[n][n] += const_t * Rn * COST[n];
+				AI[n][n] -= const_t * Rn * SINT[n];
+				if (n < 2) continue;
+			// m == n-2
+				Rnnm2 = n*Rn - (n-1)*R[n-2];
+				Rnmp2 = Rnnm2;
+				AR[n][n-2] += const_t * Rnnm2 * COST[n-2];
+				AI[n][n-2] -= const_t * Rnnm2 * SINT[n-2];
+			// the rest by recurrence
+				for (m = n-4; m >= 0; m -= 2) {
+					Rnm = H1[n][m] * Rnmp4 + ( H2[n][m] + (H3[n][m]/r2) ) * Rnmp2;
+					Rnmp4 = Rnmp2;
+					Rnmp2 = Rnm;
 					AR[n][m] += const_t * Rnm * COST[m];
 					AI[n][m] -= const_t * Rnm * SINT[m];
 				}
@@ -90,6 +90,95 @@ class TestFeatureSpace( unittest.TestCase ):
         finally:
           rmtree( tempdir )
 
+    # --------------------------------------------------------------------------
+    def test_FitFileRoundTrip( self ):
+        """Read a .fit file, write it back out, and read it in again."""
+
+        from filecmp import cmp
+        fs = FeatureSpace.NewFromFitFile( self.test_fit_path, quiet=True )
+
+        tempdir = mkdtemp()
+        try:
+            path1 = join( tempdir, 'round_trip1.fit' )
+            path2 = join( tempdir, 'round_trip2.fit' )
+            fs.ToFitFile( path1 )
+            fs2 = FeatureSpace.NewFromFitFile( path1, quiet=True )
+            fs2.ToFitFile( path2 )
+            self.assertTrue( cmp( path1, path2, shallow=False ) )
+
+            self.assertEqual( fs.feature_names, fs2.feature_names )
+            self.assertEqual( fs.class_names, fs2.class_names )
+            self.assertEqual( fs.class_sizes, fs2.class_sizes )
+            self.assertEqual( fs._contiguous_sample_names, fs2._contiguous_sample_names )
+            self.assertEqual( fs._contiguous_ground_truth_labels,
+                    fs2._contiguous_ground_truth_labels )
+            np.testing.assert_allclose( fs.data_matrix, fs2.data_matrix, rtol=1e-7 )
+
+            # Version 1 files, which state "1.0" or no version at all, get their
+            # minor version from the number of features
+            path3 = join( tempdir, 'version1.fit' )
+            fs.FeatureReduce( fs.feature_names[ :1025 ], quiet=True ).ToFitFile( path3 )
+            with open( path3 ) as infile:
+                lines = infile.readlines()
+            for header in '2 1.0\n', '2\n':
+                lines[0] = header
+                with open( path3, 'w' ) as outfile:
+                    outfile.writelines( lines )
+                self.assertEqual( FeatureSpace.NewFromFitFile( path3, quiet=True ).feature_set_version,
+                        '1.1' )
+
+            # Truncated sample rows get caught:
+            with open( path1 ) as infile:
+                lines = infile.readlines()
+            lines[-2] = lines[-2].split( ' ', 1 )[1]
+            with open( path1, 'w' ) as outfile:
+                outfile.writelines( lines )
+            self.assertRaises( ValueError, FeatureSpace.NewFromFitFile, path1, quiet=True )
+        finally:
+            rmtree( tempdir )
+
+    # --------------------------------------------------------------------------
+    def test_NewFromImageTiles( self ):
+        """Features for all tiles of an image in one call match those calculated
+        one FeatureVector at a time."""
+
+        img_path = join( pychrm_test_dir, 'test-0032-0008-0008.tif' )
+        fs = FeatureSpace.NewFromImageTiles( img_path, tile_num_rows=2, tile_num_cols=2,
+                ground_truth_label='test' )
+        self.assertEqual( fs.num_samples, 4 )
+        self.assertEqual( fs.num_samples_per_group, 4 )
+
+        # sample sequence order is column-major
+        for ssid, ( col, row ) in enumerate( ( (0,0), (0,1), (1,0), (1,1) ) ):
+            fv = FeatureVector( source_filepath=img_path, tile_num_rows=2, tile_num_cols=2,
+                    tile_row_index=row, tile_col_index=col ).GenerateFeatures( write_to_disk=False )
+            self.assertEqual( fv.feature_names, fs.feature_names )
+            np.testing.assert_array_equal( fv.values, fs.data_matrix[ ssid ] )
+
+        # ROIs, including one outside of the 32x32 image
+        fs = FeatureSpace.NewFromImageTiles( img_path, rects=[ (8, 8, 16, 16) ] )
+        fv = FeatureVector( source_filepath=img_path, x=8, y=8, w=16, h=16 ).GenerateFeatures(
+                write_to_disk=False )
+        np.testing.assert_array_equal( fv.values, fs.data_matrix[0] )
+        self.assertRaises( ValueError, FeatureSpace.NewFromImageTiles, img_path,
+                rects=[ (20, 0, 16, 16) ] )
+
+        # The executor checks the shapes of the arrays it's given, and stops at
+        # the first region outside of the image
+        from wndcharm.FeatureVector import NewFeatureComputationPlanExecutor
+        plan = fv.GetFeatureComputationPlan()
+        px_plane = fv.GetPreprocessedFullPixelPlane()
+        plan_exec = NewFeatureComputationPlanExecutor( plan )
+        rects = np.array( [ (0, 0, 16, 16), (20, 0, 16, 16) ], dtype=np.intc )
+        comp_vals = np.empty( ( 2, plan.n_features ) )
+        self.assertEqual( plan_exec.run_rects_to_array( px_plane, rects, comp_vals ), 1 )
+        self.assertRaises( ValueError, plan_exec.run_rects_to_array, px_plane,
+                rects[ :, :3 ].copy(), comp_vals )
+        self.assertRaises( ValueError, plan_exec.run_rects_to_array, px_plane,
+                rects, np.empty( ( 2, plan.n_features + 1 ) ) )
+        self.assertRaises( ValueError, plan_exec.run_rects_to_array, px_plane,
+                rects, np.empty( ( 1, plan.n_features ) ) )
+
     # --------------------------------------------------------------------------
     #@unittest.skip('')
     def test_DiscreteTrainTestSplitNoTiling( self ):
@@ -44,6 +44,23 @@ from wndcharm.FeatureWeights import FisherFeatureWeights, PearsonFeatureWeights
 from wndcharm.FeatureSpacePrediction import FeatureSpaceClassification, FeatureSpaceRegression
 from wndcharm.FeatureSpacePredictionExperiment import FeatureSpaceClassificationExperiment
 
+def WND5TrainTestSplit( n_samples=400, n_classes=4, num_features_per_signal_type=10,
+        dtype=None ):
+    """Returns train and test FeatureSpaces split from an artificial one, normalized and
+    reduced to the features chosen by the Fisher weights (the third return value)."""
+
+    from wndcharm.ArtificialFeatureSpace import CreateArtificialFeatureSpace_Discrete
+    fs = CreateArtificialFeatureSpace_Discrete( n_samples=n_samples, n_classes=n_classes,
+            num_features_per_signal_type=num_features_per_signal_type, interpolatable=True,
+            random_state=42, singularity=False, clip=False )
+    if dtype is not None:
+        fs = fs.AsType( dtype )
+    train, test = fs.Split( random_state=42, quiet=True )
+    train.Normalize( inplace=True, quiet=True )
+    fw = FisherFeatureWeights.NewFromFeatureSpace( train ).Threshold()
+    train.FeatureReduce( fw, inplace=True, quiet=True )
+    test.FeatureReduce( fw, inplace=True, quiet=True ).Normalize( train, inplace=True, quiet=True )
+    return train, test, fw
 
 class TestFeatureSpaceClassification( unittest.TestCase ):
     """
@@ -205,6 +222,203 @@ class TestFeatureSpaceClassification( unittest.TestCase ):
                     class_name, result.similarity_matrix[ class_name ][ class_name ] )
                 raise
 
-            
+
+    def test_WND5ArrayResults( self ):
+        """Array form of WND5 results agrees with individual results built on demand"""
+
+        train, test, fw = WND5TrainTestSplit()
+
+        result = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True )
+        self.assertIsNone( result._individual_results )
+        self.assertEqual( result.marginal_probabilities.shape, ( test.num_samples, train.num_classes ) )
+
+        from numpy.testing import assert_array_equal, assert_allclose
+        for i, indiv_res in enumerate( result.individual_results ):
+            assert_array_equal( indiv_res.marginal_probabilities, result.marginal_probabilities[i] )
+            self.assertEqual( indiv_res.normalization_factor, result.normalization_factors[i] )
+            self.assertEqual( indiv_res.predicted_label,
+                    train.class_names[ result.predicted_class_indices[i] ] )
+            self.assertEqual( indiv_res.predicted_value, result.predicted_values[i] )
+            self.assertEqual( indiv_res.name, test._contiguous_sample_names[i] )
+
+        # Training set against itself: every sample collides with itself
+        # and must be left out of its own class mean.
+        fit_on_fit = FeatureSpaceClassification.NewWND5( train, train, fw, quiet=True )
+        self.assertTrue( np.all( fit_on_fit.predicted_class_indices >= 0 ) )
+        assert_allclose( fit_on_fit.marginal_probabilities.sum( axis=1 ), 1.0 )
+
+    def test_WND5MemoryBudget( self ):
+        """Blocked WND5 gives the same answers as the whole distance matrix at once"""
+
+        train, test, fw = WND5TrainTestSplit()
+
+        from numpy.testing import assert_array_equal, assert_allclose
+        for test_set in test, train:
+            whole = FeatureSpaceClassification.NewWND5( train, test_set, fw, quiet=True )
+            # Blocks of test samples only; blocks of test samples and whole classes
+            for budget in 100000, 50000:
+                blocked = FeatureSpaceClassification.NewWND5( train, test_set, fw,
+                        quiet=True, memory_budget=budget )
+                assert_array_equal( whole.marginal_probabilities, blocked.marginal_probabilities )
+                assert_array_equal( whole.normalization_factors, blocked.normalization_factors )
+                assert_array_equal( whole.predicted_class_indices, blocked.predicted_class_indices )
+            # Classes themselves get split up
+            blocked = FeatureSpaceClassification.NewWND5( train, test_set, fw,
+                    quiet=True, memory_budget=2000 )
+            assert_allclose( whole.marginal_probabilities, blocked.marginal_probabilities )
+            assert_array_equal( whole.predicted_class_indices, blocked.predicted_class_indices )
+
+    def test_WND5MemoryBudgetBlockSize( self ):
+        """Blocks of the distance matrix and all of their temporaries fit in the budget"""
+
+        import wndcharm.FeatureSpacePrediction as fsp
+
+        # Peak bytes per distance matrix element, counted by hand:
+        # cdist: float64 distances/similarities + bool collision flags
+        # gemm: distances + clamp buffer, both in the features' precision, then
+        #     float32 distances get a float64 copy for the similarities + collision flags
+        elem_bytes = { ( 'cdist', np.float64 ) : 9, ( 'cdist', np.float32 ) : 9,
+                ( 'gemm', np.float64 ) : 16, ( 'gemm', np.float32 ) : 13 }
+
+        block_shapes = []
+        class_similarities = fsp.WND5ClassSimilarities
+        def RecordBlockShape( dist_mat, *args, **kwargs ):
+            block_shapes.append( dist_mat.shape )
+            return class_similarities( dist_mat, *args, **kwargs )
+
+        fsp.WND5ClassSimilarities = RecordBlockShape
+        try:
+            for dtype in np.float64, np.float32:
+                train, test, fw = WND5TrainTestSplit( dtype=dtype )
+                row_bytes = np.dtype( dtype ).itemsize * len( fw.values )
+                for method in 'cdist', 'gemm':
+                    self.assertEqual( fsp.WND5BytesPerElement( method, dtype ),
+                            elem_bytes[ method, dtype ] )
+                    for budget in 100000, 50000, 2000:
+                        del block_shapes[:]
+                        FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True,
+                                memory_budget=budget, distance_method=method )
+                        self.assertTrue( block_shapes )
+                        n_rows, n_cols = max( block_shapes, key=lambda shape: shape[0] * shape[1] )
+                        peak = n_rows * n_cols * elem_bytes[ method, dtype ] + \
+                                ( n_rows + n_cols ) * row_bytes
+                        self.assertLessEqual( peak, budget )
+        finally:
+            fsp.WND5ClassSimilarities = class_similarities
+
+    def test_WND5Model( self ):
+        """Compiled WND5 model agrees with NewWND5"""
+
+        from wndcharm.FeatureSpacePrediction import WND5Model
+        train, test, fw = WND5TrainTestSplit( n_samples=200 )
+
+        result = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True )
+        model = WND5Model( train, fw )
+
+        from numpy.testing import assert_array_equal
+        norm_factors, marg_probs, class_indices = model.Predict( test.data_matrix )
+        assert_array_equal( result.marginal_probabilities, marg_probs )
+        assert_array_equal( result.normalization_factors, norm_factors )
+        assert_array_equal( result.predicted_class_indices, class_indices )
+
+        many = model.PredictMany( test.data_matrix )
+        for i, indiv_res in enumerate( result.individual_results ):
+            one = model.PredictOne( test.data_matrix[i] )
+            for res in one, many[i]:
+                self.assertEqual( indiv_res.predicted_label, res.predicted_label )
+                self.assertEqual( indiv_res.predicted_value, res.predicted_value )
+                assert_array_equal( indiv_res.marginal_probabilities, res.marginal_probabilities )
+
+        self.assertRaises( ValueError, model.PredictOne, test.data_matrix[0][:-1] )
+        self.assertRaises( ValueError, model.PredictMany, test.data_matrix[0] )
+
+    def test_WND5GEMMDistances( self ):
+        """BLAS distance method agrees with cdist"""
+
+        train, test, fw = WND5TrainTestSplit()
+
+        from numpy.testing import assert_array_equal, assert_allclose
+        for test_set in test, train:
+            exact = FeatureSpaceClassification.NewWND5( train, test_set, fw, quiet=True )
+            for budget in None, 2000:
+                gemm = FeatureSpaceClassification.NewWND5( train, test_set, fw, quiet=True,
+                        memory_budget=budget, distance_method='gemm' )
+                assert_allclose( exact.marginal_probabilities, gemm.marginal_probabilities,
+                        rtol=1e-6 )
+                assert_array_equal( exact.predicted_class_indices, gemm.predicted_class_indices )
+
+        # training set norms are cached on the training set for the weights used
+        cached = train._weighted_sq_norms_cache[1]
+        self.assertIs( cached, train.WeightedSquaredNorms( fw.values ) )
+        w_train = train.data_matrix * np.array( fw.values )
+        assert_allclose( cached, ( w_train ** 2 ).sum( axis=1 ) )
+
+        # an exact duplicate of a training sample is a collision
+        dup = train.Derive()
+        gemm = FeatureSpaceClassification.NewWND5( train, dup, fw, quiet=True,
+                distance_method='gemm' )
+        exact = FeatureSpaceClassification.NewWND5( train, dup, fw, quiet=True )
+        assert_allclose( exact.marginal_probabilities, gemm.marginal_probabilities, rtol=1e-6 )
+
+        self.assertRaises( ValueError, FeatureSpaceClassification.NewWND5, train, test, fw,
+                quiet=True, distance_method='euclid' )
+
+    def test_WND5MemoryMappedFeatureSpaces( self ):
+        """Classify memory-mapped feature spaces written with ToBinary()"""
+
+        train, test, fw = WND5TrainTestSplit()
+        result = FeatureSpaceClassification.NewWND5( train, test, fw, quiet=True )
+
+        tempdir = mkdtemp()
+        try:
+            train_path = train.ToBinary( tempdir + sep + 'train.npy', quiet=True )
+            test_path = test.ToBinary( tempdir + sep + 'test.npy', quiet=True )
+            mm_train = FeatureSpace.NewFromBinary( train_path, mmap_mode='r' )
+            mm_test = FeatureSpace.NewFromBinary( test_path, mmap_mode='r' )
+            self.assertIsInstance( mm_train.data_matrix, np.memmap )
+            self.assertEqual( mm_train.class_names, train.class_names )
+            self.assertEqual( mm_test._contiguous_sample_names, test._contiguous_sample_names )
+
+            # normalized_against survives as a name
+            self.assertTrue( mm_test.normalized_against )
+
+            mm_result = FeatureSpaceClassification.NewWND5(
+                    mm_train.FeatureReduce( fw, quiet=True ),
+                    mm_test.FeatureReduce( fw, quiet=True ), fw, quiet=True,
+                    memory_budget=50000 )
+            from numpy.testing import assert_array_equal
+            assert_array_equal( result.marginal_probabilities, mm_result.marginal_probabilities )
+
+            # Copy-on-write mode (the default) allows in-place operations
+            cow = FeatureSpace.NewFromBinary( train_path )
+            cow.data_matrix[:] = 0
+            assert_array_equal( FeatureSpace.NewFromBinary( train_path ).data_matrix,
+                    train.data_matrix )
+            del mm_train, mm_test, cow
+        finally:
+            rmtree( tempdir )
+
+    def test_WND5SinglePrecision( self ):
+        """float32 feature spaces stay float32 and classify like float64 ones"""
+
+        from numpy.testing import assert_allclose, assert_array_equal
+
+        results = {}
+        for dtype in np.float64, np.float32:
+            train, test, fw = WND5TrainTestSplit( n_samples=1000, n_classes=10,
+                    num_features_per_signal_type=30, dtype=dtype )
+            self.assertEqual( train.data_matrix.dtype, dtype )
+            self.assertEqual( test.data_matrix.dtype, dtype )
+            for method in 'cdist', 'gemm':
+                results[ dtype, method ] = FeatureSpaceClassification.NewWND5( train, test, fw,
+                        quiet=True, distance_method=method )
+
+        for method, atol in ( 'cdist', 5e-7 ), ( 'gemm', 2e-5 ):
+            double = results[ np.float64, method ]
+            single = results[ np.float32, method ]
+            assert_allclose( double.marginal_probabilities, single.marginal_probabilities,
+                    rtol=0, atol=atol )
+            assert_array_equal( double.predicted_class_indices, single.predicted_class_indices )
+
 if __name__ == '__main__':
     unittest.main()
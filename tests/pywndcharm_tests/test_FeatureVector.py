@@ -143,11 +143,365 @@ class TestFeatureCalculation( unittest.TestCase ):
                 fv2.LoadSigFile()
 
             fv2.GenerateFeatures()
-            #self.assertEqual( fv1.values[0], fv2.values[0] )
+            self.assertEqual( fv2.values[1], -9999 )
 
+            # The sig file was rewritten with all of the features
+            from os import listdir
+            self.assertEqual( sorted( listdir( tempdir ) ),
+                    sorted( [ img_filename, basename( fv1.auxiliary_feature_storage ) ] ) )
+            fv3 = FeatureVector( **kwargs ).LoadSigFile( quiet=True )
+            self.assertEqual( list( fv3.values ), list( fv2.values ) )
+
+        finally:
+            rmtree( tempdir )
+
+    # --------------------------------------------------------------------------
+    def test_MinimalFeatureComputationPlan( self ):
+        """Reduced feature vectors only compute the feature groups they need"""
+
+        full = FeatureVector.NewFromSigFile( self.sig_file_path, quiet=True )
+        full_plan = full.GetFeatureComputationPlan()
+        self.assertEqual( full_plan.n_features, len( full ) )
+
+        reduced_names = [ 'Zernike Coefficients (Fourier ()) [3]',
+                'Pixel Intensity Statistics () [0]', 'Zernike Coefficients (Fourier ()) [0]' ]
+        reduced = full.FeatureReduce( reduced_names, quiet=True )
+        # The standard feature set version doesn't matter, nor does the full plan
+        # inherited from the sample it was reduced from
+        reduced.feature_set_version = full.feature_set_version
+        reduced_plan = reduced.GetFeatureComputationPlan()
+        self.assertLess( reduced_plan.n_features, full_plan.n_features )
+        self.assertEqual( set( [ reduced_plan.getFeatureNameByIndex(i).rsplit( ' ', 1 )[0] \
+                for i in xrange( reduced_plan.n_features ) ] ),
+                set( [ 'Zernike Coefficients (Fourier ())', 'Pixel Intensity Statistics ()' ] ) )
+
+        # Other samples with the same features share the plan
+        other = FeatureVector( source_filepath=self.test_tif_path, feature_names=list( reduced_names ) )
+        self.assertIs( other.GetFeatureComputationPlan(), reduced_plan )
+
+        # Only a few feature lists are remembered, but their plans still are
+        from wndcharm import FeatureVector as fv_module
+        for i in xrange( fv_module.feature_list_plan_cache_size + 2 ):
+            GenerateFeatureComputationPlan( reduced_names[:1] * ( i + 1 ) )
+        self.assertEqual( len( fv_module.feature_list_plan_cache ),
+                fv_module.feature_list_plan_cache_size )
+        self.assertIs( GenerateFeatureComputationPlan( reduced_names ), reduced_plan )
+
+    # --------------------------------------------------------------------------
+    def test_RunToArrayShape( self ):
+        """Plan executors raise ValueError for a destination matrix that doesn't fit"""
+
+        import numpy as np
+        from wndcharm.FeatureVector import NewFeatureComputationPlanExecutor
+
+        fv = FeatureVector( source_filepath=self.test_tif_path,
+                feature_names=[ 'Pixel Intensity Statistics () [0]' ] )
+        plan = fv.GetFeatureComputationPlan()
+        px_plane = fv.GetPreprocessedLocalPixelPlane()
+        plan_exec = NewFeatureComputationPlanExecutor( plan )
+
+        with self.assertRaises( ValueError ):
+            plan_exec.run_to_array( px_plane, np.empty( ( 1, plan.n_features + 1 ) ), 0 )
+        with self.assertRaises( ValueError ):
+            plan_exec.run_to_array( px_plane, np.empty( ( 1, plan.n_features ) ), 1 )
+
+        comp_vals = np.empty( ( 2, plan.n_features ) )
+        plan_exec.run_to_array( px_plane, comp_vals, 1 )
+        self.assertTrue( np.all( np.isfinite( comp_vals[1] ) ) )
+
+    # --------------------------------------------------------------------------
+    def test_HaralickTextures( self ):
+        """Haralick textures on raw and transformed pixels match the reference sigs"""
+
+        for sig_path in ( self.sig_file_path, join( test_dir, 't1_s01_c05_ij-l_precalculated.sig' ) ):
+            img_path = sig_path.replace( '-l_precalculated.sig', '.tif' )
+            reference_sample = FeatureVector.NewFromSigFile( sig_path, image_path=img_path, quiet=True )
+            haralick_names = [ name for name in reference_sample.feature_names \
+                    if name.startswith( 'Haralick Textures' ) ]
+            reference_sample = reference_sample.FeatureReduce( haralick_names, quiet=True )
+
+            target_sample = FeatureVector( source_filepath=img_path,
+                feature_names=haralick_names ).GenerateFeatures( write_to_disk=False, quiet=True )
+            self.assertEqual( target_sample.feature_names, reference_sample.feature_names )
+            self.assertTrue( compare( target_sample.values, reference_sample.values ) )
+
+    # --------------------------------------------------------------------------
+    def test_ConcurrentExecutor( self ):
+        """Threaded feature computation gives exactly the same values as serial"""
+
+        img_path = join( pychrm_test_dir, 'test-0032-0016-0016.tif' )
+        serial = FeatureVector( source_filepath=img_path, long=True ).GenerateFeatures(
+                write_to_disk=False, quiet=True )
+        for n_threads in 2, 4, True:
+            threaded = FeatureVector( source_filepath=img_path, long=True ).GenerateFeatures(
+                    write_to_disk=False, quiet=True, n_threads=n_threads )
+            self.assertEqual( threaded.feature_names, serial.feature_names )
+            # NaNs compare unequal, so compare the bytes
+            self.assertEqual( threaded.values.tostring(), serial.values.tostring() )
+
+    # --------------------------------------------------------------------------
+    def test_IntermediateRelease( self ):
+        """Transformed images are released as soon as the plan is done with them"""
+
+        from wndcharm.FeatureVector import NewFeatureComputationPlanExecutor, \
+                GenerateFeatureComputationPlan, PlanExecutorTimings
+
+        img_path = join( pychrm_test_dir, 'test-0032-0016-0016.tif' )
+        fv = FeatureVector( source_filepath=img_path, long=True )
+        plan = fv.GetFeatureComputationPlan()
+        px_plane = fv.GetPreprocessedLocalPixelPlane()
+        plan_exec = NewFeatureComputationPlanExecutor( plan )
+        plan_exec.record_timings = True
+        values = np.empty( ( 1, plan.n_features ) )
+        plan_exec.run_to_array( px_plane, values, 0 )
+
+        # Fourier, Wavelet, Chebyshev and their chains never all need to be held at once
+        timings = PlanExecutorTimings( plan_exec )
+        transform_bytes = timings['output_bytes'][ timings['transform'] ]
+        self.assertGreater( len( transform_bytes ), 5 )
+        source_bytes = px_plane.data_bytes()
+        self.assertLess( plan_exec.peak_IM_bytes, source_bytes + transform_bytes.sum() )
+        self.assertGreaterEqual( plan_exec.peak_IM_bytes, source_bytes + transform_bytes.max() )
+
+        # Same values as each feature group computed by itself, sharing no intermediates
+        names = [ plan.getFeatureNameByIndex(i) for i in xrange( plan.n_features ) ]
+        groups = {}
+        for index, name in enumerate( names ):
+            groups.setdefault( name.rsplit( ' ', 1 )[0], [] ).append( index )
+        for indices in groups.itervalues():
+            group_plan = GenerateFeatureComputationPlan( [ names[i] for i in indices ] )
+            group_values = np.empty( ( 1, group_plan.n_features ) )
+            NewFeatureComputationPlanExecutor( group_plan ).run_to_array( px_plane, group_values, 0 )
+            self.assertEqual( [ group_plan.getFeatureNameByIndex(i) \
+                    for i in xrange( group_plan.n_features ) ], [ names[i] for i in indices ] )
+            self.assertEqual( group_values[0].tostring(), values[ 0, indices ].tostring() )
+
+    # --------------------------------------------------------------------------
+    def test_ZernikeBlankImage( self ):
+        """A blank image has no centroid, so its Zernike coefficients are all NaN"""
+
+        import numpy as np
+        from wndcharm.PyImageMatrix import PyImageMatrix
+
+        px_plane = PyImageMatrix()
+        px_plane.allocate( 32, 24 )
+        px_plane.as_ndarray()[:] = 0
+        px_plane.finish()
+        zernike_names = [ 'Zernike Coefficients () [{0}]'.format( i ) for i in xrange( 72 ) ]
+        fv = FeatureVector( source_filepath='blank.tif', feature_names=zernike_names,
+                original_px_plane=px_plane ).GenerateFeatures( write_to_disk=False, quiet=True )
+        self.assertEqual( len( fv.values ), 72 )
+        self.assertTrue( np.all( np.isnan( fv.values ) ) )
+
+    # --------------------------------------------------------------------------
+    def test_BinarySigFile( self ):
+        """Round trip text .sig -> binary .bsig -> FeatureVector"""
+
+        from numpy.testing import assert_array_equal
+        import numpy as np
+
+        text_fv = FeatureVector.NewFromSigFile( self.sig_file_path, quiet=True )
+
+        tempdir = mkdtemp()
+        try:
+            bsig_path = join( tempdir, '010067_301x300-l.bsig' )
+            text_fv.ToSigFile( bsig_path, quiet=True )
+            bin_fv = FeatureVector.NewFromSigFile( bsig_path, quiet=True )
+            self.assertEqual( text_fv.feature_names, bin_fv.feature_names )
+            self.assertEqual( text_fv.feature_set_version, bin_fv.feature_set_version )
+            assert_array_equal( text_fv.values, bin_fv.values )
+            self.assertTrue( bin_fv.long )
+
+            # Single precision
+            text_fv.ToSigFile( bsig_path, quiet=True, dtype=np.float32 )
+            bin_fv = FeatureVector.NewFromSigFile( bsig_path, quiet=True )
+            self.assertEqual( bin_fv.values.dtype, np.float32 )
+            assert_array_equal( np.float32( text_fv.values ), bin_fv.values )
+
+            # Generated paths: binary file is preferred when it exists
+            fv = FeatureVector( basename=join( tempdir, '010067_301x300' ), long=True )
+            self.assertEqual( fv.GenerateSigFilepath(), join( tempdir, '010067_301x300-l.sig' ) )
+            fv.sig_file_format = 'binary'
+            self.assertEqual( fv.GenerateSigFilepath(), bsig_path )
+            fv = FeatureVector( basename=join( tempdir, '010067_301x300' ), long=True,
+                    feature_names=text_fv.feature_names ).LoadSigFile( quiet=True )
+            self.assertEqual( fv.auxiliary_feature_storage, bsig_path )
+            self.assertEqual( fv.values.dtype, np.float32 )
+        finally:
+            rmtree( tempdir )
+
+    # --------------------------------------------------------------------------
+    def test_InternedFeatureNames( self ):
+        """Samples with a standard feature set version share one feature name list"""
+
+        alt_sig_file_path = join( test_dir, 't1_s01_c05_ij-l_precalculated.sig' )
+        fv1 = FeatureVector.NewFromSigFile( self.sig_file_path, quiet=True )
+        fv2 = FeatureVector.NewFromSigFile( alt_sig_file_path, quiet=True )
+        self.assertEqual( fv1.feature_set_version, '4.2' )
+        self.assertIs( fv1.feature_names, fv2.feature_names )
+        self.assertIs( fv1.Derive().feature_names, fv1.feature_names )
+
+        tempdir = mkdtemp()
+        try:
+            bsig_path = join( tempdir, '010067_301x300-l.bsig' )
+            fv1.ToSigFile( bsig_path, quiet=True )
+            bin_fv = FeatureVector.NewFromSigFile( bsig_path, quiet=True )
+            self.assertIs( bin_fv.feature_names, fv1.feature_names )
         finally:
             rmtree( tempdir )
 
+        # Nonstandard feature sets get their own list
+        reduced_fv = fv1.FeatureReduce( fv1.feature_names[:100], quiet=True )
+        self.assertEqual( reduced_fv.feature_set_version, '4.0' )
+        self.assertIsNot( reduced_fv.feature_names, fv1.feature_names )
+
+    # --------------------------------------------------------------------------
+    def test_SigFileLocking( self ):
+        """Sig files written atomically, claimed by one process at a time"""
+
+        from os import listdir, remove
+        from multiprocessing import Process, Event
+        from numpy.testing import assert_array_equal
+        from wndcharm.FeatureVector import WORMfile, SigFileBusyError
+
+        ref_fv = FeatureVector.NewFromSigFile( self.sig_file_path, quiet=True )
+        tempdir = mkdtemp()
+        try:
+            sig_path = join( tempdir, '010067_301x300-l.sig' )
+            ref_fv.ToSigFile( sig_path, quiet=True )
+            ref_fv.ToSigFile( sig_path, quiet=True )
+            self.assertEqual( listdir( tempdir ), [ basename( sig_path ) ] )
+
+            # An empty file isn't loaded, and a failed write leaves no trace
+            wf = WORMfile( join( tempdir, 'empty-l.sig' ) )
+            self.assertEqual( wf.status, WORMfile.WR )
+            self.assertRaises( IOError, FeatureVector( long=True ).LoadSigFile,
+                    wf.path, quiet=True )
+            def FailedWrite( temp_path ):
+                open( temp_path, 'w' ).write( 'partial' )
+                raise RuntimeError( 'killed' )
+            self.assertRaises( RuntimeError, wf.finish, FailedWrite )
+            self.assertEqual( listdir( tempdir ), [ basename( sig_path ) ] )
+            self.assertEqual( WORMfile( sig_path ).status, WORMfile.RD )
+
+            # Loading a binary sig file doesn't touch the text one's path
+            bsig_path = join( tempdir, 'binary-l.bsig' )
+            ref_fv.ToSigFile( bsig_path, quiet=True )
+            fv = FeatureVector( basename=join( tempdir, 'binary' ), long=True ).GenerateFeatures()
+            assert_array_equal( fv.values, ref_fv.values )
+            self.assertEqual( sorted( listdir( tempdir ) ), [ basename( sig_path ), basename( bsig_path ) ] )
+            remove( bsig_path )
+
+            # Another process claims a sig file and writes it when told to
+            claimed = Event()
+            finish = Event()
+            def Writer():
+                wf = WORMfile( join( tempdir, 'other-l.sig' ) )
+                claimed.set()
+                finish.wait()
+                ref_fv.ToSigFile( wormfile=wf, quiet=True )
+            writer = Process( target=Writer )
+            writer.start()
+            try:
+                claimed.wait()
+                fv = FeatureVector( basename=join( tempdir, 'other' ), long=True )
+                self.assertEqual( WORMfile( fv.GenerateSigFilepath() ).status, WORMfile.BUSY )
+                self.assertRaises( SigFileBusyError, fv.GenerateFeatures, quiet=True,
+                        wait_for_sig_file=False )
+                finish.set()
+                fv.GenerateFeatures( quiet=True )
+            finally:
+                finish.set()
+                writer.join()
+            assert_array_equal( fv.values, ref_fv.values )
+        finally:
+            rmtree( tempdir )
+
+    # --------------------------------------------------------------------------
+    def test_FeatureNameIndexMap( self ):
+        """Name -> column lookups used to reorder features"""
+
+        from wndcharm.FeatureVector import FeatureNameIndexMap
+
+        index_map = FeatureNameIndexMap( [ 'a', 'b', 'c', 'a' ] )
+        self.assertEqual( index_map, { 'a': 0, 'b': 1, 'c': 2 } )
+
+        fv = FeatureVector.NewFromSigFile( self.sig_file_path, quiet=True )
+        self.assertIs( FeatureNameIndexMap( fv.feature_names ),
+                FeatureNameIndexMap( fv.feature_names ) )
+        requested = fv.feature_names[ 500:400:-1 ]
+        reduced_fv = fv.FeatureReduce( requested, quiet=True )
+        self.assertEqual( reduced_fv.feature_names, requested )
+        self.assertEqual( list( reduced_fv.values ), list( fv.values[ 500:400:-1 ] ) )
+
+    # --------------------------------------------------------------------------
+    def test_Timings( self ):
+        """Per-node timing records get gathered into FeatureSpaces and summarized"""
+
+        from wndcharm.FeatureVector import node_timing_dtype, SummarizeTimings
+
+        samples = []
+        for ssid in xrange( 2 ):
+            fv = FeatureVector.NewFromSigFile( self.sig_file_path, quiet=True )
+            fv.Update( sample_group_id=0, sample_sequence_id=ssid )
+            fv.timings = np.array( [
+                ( 0, 'Fourier', True, 0.5, 0.5, 100, 80, 40000 ),
+                ( 0, 'Zernike Coefficients (Fourier ())', False, 2.0, 1.5, 51, 80, 576 ),
+                ( 0, 'Zernike Coefficients ()', False, 1.0, 1.0, 100, 80, 576 ) ],
+                dtype=node_timing_dtype )
+            samples.append( fv )
+
+        fs = FeatureSpace.NewFromListOfFeatureVectors( samples, num_samples_per_group=2 )
+        self.assertEqual( len( fs.timings ), 6 )
+        self.assertEqual( list( fs.timings['sample'] ), [ 0, 0, 0, 1, 1, 1 ] )
+        # the samples' own records aren't modified
+        self.assertEqual( list( samples[1].timings['sample'] ), [ 0, 0, 0 ] )
+
+        summary = SummarizeTimings( fs.timings )
+        self.assertEqual( list( summary['name'] ), [ 'Zernike Coefficients (Fourier ())',
+            'Zernike Coefficients ()', 'Fourier' ] )
+        self.assertEqual( list( summary['count'] ), [ 2, 2, 2 ] )
+        self.assertEqual( list( summary['wall_time'] ), [ 4.0, 2.0, 1.0 ] )
+        self.assertEqual( list( summary['cpu_time'] ), [ 3.0, 2.0, 1.0 ] )
+        self.assertEqual( list( summary['output_bytes'] ), [ 1152, 1152, 80000 ] )
+        self.assertEqual( list( summary['transform'] ), [ False, False, True ] )
+
+    # --------------------------------------------------------------------------
+    def test_NodeCostEstimates( self ):
+        """Plan and node cost estimates are consistent, and scale with image size"""
+
+        from wndcharm.FeatureVector import FeatureNodeCosts, node_timing_dtype
+
+        fv = FeatureVector( long=True )
+        plan = fv.GetFeatureComputationPlan()
+        feature_names = [ plan.getFeatureNameByIndex(i) for i in xrange( plan.n_features ) ]
+
+        for width, height in ( 32, 32 ), ( 301, 300 ):
+            node_costs = FeatureNodeCosts( feature_names, width=width, height=height )
+            # Every node of the plan once, looked up by its transform or algorithm name
+            self.assertAlmostEqual( sum( node_costs.values() ),
+                    plan.predicted_cost( width, height ) )
+            critical_path = plan.critical_path_cost( width, height )
+            self.assertGreaterEqual( critical_path, max( node_costs.values() ) )
+            self.assertLessEqual( critical_path, plan.predicted_cost( width, height ) )
+
+        for cost in plan.predicted_cost, plan.critical_path_cost, plan.predicted_peak_bytes:
+            self.assertLess( cost( 32, 32 ), cost( 64, 64 ) )
+            self.assertLess( cost( 64, 64 ), cost( 301, 300 ) )
+
+        self.assertRaises( ValueError, FeatureNodeCosts,
+                [ 'Nonexistent Algorithm (Fourier ()) [0]' ], width=32, height=32 )
+        # Without the image size, every node needs a timing
+        zernike = [ 'Zernike Coefficients (Fourier ()) [0]' ]
+        timings = np.array( [ ( 0, 'Fourier', True, 0.5, 0.5, 32, 32, 8192 ) ],
+                dtype=node_timing_dtype )
+        self.assertRaises( ValueError, FeatureNodeCosts, zernike )
+        self.assertRaises( ValueError, FeatureNodeCosts, zernike, timings )
+        timings = np.append( timings, np.array( [ ( 0, 'Zernike Coefficients (Fourier ())', False,
+                2.0, 1.5, 32, 32, 576 ) ], dtype=node_timing_dtype ) )
+        self.assertEqual( FeatureNodeCosts( zernike, timings ),
+                { 'Fourier' : 0.5, 'Zernike Coefficients (Fourier ())' : 2.0 } )
+
     # --------------------------------------------------------------------------
     def test_FeatureComputationFromROI( self ):
         """Specify bounding box to FeatureVector, calc features, then compare
@@ -80,5 +80,52 @@ class TestFisherFeatureWeights( unittest.TestCase ):
             self.assertEqual( sliced.feature_names[i], fw.feature_names[j] )
             self.assertEqual( sliced.values[i], fw.values[j] )
 
+    # --------------------------------------------------------------------------
+    def test_ThresholdByCost( self ):
+        """Feature selection under a compute time budget, with shared transforms"""
+
+        from wndcharm.FeatureVector import FeatureGroupNodes
+
+        self.assertEqual( FeatureGroupNodes( 'Zernike Coefficients (Chebyshev (Fourier ())) [12]' ),
+            [ 'Fourier', 'Fourier->Chebyshev', 'Zernike Coefficients (Chebyshev (Fourier ()))' ] )
+        self.assertEqual( FeatureGroupNodes( 'Gabor Textures () [3]' ), [ 'Gabor Textures ()' ] )
+
+        fw = FisherFeatureWeights( name='costs' )
+        fw.feature_names = [ 'Gabor Textures () [0]', 'Gabor Textures () [1]',
+            'Comb Moments (Fourier ()) [0]', 'Comb Moments (Fourier ()) [1]',
+            'Haralick Textures (Fourier ()) [0]', 'Haralick Textures () [0]',
+            'Zernike Coefficients (Chebyshev (Fourier ())) [0]' ]
+        fw.values = [ 9.0, 8.0, 3.0, 1.0, 2.0, 0.0, 10.0 ]
+        node_costs = { 'Gabor Textures ()' : 5.0, 'Fourier' : 1.0, 'Fourier->Chebyshev' : 10.0,
+            'Comb Moments (Fourier ())' : 0.5, 'Haralick Textures (Fourier ())' : 0.5,
+            'Haralick Textures ()' : 0.1, 'Zernike Coefficients (Chebyshev (Fourier ()))' : 0.5 }
+
+        # Comb Moments and Haralick share the Fourier transform, Zernike is too expensive,
+        # and the 0-weighted Haralick feature is never worth anything.
+        cheap = fw.ThresholdByCost( 2.0, node_costs=node_costs )
+        self.assertEqual( cheap.feature_names, [ 'Comb Moments (Fourier ()) [0]',
+            'Haralick Textures (Fourier ()) [0]', 'Comb Moments (Fourier ()) [1]' ] )
+        self.assertEqual( cheap.values, [ 3.0, 2.0, 1.0 ] )
+
+        mid = fw.ThresholdByCost( 7.0, node_costs=node_costs )
+        self.assertEqual( set( mid.feature_names ), set( fw.feature_names[:5] ) )
+
+        capped = fw.ThresholdByCost( 20.0, node_costs=node_costs, num_features_to_be_used=3 )
+        self.assertEqual( capped.values, [ 9.0, 8.0, 3.0 ] )
+
+        # Greedily, Haralick on Fourier leaves no room for the Zernike feature, which is worth more.
+        zernike = fw[4:7].ThresholdByCost( 11.5, node_costs=node_costs )
+        self.assertEqual( zernike.values, [ 10.0 ] )
+
+        # Measured timings take the place of node_costs
+        from wndcharm.FeatureVector import node_timing_dtype
+        import numpy as np
+        timings = np.array( [ ( i, name, '(' not in name, cost, cost, 32, 32, 0 )
+            for i in xrange(2) for name, cost in node_costs.iteritems() ], dtype=node_timing_dtype )
+        self.assertEqual( fw.ThresholdByCost( 2.0, timings=timings ), cheap )
+
+        with self.assertRaises( ValueError ):
+            fw.ThresholdByCost( 0.1, node_costs=node_costs )
+
 if __name__ == '__main__':
     unittest.main()
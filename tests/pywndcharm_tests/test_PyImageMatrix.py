@@ -190,6 +190,69 @@ class TestPyImageMatrix( unittest.TestCase ):
         finally:
             rmtree( tempdir )
 
+    def test_fft2PlanCache( self ):
+        """FFTW plans reused for same-size images, FFTW wisdom saved and loaded"""
+
+        import wndcharm
+        tempdir = mkdtemp()
+        wisdom_path = join( tempdir, 'fftw_wisdom.txt' )
+        try:
+            wndcharm.fft_plan_cache_clear()
+            results = []
+            for tile_path in ( 'test-0032-0008-0008.tif', 'test-0032-0016-0016.tif' ):
+                tile = PyImageMatrix()
+                if 1 != tile.OpenImage( join( pychrm_test_dir, tile_path ), 0, None, 0.0, 0.0 ):
+                    self.fail( 'Could not build an ImageMatrix from ' + tile_path )
+                fft = PyImageMatrix()
+                fft.fft2( tile )
+                results.append( fft.as_ndarray().copy() )
+            self.assertEqual( wndcharm.fft_plan_cache_size(), 1 )
+
+            # A new plan gives the same result as the cached one
+            wndcharm.fft_plan_cache_clear()
+            self.assertEqual( wndcharm.fft_plan_cache_size(), 0 )
+            fft = PyImageMatrix()
+            fft.fft2( tile )
+            assert_equal( fft.as_ndarray(), results[-1] )
+
+            self.assertTrue( wndcharm.fft_wisdom_save( wisdom_path ) )
+            self.assertTrue( wndcharm.fft_wisdom_load( wisdom_path ) )
+            self.assertFalse( wndcharm.fft_wisdom_load( join( tempdir, 'nonexistent.txt' ) ) )
+        finally:
+            rmtree( tempdir )
+
+    def test_SharedPixelPlane( self ):
+        """Pixels pickled by shared memory name instead of by value"""
+
+        import pickle
+        from os.path import exists
+        orig = join( pychrm_test_dir, 'test-0032-0008-0008.tif' )
+        origim = PyImageMatrix()
+        if 1 != origim.OpenImage( orig, 0, None, 0.0, 0.0 ):
+            self.fail( 'Could not build an ImageMatrix from ' + orig )
+        pixels = origim.as_ndarray().copy()
+
+        # Without shared memory, only the constructor args are pickled
+        self.assertEqual( pickle.loads( pickle.dumps( origim ) ).width, 0 )
+
+        name = origim.share_pixels()
+        self.assertTrue( name )
+        self.assertEqual( origim.share_pixels(), name )
+        try:
+            assert_equal( origim.as_ndarray(), pixels )
+            pickled = pickle.dumps( origim, pickle.HIGHEST_PROTOCOL )
+            unpickled = pickle.loads( pickled )
+            self.assertEqual( ( unpickled.width, unpickled.height ), ( origim.width, origim.height ) )
+            self.assertEqual( unpickled.source, origim.source )
+            assert_equal( unpickled.as_ndarray(), pixels )
+        finally:
+            self.assertTrue( origim.unshare_pixels() )
+        self.assertFalse( exists( '/dev/shm' + name ) )
+        self.assertRaises( ValueError, pickle.loads, pickled )
+
+        # Both still have the pixels after the name is gone
+        assert_equal( origim.as_ndarray(), pixels )
+        assert_equal( unpickled.as_ndarray(), pixels )
 
 if __name__ == '__main__':
     unittest.main()
@@ -101,5 +101,199 @@ class Test_parallel_compute( unittest.TestCase ):
             rmtree( refdir )
             rmtree( targetdir )
 
+    def test_InMemoryResults( self ):
+        """Features calculated by worker processes come back without going through .sig files"""
+
+        from shutil import copy
+        from os import listdir
+        from wndcharm.utils import parallel_compute
+
+        tempdir = mkdtemp()
+        try:
+            img_filename = 'test-0032-0008-0008.tif'
+            copy( pychrm_test_dir + sep + img_filename, tempdir )
+            feature_names = [ 'Pixel Intensity Statistics () [3]', 'Haralick Textures () [0]' ]
+
+            def Tiles():
+                return [ FeatureVector( source_filepath=tempdir + sep + img_filename,
+                    feature_names=list( feature_names ), tile_num_cols=2, tile_num_rows=2,
+                    tile_col_index=col, tile_row_index=row ) \
+                        for col in xrange(2) for row in xrange(2) ]
+
+            samples = Tiles()
+            self.assertIs( parallel_compute( samples, 2, write_to_disk=False ), samples )
+            self.assertEqual( listdir( tempdir ), [ img_filename ] )
+
+            for sample, reference in zip( samples, Tiles() ):
+                reference.GenerateFeatures( write_to_disk=False )
+                self.assertEqual( sample.feature_names, feature_names )
+                self.assertEqual( list( sample.values ), list( reference.values ) )
+        finally:
+            rmtree( tempdir )
+
+    def test_imap_compute( self ):
+        """Streaming results from the shared worker pool, with progress and errors"""
+
+        from shutil import copy
+        from wndcharm.utils import imap_compute, GetFeatureComputationPool, \
+                CloseFeatureComputationPool
+
+        tempdir = mkdtemp()
+        try:
+            img_filename = 'test-0032-0008-0008.tif'
+            copy( pychrm_test_dir + sep + img_filename, tempdir )
+            samples = [ FeatureVector( source_filepath=tempdir + sep + img_filename,
+                feature_names=[ 'Pixel Intensity Statistics () [3]' ], tile_num_cols=3,
+                tile_num_rows=1, tile_col_index=col, tile_row_index=0 ) for col in xrange(3) ]
+            # This one can't be calculated
+            samples.insert( 1, FeatureVector( source_filepath=tempdir + sep + 'nonexistent.tif',
+                feature_names=[ 'Pixel Intensity Statistics () [3]' ] ) )
+
+            pool = GetFeatureComputationPool( 2 )
+            progress_calls = []
+            def progress( n_done, n_total, rate, eta ):
+                progress_calls.append( ( n_done, n_total, eta ) )
+
+            results = {}
+            for index, values, error in imap_compute( samples, 2, write_to_disk=False,
+                    progress=progress ):
+                self.assertNotIn( index, results )
+                results[ index ] = ( values, error )
+
+            self.assertEqual( sorted( results ), range(4) )
+            self.assertIsNone( results[1][0] )
+            self.assertIn( 'Traceback', results[1][1] )
+            for index in ( 0, 2, 3 ):
+                self.assertIsNone( results[ index ][1] )
+                self.assertEqual( len( results[ index ][0][ 'values' ] ), 1 )
+            self.assertEqual( [ call[0] for call in progress_calls ], [ 1, 2, 3, 4 ] )
+            self.assertEqual( progress_calls[-1][1:], ( 4, 0 ) )
+
+            # The pool is still there for the next job
+            self.assertIs( GetFeatureComputationPool( 2 ), pool )
+        finally:
+            CloseFeatureComputationPool()
+            rmtree( tempdir )
+
+    def test_SharedPixelPlane( self ):
+        """Tiles of an image held in memory go to the workers through shared memory"""
+
+        from os.path import exists
+        from wndcharm.PyImageMatrix import PyImageMatrix
+        from wndcharm.utils import parallel_compute, imap_compute, CloseFeatureComputationPool
+
+        img_filepath = pychrm_test_dir + sep + 'test-0032-0008-0008.tif'
+        px_plane = PyImageMatrix()
+        if 1 != px_plane.OpenImage( img_filepath, 0, None, 0.0, 0.0 ):
+            self.fail( 'Could not build an ImageMatrix from ' + img_filepath )
+        feature_names = [ 'Pixel Intensity Statistics () [3]', 'Haralick Textures () [0]' ]
+
+        def Tiles():
+            # The workers can't read the pixels from this path
+            return [ FeatureVector( source_filepath='nonexistent.tif',
+                feature_names=list( feature_names ), tile_num_cols=2, tile_num_rows=2,
+                tile_col_index=col, tile_row_index=row, original_px_plane=px_plane ) \
+                    for col in xrange(2) for row in xrange(2) ]
+
+        try:
+            samples = parallel_compute( Tiles(), 2, write_to_disk=False )
+        finally:
+            CloseFeatureComputationPool()
+        self.assertFalse( px_plane.shared_pix_plane_name() )
+        self.assertEqual( px_plane.width, 32 )
+
+        for sample, reference in zip( samples, Tiles() ):
+            reference.GenerateFeatures( write_to_disk=False )
+            self.assertEqual( list( sample.values ), list( reference.values ) )
+
+        # The pixels are unshared even if the job fails before any sample is sent
+        import wndcharm.utils
+        def EstimateSampleCost( fv, cache ):
+            raise ValueError( 'No estimate' )
+        saved = wndcharm.utils.EstimateSampleCost
+        wndcharm.utils.EstimateSampleCost = EstimateSampleCost
+        try:
+            with self.assertRaises( ValueError ):
+                list( imap_compute( Tiles(), 2, write_to_disk=False, longest_first=True ) )
+        finally:
+            wndcharm.utils.EstimateSampleCost = saved
+            CloseFeatureComputationPool()
+        self.assertFalse( px_plane.shared_pix_plane_name() )
+
+    def test_SizeAwareScheduling( self ):
+        """Cost and memory estimates from TIFF headers, longest-first under a memory limit"""
+
+        from shutil import copy
+        from wndcharm.utils import TiffDimensions, EstimateSampleCost, parallel_compute, \
+                CloseFeatureComputationPool
+
+        small = 'test-0032-0008-0008.tif'
+        big = 'lymphoma_eosin_channel_MCL_test_img_sj-05-3362-R2_001_E.tif'
+        self.assertEqual( TiffDimensions( pychrm_test_dir + sep + small ), ( 32, 32 ) )
+        self.assertEqual( TiffDimensions( pychrm_test_dir + sep + big ), ( 1388, 1040 ) )
+        self.assertIsNone( TiffDimensions( realpath( __file__ ) ) )
+
+        tempdir = mkdtemp()
+        try:
+            copy( pychrm_test_dir + sep + small, tempdir )
+            copy( pychrm_test_dir + sep + big, tempdir )
+            feature_names = [ 'Pixel Intensity Statistics () [3]', 'Haralick Textures () [0]' ]
+
+            def Samples():
+                return [ FeatureVector( source_filepath=tempdir + sep + path,
+                    feature_names=list( feature_names ), tile_num_cols=tiles, tile_num_rows=tiles,
+                    tile_col_index=0, tile_row_index=0 ) \
+                        for path, tiles in ( ( small, 1 ), ( big, 4 ), ( big, 1 ), ( small, 2 ) ) ]
+
+            samples = Samples()
+            cache = {}
+            estimates = [ EstimateSampleCost( fv, cache ) for fv in samples ]
+            costs = [ cost for cost, n_bytes in estimates ]
+            self.assertEqual( sorted( costs, reverse=True ), [ costs[i] for i in ( 2, 1, 0, 3 ) ] )
+            # At least the pixels of the image and the tile, as doubles
+            self.assertGreaterEqual( estimates[1][1], 8 * ( 1388 * 1040 + 347 * 260 ) )
+            self.assertIsNone( samples[0].feature_computation_plan )
+
+            # Room for only one of the big image samples at a time
+            memory_limit = estimates[2][1] + estimates[0][1]
+            try:
+                parallel_compute( samples, 2, write_to_disk=False, memory_limit=memory_limit )
+            finally:
+                CloseFeatureComputationPool()
+            for sample, reference in zip( samples, Samples() ):
+                reference.GenerateFeatures( write_to_disk=False )
+                self.assertEqual( list( sample.values ), list( reference.values ) )
+        finally:
+            rmtree( tempdir )
+
+    def test_LongestFirstDispatch( self ):
+        """Samples handed out most expensive first, and dealt out to chunks"""
+
+        from wndcharm.utils import imap_compute, CloseFeatureComputationPool
+
+        small = pychrm_test_dir + sep + 'test-0032-0008-0008.tif'
+        big = pychrm_test_dir + sep + 'lymphoma_eosin_channel_MCL_test_img_sj-05-3362-R2_001_E.tif'
+        feature_names = [ 'Pixel Intensity Statistics () [3]' ]
+        # Most to least expensive: 2, 1, 0, 3
+        samples = [ FeatureVector( source_filepath=path, feature_names=list( feature_names ),
+            tile_num_cols=tiles, tile_num_rows=tiles, tile_col_index=0, tile_row_index=0 ) \
+                for path, tiles in ( ( small, 1 ), ( big, 4 ), ( big, 1 ), ( small, 2 ) ) ]
+
+        # One worker process finishes the samples in the order they're sent
+        try:
+            order = [ index for index, values, error in imap_compute( samples, 1,
+                write_to_disk=False, chunksize=1, longest_first=True ) ]
+            self.assertEqual( order, [ 2, 1, 0, 3 ] )
+            # Two chunks: the 1st and 3rd most expensive, then the 2nd and 4th
+            order = [ index for index, values, error in imap_compute( samples, 1,
+                write_to_disk=False, chunksize=2, longest_first=True ) ]
+            self.assertEqual( order, [ 2, 0, 1, 3 ] )
+            # In the order given by default
+            order = [ index for index, values, error in imap_compute( samples, 1,
+                write_to_disk=False, chunksize=2 ) ]
+            self.assertEqual( order, [ 0, 1, 2, 3 ] )
+        finally:
+            CloseFeatureComputationPool()
+
 if __name__ == '__main__':
     unittest.main()
@@ -24,8 +24,10 @@
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"""
 
 import numpy as np
+from . import feature_vector_minor_version_from_num_features_v1
 from .utils import output_railroad_switch, normalize_by_columns
-from .FeatureVector import FeatureVector
+from .FeatureVector import FeatureVector, InternFeatureNames, IsInternedFeatureNames, \
+        FeatureNameIndexMap, NewFeatureComputationPlanExecutor, PlanExecutorTimings
 
 def CheckIfClassNamesAreInterpolatable( class_names ):
     """N.B., this method takes only the first number it finds in the class label."""
@@ -72,13 +74,23 @@ class FeatureSpace( object ):
     # Don't bother copying these "view" members which are rebuilt by self._RebuildViews()
     # Used for Derive, pickling operations, etc.
     convenience_view_members = [ 'data_list', 'sample_names', 'sample_group_ids',\
-            'sample_sequence_ids', 'ground_truth_values', 'ground_truth_labels' ]
+            'sample_sequence_ids', 'ground_truth_values', 'ground_truth_labels',\
+            '_weighted_sq_norms_cache' ]
 
     #==============================================================
     def __init__( self, name=None, source_filepath=None, num_samples=None,
                   num_samples_per_group=1, feature_names=None,
-                  num_features=None, discrete=True, feature_set_version=None ):
-        """FeatureSpace constructor"""
+                  num_features=None, discrete=True, feature_set_version=None,
+                  dtype=np.float64 ):
+        """FeatureSpace constructor
+
+        dtype - numpy dtype of self.data_matrix, np.float64 (default) or np.float32.
+            Single precision halves the memory footprint and bandwidth of big feature
+            spaces. Statistics (normalization, Fisher scores) are still accumulated in
+            double precision. On artificial feature spaces (see ArtificialFeatureSpace,
+            1000 samples, 2-10 classes, 180 features) WND5 marginal probabilities from
+            a float32 space agree with float64 to within 5e-7 using the "cdist"
+            distance method and 2e-5 using "gemm", and all predicted classes match."""
         
         # Let F = # features for a given 5D ROI.
         # Let S = total # samples (rows) in a feature set.
@@ -211,12 +223,21 @@ class FeatureSpace( object ):
         self.feature_means = None
         self.feature_stdevs = None
 
+        #: numpy structured array of wndcharm.FeatureVector.node_timing_dtype with
+        #: per-node timings of the feature calculations that built this FeatureSpace,
+        #: if they were recorded (see NewFromImageTiles and NewFromListOfFeatureVectors)
+        self.timings = None
+
+        #: tuple ( weights bytes, numpy.ndarray ) - squared norms of weighted rows,
+        #: see WeightedSquaredNorms(). Thrown away by _RebuildViews().
+        self._weighted_sq_norms_cache = None
+
         ### Now initialize array-like members if possible:
         # It's ok if num_samples == 0 or num_features == 0
         # That's how you initialize the empty lists and use AddSample
         if self.num_samples is not None and self.num_features is not None:
             self.shape = ( self.num_samples, self.num_features )
-            self.data_matrix = np.empty( self.shape, dtype='double' )
+            self.data_matrix = np.empty( self.shape, dtype=dtype )
 
         if self.num_samples is not None:
             self._contiguous_sample_names = [None] * self.num_samples
@@ -249,6 +270,9 @@ class FeatureSpace( object ):
                 continue
             if key in kwargs:
                 new_obj_namespace[key] = kwargs[key]
+            # interned feature name tables are shared, not copied
+            elif key == 'feature_names' and IsInternedFeatureNames( self_namespace[key] ):
+                new_obj_namespace[key] = self_namespace[key]
             else:
                 new_obj_namespace[key] = deepcopy( self_namespace[key] )
         new_obj._RebuildViews()
@@ -284,10 +308,12 @@ class FeatureSpace( object ):
         To create new featureSpace
         fv - wndcharm.FeatureVector"""
 
-        if self.feature_names != fv.feature_names:
+        if self.feature_names is not fv.feature_names and \
+                self.feature_names != fv.feature_names:
             raise ValueError( "feature names don't match" )
 
-        self.data_matrix = np.vstack( (self.data_matrix, fv.values) )
+        self.data_matrix = np.vstack( (self.data_matrix,
+                np.asarray( fv.values, dtype=self.data_matrix.dtype ) ) )
         self._contiguous_sample_names.append( fv.name )
         self._contiguous_ground_truth_values.append( fv.ground_truth_value )
         self._contiguous_ground_truth_labels.append( fv.ground_truth_label )
@@ -468,6 +494,81 @@ class FeatureSpace( object ):
         with open( outfile_pathname, 'wb') as outfile:
             pickle.dump( self.__dict__, outfile, pickle.HIGHEST_PROTOCOL )
 
+    #==============================================================
+    def ToBinary( self, pathname=None, quiet=False ):
+        """Write this FeatureSpace to disk in a form that can be memory-mapped back in
+        with NewFromBinary(): the data matrix as a raw NumPy .npy file, plus a small
+        pickled sidecar file "<pathname>.meta" holding everything else (sample names,
+        ground truths, group ids, feature names, normalization vectors, etc.).
+
+        pathname - str, path to the .npy file to write. Defaults to self.source_filepath
+            with ".fs.npy" appended.
+
+        References to other FeatureSpaces (normalized_against, transformed_against) are
+        stored by name only, so the sidecar never pulls in another data matrix.
+
+        Returns: pathname"""
+
+        import cPickle as pickle
+
+        if pathname is None:
+            if not self.source_filepath or not isinstance( self.source_filepath, str ):
+                raise ValueError( "Can't write this feature space: its 'source_filepath' member " \
+                        "is not defined, and you did not specify a file path." )
+            pathname = self.source_filepath + ".fs.npy"
+        if not pathname.endswith( ".npy" ):
+            raise ValueError( 'Binary feature space file path must end in ".npy", you gave {0}'.format( pathname ) )
+
+        metadata = {}
+        for key, val in vars( self ).iteritems():
+            if key == 'data_matrix' or key in self.convenience_view_members:
+                continue
+            if isinstance( val, FeatureSpace ):
+                val = val.name if val.name else 'unnamed ' + val.__class__.__name__
+            metadata[ key ] = val
+
+        np.save( pathname, self.data_matrix )
+        with open( pathname + ".meta", 'wb' ) as outfile:
+            pickle.dump( metadata, outfile, pickle.HIGHEST_PROTOCOL )
+
+        if not quiet:
+            print "Wrote {0} and {0}.meta".format( pathname )
+        return pathname
+
+    #==============================================================
+    @classmethod
+    def NewFromBinary( cls, pathname, mmap_mode='c', quiet=True ):
+        """Open a FeatureSpace previously written by ToBinary(). The data matrix is
+        memory-mapped (numpy.memmap), so opening is near-instant regardless of size
+        and only the rows/columns that are actually used get paged in from disk.
+
+        pathname - str, path to the .npy file
+        mmap_mode - passed through to numpy.load. The default 'c' (copy-on-write) lets
+            in-place operations like Normalize() work without modifying the file on disk.
+            'r' is strictly read-only, 'r+' writes changes back to the file, and None
+            reads the whole matrix into memory.
+
+        Returns: new instance of FeatureSpace"""
+
+        import cPickle as pickle
+
+        with open( pathname + ".meta", 'rb' ) as infile:
+            metadata = pickle.load( infile )
+
+        new_fs = cls()
+        vars( new_fs ).update( metadata )
+        new_fs.data_matrix = np.load( pathname, mmap_mode=mmap_mode )
+
+        if new_fs.shape is not None and tuple( new_fs.shape ) != new_fs.data_matrix.shape:
+            raise ValueError( 'Data matrix in {0} has shape {1}, but its metadata says {2}'.format(
+                pathname, new_fs.data_matrix.shape, new_fs.shape ) )
+
+        new_fs._RebuildViews( recalculate_class_metadata=False )
+
+        if not quiet:
+            print "NEW FEATURE SPACE FROM BINARY FILE:", str( new_fs )
+        return new_fs
+
     #==============================================================
     def _RebuildViews( self, recalculate_class_metadata=True ):
         """Anytime you've finished adding or subtracting samples to a FeatureSpace,
@@ -483,6 +584,9 @@ class FeatureSpace( object ):
         if not self.samples_sorted_by_ground_truth:
             self.SortSamplesByGroundTruth( inplace=True, rebuild_views=False )
 
+        # data matrix may have changed
+        self._weighted_sq_norms_cache = None
+
         if self.discrete is None:
             errmsg = 'FeatureSpace {0} "discrete" member hasn\'t been set. '.format( self )
             errmsg += 'Please set the flag on the object indicating classification vs. regression/clustering.'
@@ -542,6 +646,50 @@ class FeatureSpace( object ):
 
         return self
 
+    #==============================================================
+    def WeightedSquaredNorms( self, weights ):
+        """Squared L2 norm of each row of self.data_matrix * weights, as used by the
+        "gemm" distance method of FeatureSpaceClassification.NewWND5.
+
+        The result for the most recently used weights is cached on self until the
+        next call to self._RebuildViews(). If you modify self.data_matrix by hand,
+        call _RebuildViews() afterwards.
+
+        weights - array-like, shape (features,)
+
+        Returns: numpy.ndarray, shape (samples,)"""
+
+        weights = np.asarray( weights, dtype=np.float64 )
+        key = weights.tostring()
+        # getattr: FeatureSpaces unpickled from older versions don't have the member
+        cached = getattr( self, '_weighted_sq_norms_cache', None )
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        # A block of rows at a time, so memory-mapped data matrices don't get
+        # copied in their entirety
+        weights = weights.astype( self.data_matrix.dtype )
+        sq_norms = np.empty( ( self.data_matrix.shape[0], ) )
+        row_bytes = max( 1, self.data_matrix.shape[1] * self.data_matrix.itemsize )
+        n_rows_per_block = max( 1, ( 64 * 1024 * 1024 ) // row_bytes )
+        for start in xrange( 0, self.data_matrix.shape[0], n_rows_per_block ):
+            end = start + n_rows_per_block
+            w_featspace = self.data_matrix[ start : end ] * weights
+            sq_norms[ start : end ] = np.einsum( 'ij,ij->i', w_featspace, w_featspace,
+                    dtype=np.float64 )
+        self._weighted_sq_norms_cache = ( key, sq_norms )
+        return sq_norms
+
+    #==============================================================
+    def AsType( self, dtype, inplace=False ):
+        """Convert self.data_matrix to the given numpy dtype, e.g., numpy.float32
+        to halve the memory footprint."""
+
+        newdata = { 'data_matrix' : self.data_matrix.astype( dtype ) }
+        if inplace:
+            return self.Update( **newdata )._RebuildViews( recalculate_class_metadata=False )
+        return self.Derive( **newdata )
+
     #==============================================================
     def UpdateGroundTruthValues( self ):
         """Update ground truth numeric values based on ground truth labels
@@ -597,7 +745,7 @@ class FeatureSpace( object ):
             newdata['name'] = self.name + " (sorted)"
         newdata['_contiguous_ground_truth_labels'] = list(a)
         newdata['_contiguous_ground_truth_values'] = list(b)
-        newdata['data_matrix'] = np.array(c)
+        newdata['data_matrix'] = np.array( c, dtype=self.data_matrix.dtype )
         newdata['_contiguous_sample_names'] = list(d)
         newdata['_contiguous_sample_sequence_ids'] = list(e)
 
@@ -786,11 +934,12 @@ class FeatureSpace( object ):
     #==============================================================
     @classmethod
     def NewFromFitFile( cls, pathname, discrete=True, quiet=False, num_samples_per_group=None,
-            global_sampling_options=None, **kwargs ):
+            global_sampling_options=None, dtype=np.float64, **kwargs ):
         """Helper function which reads in a c-chrm fit file.
 
         tile_options - an integer N -> NxN tile scheme, or a tuple (N,M) -> NxM tile scheme
-        discrete_data - if false, try to interpret classes as continuous variable."""
+        discrete_data - if false, try to interpret classes as continuous variable.
+        dtype - numpy dtype of the new data_matrix, see FeatureSpace constructor."""
 
         if not global_sampling_options:
             global_sampling_options = FeatureVector( **kwargs )
@@ -808,11 +957,6 @@ class FeatureSpace( object ):
         new_fs.name = basename( filename )
         new_fs.discrete = discrete
 
-        fitfile = open( pathname )
-
-        name_line = False
-        sample_count = 0
-
         if global_sampling_options.tile_num_rows is not None:
             new_fs.tile_num_rows = global_sampling_options.tile_num_rows
         else:
@@ -828,70 +972,63 @@ class FeatureSpace( object ):
         new_fs.global_sampling_options = global_sampling_options
         new_fs.samples_sorted_by_ground_truth = True
 
-        for line_num, line in enumerate( fitfile ):
-            if line_num is 0:
-                # 1st line: number of classes and feature vector version
-                num_classes, feature_set_version = re.match('^(\S+)\s*(\S+)?$', line.strip()).group(1, 2)
-                if feature_set_version is None:
-                    feature_set_version = "1.0"
-                new_fs.feature_set_version = feature_set_version
-                num_classes = int( num_classes )
-                new_fs.num_classes = num_classes
-                new_fs.class_sizes = [0] * num_classes
-                new_fs.class_names = [0] * num_classes
-
-            elif line_num is 1:
-                # 2nd line: num features
-                num_features = int( line )
-                new_fs.num_features = num_features
-                new_fs.feature_names = [None] * num_features
-                if( feature_set_version == "1.0" ):
-                    feature_set_version = "1." + str(
-                        feature_vector_minor_version_from_num_features_v1.get ( num_features,0 ) )
-                    new_fs.feature_set_version = feature_set_version
-
-            elif line_num is 2:
-                # 3rd line: number of samples
-                num_samples = int( line )
-                new_fs.num_samples = num_samples
-                new_fs.shape = ( num_samples, num_features )
-                new_fs.data_matrix = np.empty( new_fs.shape, dtype='double' )
-                new_fs._contiguous_sample_names = [None] * num_samples
-
-            elif line_num < ( num_features + 3 ):
-                # Lines 4 through num_features contains the feature names
-                #retval = wndchrm.FeatureNames.getFeatureInfoByName( line.strip() )
-                #name = retval.name if retval else line.strip()
-                name = line.strip()
-                new_fs.feature_names[ line_num - 3 ] = name
-
-            elif line_num == ( num_features + 3 ):
-                # The line after the block of feature names is blank
-                pass
-
-            elif line_num < ( num_features + 4 + num_classes ):
-                # Class labels
-                class_index = line_num - num_features - 4
-                new_fs.class_names[ class_index ] = line.strip()
-
-            else:
-                # Everything else after is a feature or a sample name
-                # Comes in alternating lines of data, then path to sample original file (tif or sig)
-                if not name_line:
-                    # strip off the class identity value, which is the last in the array
-                    features_string, class_index_string  = line.strip().rsplit( " ", 1 )
-                    class_index = int( class_index_string ) - 1
-                    new_fs.class_sizes[ class_index ] += 1
-                    # np.fromstring is a PIG, see timeit data elsewhere in code
-
-                    new_fs.data_matrix[ sample_count ] = \
-                      np.array( [ float(val) for val in features_string.split() ] )
-                else:
-                    new_fs._contiguous_sample_names[ sample_count ] = line.strip()
-                    sample_count += 1
-                name_line = not name_line
-
-        fitfile.close()
+        from itertools import islice
+
+        with open( pathname ) as fitfile:
+            # 1st line: number of classes and feature vector version
+            num_classes, feature_set_version = \
+                    re.match( '^(\S+)\s*(\S+)?$', next( fitfile ).strip() ).group( 1, 2 )
+            num_classes = int( num_classes )
+            # 2nd line: num features
+            num_features = int( next( fitfile ) )
+            # Version 1 files state "1.0" (or nothing): the minor version comes from
+            # the number of features
+            if feature_set_version is None or feature_set_version == "1.0":
+                feature_set_version = "1." + str(
+                    feature_vector_minor_version_from_num_features_v1.get ( num_features,0 ) )
+            # 3rd line: number of samples
+            num_samples = int( next( fitfile ) )
+
+            new_fs.feature_set_version = feature_set_version
+            new_fs.num_classes = num_classes
+            new_fs.num_features = num_features
+            new_fs.num_samples = num_samples
+            new_fs.shape = ( num_samples, num_features )
+            new_fs.data_matrix = np.empty( new_fs.shape, dtype=dtype )
+
+            # Lines 4 through num_features contains the feature names
+            new_fs.feature_names = \
+                    [ line.strip() for line in islice( fitfile, num_features ) ]
+            # The line after the block of feature names is blank
+            next( fitfile )
+            # Class labels
+            new_fs.class_names = [ line.strip() for line in islice( fitfile, num_classes ) ]
+
+            # Everything else after is a feature or a sample name
+            # Comes in alternating lines of data, then path to sample original file (tif or sig)
+            # Parse a chunk of feature lines at a time with a single call to np.fromstring,
+            # which here is way faster than float()-ing each value, and check the number
+            # of values read to catch truncated lines or unparsable junk.
+            # The class identity value is the last column of each line of features.
+            class_indices = np.empty( num_samples, dtype=int )
+            sample_names = []
+            rows_per_chunk = 256
+            for row_start in xrange( 0, num_samples, rows_per_chunk ):
+                n_rows = min( rows_per_chunk, num_samples - row_start )
+                lines = list( islice( fitfile, 2 * n_rows ) )
+                values = np.fromstring( ' '.join( lines[ 0::2 ] ), sep=' ' )
+                if len( lines ) != 2 * n_rows or values.size != n_rows * ( num_features + 1 ):
+                    raise ValueError( "Error reading samples {0}-{1} from .fit file {2}: expected {3} samples with {4} features each.".format(
+                        row_start, row_start + n_rows - 1, pathname, num_samples, num_features ) )
+                values.shape = ( n_rows, num_features + 1 )
+                new_fs.data_matrix[ row_start : row_start + n_rows ] = values[ :, :-1 ]
+                class_indices[ row_start : row_start + n_rows ] = values[ :, -1 ] - 1
+                sample_names.extend( line.strip() for line in lines[ 1::2 ] )
+
+        # Samples in the UNKNOWN class (index 0 in the file) are counted with the last class
+        class_indices[ class_indices < 0 ] += num_classes
+        new_fs._contiguous_sample_names = sample_names
+        new_fs.class_sizes = np.bincount( class_indices, minlength=num_classes ).tolist()
 
         # Every sample gets a string label
         new_fs._contiguous_ground_truth_labels = [ new_fs.class_names[ class_index ] \
@@ -955,46 +1092,51 @@ class FeatureSpace( object ):
         else:
             temp_fs = self
 
-        fit = open( path, 'w' )
-
+        header = []
         # 1st line: number of classes and feature vector version
-        fit.write( str( temp_fs.num_classes ) + ' ' + temp_fs.feature_set_version + '\n' )
+        header.append( str( temp_fs.num_classes ) + ' ' + temp_fs.feature_set_version )
         # 2nd line: num features
-        fit.write( str( temp_fs.num_features ) + '\n' )
+        header.append( str( temp_fs.num_features ) )
         # 3rd line: number of samples
-        fit.write( str( temp_fs.num_samples ) + '\n' )
+        header.append( str( temp_fs.num_samples ) )
         # Lines 4 through num_features contains the feature names
-        for name in temp_fs.feature_names:
-            fit.write( name + '\n' )
+        header.extend( temp_fs.feature_names )
         # The line after the block of feature names is blank
-        fit.write('\n')
+        header.append( '' )
         # Then all the Class labels
-        for class_name in temp_fs.class_names:
-            fit.write( class_name + '\n' )
+        header.extend( temp_fs.class_names )
 
         # Finally, alternating lines of features and paths to sample original file (tif or sig)
         # In the fit file format, a sample's class membership is denoted by the final int
         # at the end of the line of features. A class index of 0 implies it belongs
         # to the UNKNOWN CLASS so in practical terms, fit file indexing starts at 1.
-
-        for samp_feats, samp_name, samp_label in zip( temp_fs.data_matrix, \
-                temp_fs._contiguous_sample_names, temp_fs._contiguous_ground_truth_labels ):
-            samp_feats.tofile( fit, sep=' ', format='%.8g' )
-            # add class index of sample to end of features line
-            if not samp_label or samp_label == 'UNKNOWN':
-                class_index = 0
-            else:
-                class_index = temp_fs.class_names.index( samp_label ) + 1
-            fit.write( ' ' + str(class_index) + '\n' )
-            fit.write( samp_name + '\n' )
-
-        fit.close()
+        # Format a whole row with one %-operation and write out a chunk of rows at a time;
+        # output is the same as ndarray.tofile( sep=' ', format='%.8g' ) for each row.
+        row_format = ' '.join( [ '%.8g' ] * temp_fs.num_features )
+        rows_per_chunk = 256
+
+        with open( path, 'w' ) as fit:
+            fit.write( '\n'.join( header ) + '\n' )
+            chunk = []
+            for samp_feats, samp_name, samp_label in zip( temp_fs.data_matrix, \
+                    temp_fs._contiguous_sample_names, temp_fs._contiguous_ground_truth_labels ):
+                # add class index of sample to end of features line
+                if not samp_label or samp_label == 'UNKNOWN':
+                    class_index = 0
+                else:
+                    class_index = temp_fs.class_names.index( samp_label ) + 1
+                chunk.append( row_format % tuple( samp_feats.tolist() ) + \
+                        ' {0}\n{1}\n'.format( class_index, samp_name ) )
+                if len( chunk ) == rows_per_chunk:
+                    fit.write( ''.join( chunk ) )
+                    chunk = []
+            fit.write( ''.join( chunk ) )
 
     #==============================================================
     @classmethod
     def NewFromDirectory( cls, top_level_dir_path, discrete=True, num_samples_per_group=None,
       quiet=False, global_sampling_options=None, write_sig_files_to_disk=True,
-      n_jobs=None, **kwargs ):
+      n_jobs=None, dtype=np.float64, progress=None, memory_limit=None, **kwargs ):
         """Create a FeatureSpace by reading the given directory for image/feature data,
         using its subdirectory structure to define class membership. Equivalent to the
         "wndchrm train" command from the C++ WND-CHARM implementation by Shamir.
@@ -1017,9 +1159,19 @@ class FeatureSpace( object ):
             n_jobs (int, bool, default None):
                 If features need to be calculated. If true, use all cores available on
                 CPU, if int, try to create that number of processes to calculate features
+            progress (callable, default None):
+                Called as progress( n_done, n_total, rate, eta ) as samples are finished
+                when n_jobs is set, see wndcharm.utils.imap_compute().
+            memory_limit (int, default None):
+                Bytes of memory the worker processes may use at once when n_jobs is set,
+                see wndcharm.utils.imap_compute().
+            dtype (numpy dtype, default numpy.float64):
+                dtype of the new data_matrix, see FeatureSpace constructor.
             **kwargs
                 5D sampling options directly passed to FeatureVector constructor to serve as
-                template FeatureVector (see arg global_sampling_options above)
+                template FeatureVector (see arg global_sampling_options above). Pass
+                sig_file_format='binary' to write compact binary .bsig signature files
+                instead of text .sig files; existing .bsig files are always read.
 
         Returns:
             wndcharm.FeatureVector object"""
@@ -1092,7 +1244,8 @@ class FeatureSpace( object ):
         # Load features from disk, or calculate them if they don't exist:
         if n_jobs is not None:
             from .utils import parallel_compute
-            parallel_compute( feature_vector_list, n_jobs )
+            parallel_compute( feature_vector_list, n_jobs, write_to_disk=write_sig_files_to_disk,
+                    progress=progress, memory_limit=memory_limit )
         for fv in feature_vector_list:
             fv.GenerateFeatures( write_to_disk=write_sig_files_to_disk,
                 update_samp_opts_from_pathname=False, quiet=quiet )
@@ -1102,7 +1255,7 @@ class FeatureSpace( object ):
                source_filepath=top_level_dir_path, num_samples=len(feature_vector_list),
                num_samples_per_group=num_samples_per_group,
                num_features=global_sampling_options.num_features,
-               discrete=discrete, quiet=True )
+               discrete=discrete, quiet=True, dtype=dtype )
 
         if not quiet:
             print "NEW FEATURE SPACE FROM DIRECTORY:", str( retval )
@@ -1112,7 +1265,7 @@ class FeatureSpace( object ):
     @classmethod
     def NewFromFileOfFiles( cls, pathname, discrete=True, num_samples_per_group=None, quiet=False,
              global_sampling_options=None, write_sig_files_to_disk=True, n_jobs=None,
-             **kwargs ):
+             dtype=np.float64, progress=None, memory_limit=None, **kwargs ):
         """Create a FeatureSpace from a tab-separated text file containing paths to TIFF files,
         ground truth values, and 5D sampling options.
 
@@ -1146,9 +1299,19 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
             n_jobs (int, bool, default None):
                 If features need to be calculated. If true, use all cores available on
                 CPU, if int, try to create that number of processes to calculate features
+            progress (callable, default None):
+                Called as progress( n_done, n_total, rate, eta ) as samples are finished
+                when n_jobs is set, see wndcharm.utils.imap_compute().
+            memory_limit (int, default None):
+                Bytes of memory the worker processes may use at once when n_jobs is set,
+                see wndcharm.utils.imap_compute().
+            dtype (numpy dtype, default numpy.float64):
+                dtype of the new data_matrix, see FeatureSpace constructor.
             **kwargs
                 5D sampling options directly passed to FeatureVector constructor to serve as
-                template FeatureVector (see arg global_sampling_options above)
+                template FeatureVector (see arg global_sampling_options above). Pass
+                sig_file_format='binary' to write compact binary .bsig signature files
+                instead of text .sig files; existing .bsig files are always read.
 
         Returns:
             wndcharm.FeatureVector object"""
@@ -1388,7 +1551,8 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         # Load features from disk, or calculate them if they don't exist:
         if n_jobs is not None:
             from .utils import parallel_compute
-            parallel_compute( samples, n_jobs, quiet=quiet )
+            parallel_compute( samples, n_jobs, quiet=quiet, write_to_disk=write_sig_files_to_disk,
+                    progress=progress, memory_limit=memory_limit )
         for fv in samples:
             fv.GenerateFeatures( write_sig_files_to_disk,
                 update_samp_opts_from_pathname=False, quiet=quiet )
@@ -1398,14 +1562,16 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         retval = cls.NewFromListOfFeatureVectors( samples, name=file_name, source_filepath=pathname,
                num_samples=len(samp_name_to_samp_group_id_dict)*num_samples_per_group,
                num_samples_per_group=num_samples_per_group, num_features=num_features,
-               feature_set_version=feature_set_version, discrete=discrete, quiet=True )
+               feature_set_version=feature_set_version, discrete=discrete, quiet=True,
+               dtype=dtype )
 
         if not quiet:
             print "NEW FEATURE SPACE FROM FILE LIST:", retval
         return retval
     #==============================================================
     @classmethod
-    def NewFromSlidingWindow( cls, window, n_jobs=None, quiet=True):
+    def NewFromSlidingWindow( cls, window, n_jobs=None, quiet=True, dtype=np.float64,
+            write_sig_files_to_disk=True, progress=None, memory_limit=None ):
         """Takes features derived from samples from a wndchrm.FeatureVector.SlidingWindow
         and constructs a FeatureSpace out of them.
 
@@ -1415,6 +1581,16 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
             n_jobs (int or bool, default None):
                 Number of cores to concurrently calculate features, or all available if
                 True.
+            dtype (numpy dtype, default numpy.float64):
+                dtype of the new data_matrix, see FeatureSpace constructor.
+            write_sig_files_to_disk (bool, default True):
+                Save any features calculated to WND-CHARM .sig file
+            progress (callable, default None):
+                Called as progress( n_done, n_total, rate, eta ) as samples are finished
+                when n_jobs is set, see wndcharm.utils.imap_compute().
+            memory_limit (int, default None):
+                Bytes of memory the worker processes may use at once when n_jobs is set,
+                see wndcharm.utils.imap_compute().
         Returns:
             instance of wndcharm.FeatureSpace.FeatureSpace"""
 
@@ -1425,23 +1601,174 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         # Load features from disk, or calculate them if they don't exist:
         if n_jobs is not None:
             from .utils import parallel_compute
-            parallel_compute( samples, n_jobs, quiet=quiet )
+            parallel_compute( samples, n_jobs, quiet=quiet, write_to_disk=write_sig_files_to_disk,
+                    progress=progress, memory_limit=memory_limit )
         for fv in samples:
-            fv.GenerateFeatures( update_samp_opts_from_pathname=False, quiet=quiet )
+            fv.GenerateFeatures( write_sig_files_to_disk, update_samp_opts_from_pathname=False,
+                    quiet=quiet )
 
         new_fs = cls.NewFromListOfFeatureVectors( samples, name=window.name,
-                source_filepath=window.source_filepath, quiet=True )
+                source_filepath=window.source_filepath, quiet=True, dtype=dtype )
 
         if not quiet:
             print "NEW FEATURE SPACE FROM SCANING WINDOW:", str( new_fs )
 
         return new_fs
 
+    #==============================================================
+    @classmethod
+    def NewFromImageTiles( cls, source_filepath, rects=None, tile_num_rows=None,
+            tile_num_cols=None, ground_truth_label=None, global_sampling_options=None,
+            n_threads=None, name=None, discrete=True, quiet=True, dtype=np.float64,
+            record_timings=False, **kwargs ):
+        """Calculates features for many tiles or ROIs of a single image in one call.
+        The image is opened and preprocessed once, and a single feature computation plan
+        executor fills in the whole data_matrix, reusing its state and scratch ImageMatrix
+        from one tile to the next instead of going through a FeatureVector per tile.
+        Features are not loaded from or saved to .sig files.
+
+        Arguments:
+            source_filepath (str):
+                Path to the image.
+            rects (list of (x, y, w, h) tuples, default None):
+                Bounding boxes in pixel coordinates of the preprocessed (e.g., downsampled)
+                image, one sample each, in order. If None, the image is cut into a
+                tile_num_cols X tile_num_rows grid like FeatureVector tiling does, with
+                samples in tile sequence order.
+            tile_num_rows, tile_num_cols (int, default None):
+                Tiling scheme if rects is None. Defaults to the tiling scheme in
+                global_sampling_options, or 1.
+            ground_truth_label (str, default None):
+                Class label for all the samples.
+            global_sampling_options (wndcharm.FeatureVector, default None):
+                A template FeatureVector with 5D sampling options set (downsample,
+                pixel intensity normalization, feature set, etc.).
+            n_threads (int or bool, default None):
+                Threads used to calculate each tile's features, see
+                FeatureVector.GenerateFeatures().
+            name (str, default None):
+                The name of the new FeatureSpace, default is the image file name.
+            discrete (bool, default True):
+                Classification (True) or regression (False) problem
+            quiet (bool, default True):
+                Verbosity.
+            dtype (numpy dtype, default numpy.float64):
+                dtype of the new data_matrix, see FeatureSpace constructor.
+            record_timings (bool, default False):
+                Keep per-node timings for every tile in self.timings.
+            **kwargs
+                5D sampling options directly passed to FeatureVector constructor to serve as
+                template FeatureVector (see arg global_sampling_options above).
+
+        Returns:
+            instance of wndcharm.FeatureSpace.FeatureSpace containing a single sample
+            group with one sample per tile/ROI"""
+
+        from copy import deepcopy
+        from os.path import basename
+
+        if global_sampling_options:
+            template = deepcopy( global_sampling_options )
+        else:
+            template = FeatureVector( **kwargs )
+        template.Update( source_filepath=source_filepath, ground_truth_label=ground_truth_label )
+
+        px_plane = template.GetPreprocessedFullPixelPlane()
+        width = px_plane.width
+        height = px_plane.height
+
+        # One dict of sampling options per sample, used to name them
+        tiled = rects is None
+        if tiled:
+            if tile_num_rows is None:
+                tile_num_rows = template.tile_num_rows if template.tile_num_rows else 1
+            if tile_num_cols is None:
+                tile_num_cols = template.tile_num_cols if template.tile_num_cols else 1
+            # Same bounding boxes as FeatureVector.GetPreprocessedLocalPixelPlane()
+            w = int( float( width ) / tile_num_cols )
+            h = int( float( height ) / tile_num_rows )
+            rects = []
+            sample_opts = []
+            # sequence order has historically been column-major
+            for col_index in xrange( tile_num_cols ):
+                for row_index in xrange( tile_num_rows ):
+                    rects.append( ( col_index * w, row_index * h, w, h ) )
+                    sample_opts.append( { 'tile_num_rows' : tile_num_rows,
+                        'tile_num_cols' : tile_num_cols, 'tile_row_index' : row_index,
+                        'tile_col_index' : col_index } )
+        else:
+            sample_opts = [ { 'x' : x, 'y' : y, 'w' : w, 'h' : h } for x, y, w, h in rects ]
+
+        rects = np.array( rects, dtype=np.intc ).reshape( -1, 4 )
+        num_samples = len( rects )
+        if num_samples == 0:
+            raise ValueError( "No tiles or ROIs requested from image {0}".format( source_filepath ) )
+        for x, y, w, h in rects:
+            if x < 0 or y < 0 or w < 1 or h < 1 or x + w > width or y + h > height:
+                e = 'Bounding box ({0},{1}) w={2} h={3} is outside of image "{4}" w={5} h={6}'
+                raise ValueError( e.format( x, y, w, h, source_filepath, width, height ) )
+
+        comp_plan = template.GetFeatureComputationPlan()
+        comp_names = InternFeatureNames( [ comp_plan.getFeatureNameByIndex(i) \
+                for i in xrange( comp_plan.n_features ) ], template.feature_set_version )
+        reorder = bool( template.feature_names ) and template.feature_names is not comp_names \
+                and template.feature_names != comp_names
+        feature_names = template.feature_names if reorder else comp_names
+
+        if name is None:
+            name = basename( source_filepath )
+        new_fs = cls( name=name, source_filepath=source_filepath, num_samples=num_samples,
+                num_samples_per_group=num_samples, feature_names=feature_names,
+                discrete=discrete, feature_set_version=template.feature_set_version,
+                dtype=dtype )
+
+        # The executor writes straight into the data_matrix, unless the template's
+        # feature order or a non-double dtype calls for an intermediate array
+        if reorder or new_fs.data_matrix.dtype != np.float64:
+            comp_vals = np.empty( ( num_samples, comp_plan.n_features ) )
+        else:
+            comp_vals = new_fs.data_matrix
+        plan_exec = NewFeatureComputationPlanExecutor( comp_plan, n_threads )
+        plan_exec.record_timings = record_timings
+        if not quiet:
+            print "CALCULATING FEATURES FOR {0} TILES/ROIS FROM {1}".format( num_samples, source_filepath )
+        n_computed = plan_exec.run_rects_to_array( px_plane, rects, comp_vals )
+        if n_computed != num_samples:
+            # the rest of comp_vals would be uninitialized memory
+            e = 'Features were only calculated for {0} of {1} tiles/ROIs from image "{2}"'
+            raise ValueError( e.format( n_computed, num_samples, source_filepath ) )
+        if reorder:
+            name_index = FeatureNameIndexMap( comp_names )
+            np.take( comp_vals, [ name_index[ _name ] for _name in feature_names ], axis=1,
+                    out=new_fs.data_matrix )
+        elif comp_vals is not new_fs.data_matrix:
+            new_fs.data_matrix[:] = comp_vals
+        del comp_vals
+        if record_timings:
+            new_fs.timings = PlanExecutorTimings( plan_exec )
+
+        # Samples are named like their .sig files would be
+        for i, opts in enumerate( sample_opts ):
+            template.Update( **opts )
+            new_fs._contiguous_sample_names[i] = basename( template.GenerateSigFilepath() )
+        new_fs._contiguous_sample_group_ids = [0] * num_samples
+        new_fs._contiguous_sample_sequence_ids = range( num_samples )
+        new_fs._contiguous_ground_truth_labels = [ ground_truth_label ] * num_samples
+        new_fs._contiguous_ground_truth_values = [ template.ground_truth_value ] * num_samples
+        if tiled:
+            new_fs.tile_num_rows = tile_num_rows
+            new_fs.tile_num_cols = tile_num_cols
+        new_fs._RebuildViews()
+
+        if not quiet:
+            print "NEW FEATURE SPACE FROM IMAGE TILES:", str( new_fs )
+        return new_fs
+
     #==============================================================
     @classmethod
     def NewFromListOfFeatureVectors( cls, samples, num_samples=None,
             num_features=None, name=None, source_filepath=None, num_samples_per_group=1,
-            feature_set_version=None, discrete=True, quiet=True ):
+            feature_set_version=None, discrete=True, quiet=True, dtype=np.float64 ):
         """Method to assemble FeatureVector objects into a FeatureSpace. N.B.:
         FeatureVector object must already be populated with feature values, so make sure
         you called GenerateFeatures() method on every FeatureVector object in the "samples"
@@ -1449,7 +1776,9 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
 
         Arguments:
             samples (list of wndcharm.FeatureVector.FeatureVector):
-                Prepopulated with features.
+                Prepopulated with features. Per-node timings of samples calculated with
+                GenerateFeatures( record_timings=True ) are gathered in the new
+                FeatureSpace's timings member.
             num_samples (int, default None):
             num_features (int, default None):
                 Use if there are multiple channels of feature vectors that you want
@@ -1474,6 +1803,8 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
                 a regression/clustering problem
             quiet (boot, default True):
                 Verbosity. By default, be silent about what is going on.
+            dtype (numpy dtype, default numpy.float64):
+                dtype of the new data_matrix, see FeatureSpace constructor.
 
         Returns:
             instance of wndcharm.FeatureSpace.FeatureSpace"""
@@ -1490,7 +1821,8 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
                       feature_names=None,
                       num_features=num_features,
                       discrete=discrete,
-                      feature_set_version=feature_set_version )
+                      feature_set_version=feature_set_version,
+                      dtype=dtype )
 
         # For compound samples, e.g., multichannel, need to know the column offsets.
         # key: col index, value: index in data_matrix demarking rightmost feature for this column
@@ -1553,6 +1885,19 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
             new_fs.data_matrix[ row_index, col_left_boundary_index : col_right_boundary_index ] = \
               fv.values
 
+        if num_fs_columns == 1:
+            new_fs.feature_names = InternFeatureNames( new_fs.feature_names,
+                    new_fs.feature_set_version )
+
+        # Gather up the timings of samples that were calculated with record_timings
+        timings = []
+        for fv in sorted_by_fs_cols:
+            if fv.timings is not None:
+                fv_timings = fv.timings.copy()
+                fv_timings['sample'] = (fv.sample_group_id * num_samples_per_group) + fv.sample_sequence_id
+                timings.append( fv_timings )
+        if timings:
+            new_fs.timings = np.concatenate( timings )
         new_fs._RebuildViews()
 
         if not quiet:
@@ -1606,7 +1951,7 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         newdata[ 'name' ] = self.name + " (feature reduced)"
         newdata[ 'feature_names' ] = requested_features
         newdata[ 'num_features' ] = num_features
-        data_matrix = np.empty( shape , dtype='double' )
+        data_matrix = np.empty( shape , dtype=self.data_matrix.dtype )
 
         # Columnwise operations in Numpy are a pig:
         # %timeit thing = shuffle_my_cols[:,desired_cols]
@@ -1619,9 +1964,20 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         #    thing[ :, new_index ] = shuffle_my_cols[ :, old_index ]
         # 1 loops, best of 3: 2.25 s per loop
 
-        new_order = [ self.feature_names.index( name ) for name in requested_features ]
-        for new_index, old_index in enumerate( new_order ):
-            data_matrix[ :, new_index ] = self.data_matrix[ :, old_index ]
+        name_index = FeatureNameIndexMap( self.feature_names )
+        new_order = [ name_index[ name ] for name in requested_features ]
+        if isinstance( self.data_matrix, np.memmap ):
+            # Going column by column would make a pass over the whole file for every
+            # column. Read a block of whole rows at a time instead, so each page on
+            # disk is touched exactly once.
+            row_bytes = self.data_matrix.shape[1] * self.data_matrix.itemsize
+            n_rows_per_block = max( 1, ( 64 * 1024 * 1024 ) // row_bytes )
+            for start in xrange( 0, self.num_samples, n_rows_per_block ):
+                end = start + n_rows_per_block
+                data_matrix[ start : end ] = self.data_matrix[ start : end ][ :, new_order ]
+        else:
+            for new_index, old_index in enumerate( new_order ):
+                data_matrix[ :, new_index ] = self.data_matrix[ :, old_index ]
         newdata[ 'data_matrix' ] = data_matrix
 
         if self.feature_maxima is not None:
@@ -1720,7 +2076,7 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         new_sg_count          = len( leave_in_sample_group_ids )
         new_samp_count        = new_sg_count * self.num_samples_per_group
         new_shape             = ( new_samp_count, self.num_features )
-        new_mat               = np.empty( new_shape, dtype='double' )
+        new_mat               = np.empty( new_shape, dtype=self.data_matrix.dtype )
         new_samp_names        = [None] * new_samp_count
         new_samp_sequence_ids = [None] * new_samp_count
         new_gt_values         = [None] * new_samp_count
@@ -2050,7 +2406,8 @@ sample2 ClassA  /path/to/ClassA/sample2_A.tiff    {x=12;y=34;w;56;h=78} /path/to
         kwargs['num_samples'] = new_num_samples = self.num_samples + other_fs.num_samples
         kwargs['shape'] = ( new_num_samples, self.num_features )
 
-        kwargs['data_matrix'] = np.empty( kwargs['shape'] )
+        kwargs['data_matrix'] = np.empty( kwargs['shape'],
+                dtype=np.promote_types( self.data_matrix.dtype, other_fs.data_matrix.dtype ) )
         kwargs['_contiguous_sample_names'] =  [None] * self.num_samples
         kwargs['_contiguous_sample_group_ids'] = [None] * self.num_samples
         kwargs['_contiguous_sample_sequence_ids'] = [None] * self.num_samples
@@ -30,6 +30,292 @@ from .FeatureWeights import FeatureWeights, FisherFeatureWeights, PearsonFeature
 from .SingleSamplePrediction import SingleSampleClassification, SingleSampleRegression,\
     AveragedSingleSamplePrediction
 
+#=================================================================================
+def WND5SquaredDistances( w_test_featspace, w_train_featspace, method='cdist',
+        test_sq_norms=None, train_sq_norms=None, same_samples=False ):
+    """Weighted squared Euclidean distances between every test and training sample.
+
+    w_test_featspace, w_train_featspace - numpy.ndarrays, shapes (test samples, features)
+        and (training samples, features), already multiplied by the feature weights.
+    method - 'cdist' (default) uses scipy.spatial.distance, exact to the last bit.
+        'gemm' uses ||a||^2 + ||b||^2 - 2 a.b, so that the heavy lifting is done by
+        a BLAS matrix multiply; much faster for long feature vectors, but subject
+        to round-off. See below.
+    test_sq_norms, train_sq_norms - optional precomputed squared norms of the rows of
+        the respective matrices, used by 'gemm' only (see
+        FeatureSpace.WeightedSquaredNorms).
+    same_samples - bool, the test and training matrices are the same samples, so that
+        the diagonal holds the self-distances (uses pdist when method='cdist').
+
+    With 'gemm', two samples with the same features will rarely come out exactly
+    0 apart. Distances within n_features * epsilon * ( ||a||^2 + ||b||^2 ) of zero
+    (epsilon of the feature spaces' dtype, so float32 gets a looser tolerance),
+    which is below the round-off error of the formulation, are clamped to 0 so they
+    get treated as collisions like they would be with 'cdist'.
+
+    Returns: numpy.ndarray, shape (test samples, training samples)"""
+
+    if method == 'cdist':
+        if same_samples:
+            from scipy.spatial.distance import pdist
+            from scipy.spatial.distance import squareform
+            return squareform( pdist( w_train_featspace, 'sqeuclidean' ) )
+        from scipy.spatial.distance import cdist
+        return cdist( w_test_featspace, w_train_featspace, 'sqeuclidean' )
+
+    if method != 'gemm':
+        raise ValueError( "Distance method must be either 'cdist' or 'gemm', you gave '{0}'".format( method ) )
+
+    if train_sq_norms is None:
+        train_sq_norms = np.einsum( 'ij,ij->i', w_train_featspace, w_train_featspace,
+                dtype=np.float64 )
+    if test_sq_norms is None:
+        if same_samples:
+            test_sq_norms = train_sq_norms
+        else:
+            test_sq_norms = np.einsum( 'ij,ij->i', w_test_featspace, w_test_featspace,
+                    dtype=np.float64 )
+
+    # Do the arithmetic in place, keep peak memory down to the distances plus one
+    # buffer of the same size for the clamp
+    dist_mat = np.dot( w_test_featspace, w_train_featspace.T )
+    dist_mat *= -2
+    dist_mat += test_sq_norms[ :, np.newaxis ]
+    dist_mat += train_sq_norms
+
+    n_feats = w_train_featspace.shape[1]
+    tolerance = n_feats * np.finfo( dist_mat.dtype ).eps
+    keep = np.add( test_sq_norms[ :, np.newaxis ], train_sq_norms,
+            out=np.empty_like( dist_mat ) )
+    keep *= tolerance
+    # 1 where the distance is beyond the tolerance, else 0; everything below 0 is
+    # within it, so clip first to get +0 rather than -0 from the multiply.
+    np.greater( dist_mat, keep, out=keep )
+    np.maximum( dist_mat, 0, out=dist_mat )
+    dist_mat *= keep
+    del keep
+    if same_samples:
+        np.fill_diagonal( dist_mat, 0 )
+    return dist_mat
+
+#=================================================================================
+def WND5ClassSimilarities( dist_mat, class_sizes, epsilon=None ):
+    """Reduce a matrix of weighted squared distances into per-class WND5 similarity
+    sums for every test sample at once.
+
+    dist_mat - numpy.ndarray, shape (test samples, training samples).
+        OVERWRITTEN IN PLACE with the similarities dist^-5 to save memory (unless
+        it's not float64, in which case a double precision copy is made).
+    class_sizes - list of ints, number of training samples in each class; training
+        samples are assumed to be contiguous by class (see FeatureSpace._RebuildViews)
+    epsilon - distances at or below this value are collisions and are left out
+        of the class means. Default is machine epsilon.
+
+    Returns: (sums, counts) - numpy.ndarrays each with shape (test samples, classes),
+        the sum of non-colliding similarities and the number of non-colliding training
+        samples per class."""
+
+    if epsilon is None:
+        epsilon = np.finfo( np.float ).eps
+
+    # Similarities span too many orders of magnitude for single precision
+    if dist_mat.dtype != np.float64:
+        dist_mat = dist_mat.astype( np.float64 )
+
+    n_test = dist_mat.shape[0]
+    collisions = dist_mat <= epsilon
+    with np.errstate( divide='ignore', over='ignore', under='ignore' ):
+        sims = np.power( dist_mat, -5, out=dist_mat )
+    sims[ collisions ] = 0
+
+    sums = np.empty( ( n_test, len( class_sizes ) ) )
+    counts = np.empty( ( n_test, len( class_sizes ) ), dtype=np.int64 )
+
+    # N.B.: Summing each class slice of the C-contiguous rows uses the same (pairwise)
+    # summation order as taking the mean of one test sample's class similarities at
+    # a time, so samples without collisions get bit-identical results. Collisions are
+    # zeroed rather than dropped, which can change the last bit of the sum.
+    start_index = 0
+    for class_index, n_class_train_samps in enumerate( class_sizes ):
+        end_index = start_index + n_class_train_samps
+        sums[ :, class_index ] = sims[ :, start_index : end_index ].sum( axis=1 )
+        counts[ :, class_index ] = n_class_train_samps - \
+                collisions[ :, start_index : end_index ].sum( axis=1 )
+        start_index = end_index
+
+    return sums, counts
+
+#=================================================================================
+def _WND5ColumnBlocks( class_sizes, max_block_width ):
+    """Partition the training samples into blocks of columns no wider than
+    max_block_width, keeping whole classes together whenever a class fits.
+
+    Returns: list of (start column, list of (class index, n samples in block))"""
+
+    blocks = []
+    current_start = 0
+    current = []
+    current_width = 0
+    start_index = 0
+    for class_index, n_class_train_samps in enumerate( class_sizes ):
+        if n_class_train_samps > max_block_width:
+            # Class is too big for any block: flush, then split it up
+            if current:
+                blocks.append( ( current_start, current ) )
+            for chunk_start in xrange( 0, n_class_train_samps, max_block_width ):
+                chunk_width = min( max_block_width, n_class_train_samps - chunk_start )
+                blocks.append( ( start_index + chunk_start, [ ( class_index, chunk_width ) ] ) )
+            current_start = start_index + n_class_train_samps
+            current = []
+            current_width = 0
+        else:
+            if current_width + n_class_train_samps > max_block_width:
+                blocks.append( ( current_start, current ) )
+                current_start = start_index
+                current = []
+                current_width = 0
+            current.append( ( class_index, n_class_train_samps ) )
+            current_width += n_class_train_samps
+        start_index += n_class_train_samps
+    if current:
+        blocks.append( ( current_start, current ) )
+    return blocks
+
+#=================================================================================
+def WND5BytesPerElement( distance_method, dtype ):
+    """Peak bytes held per element of a block of the distance matrix, counting the
+    temporaries of WND5SquaredDistances and WND5ClassSimilarities.
+
+    distance_method - 'cdist' or 'gemm'
+    dtype - numpy dtype of the weighted feature matrices
+
+    Returns: int"""
+
+    double = np.dtype( np.float64 ).itemsize
+    if distance_method == 'gemm':
+        # distances in the features' precision, with a clamp buffer of the same size
+        dist_bytes = np.dtype( dtype ).itemsize
+        clamp_bytes = 2 * dist_bytes
+    else:
+        # cdist always gives double precision
+        dist_bytes = double
+        clamp_bytes = 0
+    # similarities: a double precision copy if the distances aren't, plus collision flags
+    sims_bytes = dist_bytes + np.dtype( np.bool_ ).itemsize
+    if dist_bytes != double:
+        sims_bytes += double
+    return max( clamp_bytes, sims_bytes )
+
+#=================================================================================
+def WND5BlockedClassSimilarities( test_data, train_data, weights, class_sizes,
+        memory_budget, epsilon=None, distance_method='cdist', train_sq_norms=None ):
+    """Same as WND5ClassSimilarities, but streams over blocks of test samples (and
+    training samples if need be) so that the distance/similarity working set stays
+    within memory_budget bytes, no matter how big the test set is.
+
+    test_data - numpy.ndarray, shape (test samples, features), UNweighted; rows
+        get weighted one block at a time.
+    train_data - numpy.ndarray, shape (training samples, features), UNweighted.
+        Weighted once if the whole training set fits in one block, otherwise one
+        block of columns at a time, so neither matrix needs to be in memory in
+        its entirety (e.g., either may be a numpy.memmap).
+    weights - numpy.ndarray, shape (features,)
+    class_sizes - list of ints, as in WND5ClassSimilarities
+    memory_budget - int, approximate upper limit in bytes of the working set.
+    distance_method, train_sq_norms - see WND5SquaredDistances
+
+    Training samples are only split into column blocks if a single test sample
+    against the whole training set doesn't fit. Blocks are aligned to class
+    boundaries, so results are bit-identical to the unblocked WND5ClassSimilarities
+    as long as every class by itself fits; a class that doesn't fit gets its
+    similarity sum accumulated in pieces, which can change the last bit.
+
+    Returns: (sums, counts), as in WND5ClassSimilarities."""
+
+    n_test = test_data.shape[0]
+    n_feats = test_data.shape[1]
+    n_classes = len( class_sizes )
+    bytes_per_elem = WND5BytesPerElement( distance_method,
+            np.result_type( test_data, train_data, weights ) )
+    # plus one weighted row of features per test sample/training sample in the block
+    bytes_per_row = weights.itemsize * n_feats
+
+    # A block column costs a distance matrix column and a weighted training sample
+    max_block_width = max( 1, int( ( memory_budget - bytes_per_row ) //
+            ( bytes_per_elem + bytes_per_row ) ) )
+    col_blocks = _WND5ColumnBlocks( class_sizes, max_block_width )
+    widest_block = max( sum( w for _, w in classes ) for _, classes in col_blocks )
+    bytes_per_test_row = bytes_per_elem * widest_block + bytes_per_row
+    n_rows_per_block = max( 1, int( ( memory_budget - widest_block * bytes_per_row ) //
+            bytes_per_test_row ) )
+
+    if len( col_blocks ) == 1:
+        w_train_featspace = train_data * weights
+    else:
+        w_train_featspace = None
+
+    if distance_method == 'gemm' and train_sq_norms is None:
+        train_sq_norms = np.empty( len( train_data ) )
+        for col_start, classes in col_blocks:
+            col_end = col_start + sum( w for _, w in classes )
+            w_train_block = train_data[ col_start : col_end ] * weights
+            train_sq_norms[ col_start : col_end ] = np.einsum( 'ij,ij->i',
+                    w_train_block, w_train_block, dtype=np.float64 )
+
+    sums = np.zeros( ( n_test, n_classes ) )
+    counts = np.zeros( ( n_test, n_classes ), dtype=np.int64 )
+
+    for row_start in xrange( 0, n_test, n_rows_per_block ):
+        row_end = min( row_start + n_rows_per_block, n_test )
+        w_test_block = test_data[ row_start : row_end ] * weights
+        for col_start, classes in col_blocks:
+            class_indices = [ i for i, _ in classes ]
+            block_class_sizes = [ w for _, w in classes ]
+            col_end = col_start + sum( block_class_sizes )
+            if w_train_featspace is not None:
+                w_train_block = w_train_featspace
+            else:
+                w_train_block = train_data[ col_start : col_end ] * weights
+            if train_sq_norms is not None:
+                train_sq_norms_block = train_sq_norms[ col_start : col_end ]
+            else:
+                train_sq_norms_block = None
+            dist_block = WND5SquaredDistances( w_test_block, w_train_block,
+                    distance_method, train_sq_norms=train_sq_norms_block )
+            block_sums, block_counts = WND5ClassSimilarities( dist_block, block_class_sizes,
+                    epsilon )
+            sums[ row_start : row_end, class_indices ] += block_sums
+            counts[ row_start : row_end, class_indices ] += block_counts
+            del dist_block
+
+    return sums, counts
+
+#=================================================================================
+def WND5MarginalProbabilities( sums, counts ):
+    """Turn per-class similarity sums and counts into WND5 calls.
+
+    Returns: (normalization_factors, marginal_probabilities, predicted_class_indices)
+        normalization_factors - shape (test samples,)
+        marginal_probabilities - shape (test samples, classes)
+        predicted_class_indices - shape (test samples,), index into training set
+            class_names, or -1 if the sample collided with every training sample in
+            at least one class (a non-call). Rows for non-calls are NaN."""
+
+    with np.errstate( divide='ignore', invalid='ignore', under='ignore' ):
+        class_siml_means = sums / counts
+        normalization_factors = class_siml_means.sum( axis=1 )
+        marginal_probabilities = class_siml_means / normalization_factors[ :, np.newaxis ]
+        called = np.all( counts > 0, axis=1 ) & ( normalization_factors > 0 )
+
+    normalization_factors[ ~called ] = np.nan
+    marginal_probabilities[ ~called ] = np.nan
+
+    predicted_class_indices = np.full( len( sums ), -1, dtype=np.int64 )
+    if np.any( called ):
+        predicted_class_indices[ called ] = marginal_probabilities[ called ].argmax( axis=1 )
+
+    return normalization_factors, marginal_probabilities, predicted_class_indices
+
 #=================================================================================
 class _FeatureSpacePrediction( object ):
     """Base class container for individual SingleSamplePrediction instances.
@@ -79,6 +365,25 @@ class _FeatureSpacePrediction( object ):
         self.column_headers = None
         self.column_separators = None
 
+    #==============================================================
+    @property
+    def individual_results( self ):
+        """List of _SingleSamplePrediction instances. Child classes that store their
+        results in array form leave this as None until it's first asked for."""
+        if self._individual_results is None:
+            self._individual_results = self._BuildIndividualResults()
+        return self._individual_results
+
+    @individual_results.setter
+    def individual_results( self, value ):
+        self._individual_results = value
+
+    #==============================================================
+    def _BuildIndividualResults( self ):
+        """Base method, implemented in daughter classes which defer instantiation
+        of individual results."""
+        return []
+
     #==============================================================
     def __len__( self ):
         if self.averaged_results:
@@ -388,12 +693,53 @@ class FeatureSpaceClassification( _FeatureSpacePrediction ):
         self.similarity_matrix = None
         self.average_class_probability_matrix = None
 
+        #: Array form of the results; row i corresponds to test set sample i.
+        #: Non-calls (collisions) have NaN rows and a predicted class index of -1.
+        self.normalization_factors = None
+        self.marginal_probabilities = None
+        self.predicted_class_indices = None
+
         #: If there was randomness associated with generating results
         #: set use_error_bars = True to calculate confidence intervals for
         #: resulting figures of merit
         self.use_error_bars = None
         self.confidence_interval = None
 
+    #==============================================================
+    def _BuildIndividualResults( self ):
+        """Instantiate one SingleSampleClassification per test sample from the
+        array form of the results."""
+
+        if self.marginal_probabilities is None:
+            return []
+
+        test_set = self.test_set
+        class_names = self.training_set.class_names
+        interp_coeffs = self.training_set.interpolation_coefficients
+        if interp_coeffs is not None:
+            interp_coeffs = np.array( interp_coeffs )
+
+        results = [None] * len( self.marginal_probabilities )
+        for test_samp_index, class_index in enumerate( self.predicted_class_indices ):
+            result = SingleSampleClassification()
+            if class_index >= 0:
+                result.normalization_factor = self.normalization_factors[ test_samp_index ]
+                result.marginal_probabilities = self.marginal_probabilities[ test_samp_index ]
+                result.predicted_label = class_names[ class_index ]
+                if interp_coeffs is not None:
+                    result.predicted_value = \
+                        np.sum( result.marginal_probabilities * interp_coeffs )
+
+            result.sample_group_id = test_set._contiguous_sample_group_ids[ test_samp_index ]
+            result.sample_sequence_id = test_set._contiguous_sample_sequence_ids[ test_samp_index ]
+            result.num_samples_per_group = test_set.num_samples_per_group
+            result.name = test_set._contiguous_sample_names[ test_samp_index ]
+            result.ground_truth_label = test_set._contiguous_ground_truth_labels[ test_samp_index ]
+            result.ground_truth_value = test_set._contiguous_ground_truth_values[ test_samp_index ]
+            result.split_number = self.split_number
+            results[ test_samp_index ] = result
+        return results
+
     #==============================================================    
     def __str__( self ):
         outstr = '<' + self.__class__.__name__
@@ -639,13 +985,26 @@ class FeatureSpaceClassification( _FeatureSpacePrediction ):
     @classmethod
     @output_railroad_switch
     def NewWND5( cls, training_set, test_set, feature_weights=None, name=None, split_number=None,
-                quiet=False, error_bars=False ):
+                quiet=False, error_bars=False, memory_budget=None, distance_method='cdist' ):
         """The equivalent of the "wndcharm classify" command in the command line implementation
         of WND-CHARM. Input a training set, a test set, and feature weights, and returns a
-        new instance of a FeatureSpaceClassification, with self.individual_results
-        filled with a new instances of SingleSampleClassification.
+        new instance of a FeatureSpaceClassification. Marginal probabilities, normalization
+        factors and predicted classes for the whole test set are stored in array form
+        on the returned object; self.individual_results gets filled with new instances
+        of SingleSampleClassification the first time it's accessed.
+
+        If feature_weights == None: use 1's as weights.
 
-        If feature_weights == None: use 1's as weights."""
+        memory_budget - int, optional. Approximate number of bytes the distance
+            computation may use. If given, the distance matrix is never materialized
+            whole; test samples (and training samples, if necessary) are streamed
+            through in blocks. Neither feature space needs to be in memory as a whole
+            for this, so memory-mapped feature spaces (see FeatureSpace.NewFromBinary)
+            get paged in as needed. See WND5BlockedClassSimilarities.
+
+        distance_method - 'cdist' (default) or 'gemm'. The latter computes distances
+            via BLAS matrix multiply, using training set squared norms cached on the
+            training FeatureSpace. See WND5SquaredDistances."""
 
         # type checking
         if not isinstance( training_set, FeatureSpace ):
@@ -661,8 +1020,8 @@ class FeatureSpaceClassification( _FeatureSpacePrediction ):
         if feature_weights is not None and test_set.feature_names != feature_weights.feature_names:
             raise ValueError( "Can't classify, features in test set don't match features in weights. Try translating feature names from old style to new, or performing a FeatureReduce()" )
 
-        # ignore divides => dist matrices with 0's down the diagonal will have nan's
-        # which should be ahndled by the mask
+        # ignore divides => dist matrices with 0's down the diagonal will have inf's
+        # which are handled as collisions by WND5ClassSimilarities
         np.seterr( under='ignore', divide='ignore' )
 
         n_feats = len( training_set.feature_names )
@@ -682,80 +1041,48 @@ class FeatureSpaceClassification( _FeatureSpacePrediction ):
             if test_set.num_samples_per_group > 1:
                 print "Performing tiled classification."
 
-        # Any collisions? (i.e., where the distance from test sample to training sample
-        # is below machine epsilon, i.e., 2.2204e-16
-        epsilon = np.finfo( np.float ).eps
-        import numpy.ma as ma
-
-        # Create slicer for training set class boundaries
-        slice_list = []
-        start_index = 0
-        for n_class_train_samps in training_set.class_sizes:
-            end_index = start_index + n_class_train_samps
-            slice_list.append( slice( start_index, end_index ) )
-            start_index = end_index
-
         # Create distance matrix:
-        # result dist_mat where rows => train samps and cols => test_samps
-        wts = np.array( feature_weights.values )
-        w_train_featspace = training_set.data_matrix * wts
-        if training_set is test_set:
-            from scipy.spatial.distance import pdist
-            from scipy.spatial.distance import squareform
-            raw_dist_mat = squareform( pdist( w_train_featspace, 'sqeuclidean' ) )
-            dist_mat = ma.masked_less_equal( raw_dist_mat, epsilon, False )
+        # result dist_mat where rows => test samps and cols => train samps
+        # Weighting in the training set's precision keeps float32 feature spaces float32
+        wts = np.array( feature_weights.values, dtype=training_set.data_matrix.dtype )
+        if distance_method == 'gemm':
+            train_sq_norms = training_set.WeightedSquaredNorms( wts )
         else:
-            from scipy.spatial.distance import cdist
-            w_test_featspace = test_set.data_matrix * wts
-            raw_dist_mat = cdist( w_train_featspace, w_test_featspace, 'sqeuclidean' )
-            dist_mat = ma.masked_less_equal( raw_dist_mat, epsilon, False )
+            train_sq_norms = None
+        if memory_budget is not None:
+            sums, counts = WND5BlockedClassSimilarities( test_set.data_matrix,
+                    training_set.data_matrix, wts, training_set.class_sizes, memory_budget,
+                    distance_method=distance_method, train_sq_norms=train_sq_norms )
+        else:
+            w_train_featspace = training_set.data_matrix * wts
+            if training_set is test_set:
+                w_test_featspace = w_train_featspace
+            else:
+                w_test_featspace = test_set.data_matrix * wts
+            dist_mat = WND5SquaredDistances( w_test_featspace, w_train_featspace,
+                    distance_method, train_sq_norms=train_sq_norms,
+                    same_samples=( training_set is test_set ) )
+            sums, counts = WND5ClassSimilarities( dist_mat, training_set.class_sizes )
+            del dist_mat
 
-        # Create marginal probabilities from distance matrix:
-        similarity_mat = np.power( dist_mat, -5 ).T
+        # Create marginal probabilities from per-class similarities, all test samples at once:
+        split_result.normalization_factors, split_result.marginal_probabilities, \
+                split_result.predicted_class_indices = WND5MarginalProbabilities( sums, counts )
 
-        for test_samp_index, test_samp_sims in enumerate( similarity_mat ):
-            result = SingleSampleClassification()
-            per_class_sims_list = [ test_samp_sims[ class_slice ] \
-                    for class_slice in slice_list ]
-            class_siml_means = []
-            for class_sims in per_class_sims_list:
-                try:
-                    val = class_sims.compressed().mean()
-                except FloatingPointError:
-                    # mean of empty slice raises floating point error
-                    val = np.nan
-                class_siml_means.append( val )
-
-            class_siml_means = np.array( class_siml_means )
-            if not np.any( np.isnan( class_siml_means ) ):
-                result.normalization_factor = class_siml_means.sum()
-                result.marginal_probabilities = \
-                    class_siml_means / result.normalization_factor
-                result.predicted_label = \
-                    training_set.class_names[ result.marginal_probabilities.argmax() ]
-
-            result.sample_group_id = test_set._contiguous_sample_group_ids[ test_samp_index ]
-            result.sample_sequence_id = test_set._contiguous_sample_sequence_ids[ test_samp_index ]
-            result.num_samples_per_group = test_set.num_samples_per_group
-            result.name = test_set._contiguous_sample_names[ test_samp_index ]
-            result.ground_truth_label = test_set._contiguous_ground_truth_labels[ test_samp_index ]
-            result.ground_truth_value = test_set._contiguous_ground_truth_values[ test_samp_index ]
-            result.split_number = split_number
-            split_result.individual_results.append( result )
+        # Per-sample SingleSampleClassification instances get built the first time
+        # someone asks for split_result.individual_results
+        split_result.individual_results = None
 
         # Predicted value via class coefficients, if applicable
         if training_set.interpolation_coefficients is not None:
-            predicted_values = []
-            ground_truth_values = []
-            for result in split_result.individual_results:
-                if result.marginal_probabilities is not None:
-                    result.predicted_value = np.sum( result.marginal_probabilities * \
-                                                 training_set.interpolation_coefficients )
-                    predicted_values.append( result.predicted_value )
-                    ground_truth_values.append( result.ground_truth_value )
-            if predicted_values:
-                split_result.predicted_values = predicted_values
-                split_result.ground_truth_values = ground_truth_values
+            called = split_result.predicted_class_indices >= 0
+            if np.any( called ):
+                interp_coeffs = np.array( training_set.interpolation_coefficients )
+                split_result.predicted_values = list( ( \
+                        split_result.marginal_probabilities[ called ] * interp_coeffs ).sum( axis=1 ) )
+                gt_vals = test_set._contiguous_ground_truth_values
+                split_result.ground_truth_values = \
+                        [ gt_vals[i] for i in np.flatnonzero( called ) ]
 
         # TILING SECTION:
         # Create a whole image classification result that
@@ -798,6 +1125,132 @@ class FeatureSpaceClassification( _FeatureSpacePrediction ):
         np.seterr (all='raise')
         return split_result
 
+#=================================================================================
+class WND5Model( object ):
+    """A WND5 classifier "compiled" once from a training set and feature weights,
+    for classifying samples one at a time (or a batch at a time) with as little
+    per-call overhead as possible. The weighted training matrix, class boundaries,
+    interpolation coefficients and, for distance_method='gemm', the training sample
+    squared norms are computed once and held on to, so each call
+    to PredictOne()/PredictMany() only computes distances and marginal probabilities.
+
+    Input values must already be reduced to the model's features (in the same order)
+    and normalized against the training set."""
+
+    #==============================================================
+    def __init__( self, training_set, feature_weights=None, distance_method='cdist' ):
+        """training_set - FeatureSpace
+        feature_weights - FeatureWeights, if None use 1's as weights.
+        distance_method - 'cdist' or 'gemm', see WND5SquaredDistances."""
+
+        if not isinstance( training_set, FeatureSpace ):
+            raise ValueError( 'First argument to WND5Model must be of type "FeatureSpace", you gave a {0}'.format( type( training_set ).__name__ ) )
+        if feature_weights is not None and not isinstance( feature_weights, FeatureWeights ):
+            raise ValueError( 'Second argument to WND5Model must be of type "FeatureWeights" or derived class, you gave a {0}'.format( type( feature_weights ).__name__ ) )
+        if feature_weights is not None and training_set.feature_names != feature_weights.feature_names:
+            raise ValueError( "Can't build model, features in training set don't match features in weights. Try translating feature names from old style to new, or performing a FeatureReduce()" )
+
+        self.training_set = training_set
+        self.feature_weights = feature_weights
+        self.feature_names = list( training_set.feature_names )
+        self.num_features = len( self.feature_names )
+        self.class_names = list( training_set.class_names )
+        self.class_sizes = list( training_set.class_sizes )
+
+        if feature_weights is None:
+            self.weights = np.ones( ( self.num_features, ), dtype=training_set.data_matrix.dtype )
+        else:
+            self.weights = np.array( feature_weights.values, dtype=training_set.data_matrix.dtype )
+
+        self.w_train_featspace = np.ascontiguousarray( training_set.data_matrix * self.weights )
+
+        if distance_method not in ( 'cdist', 'gemm' ):
+            raise ValueError( "Distance method must be either 'cdist' or 'gemm', you gave '{0}'".format( distance_method ) )
+        self.distance_method = distance_method
+        if distance_method == 'gemm':
+            self.train_sq_norms = training_set.WeightedSquaredNorms( self.weights )
+        else:
+            self.train_sq_norms = None
+
+        if training_set.interpolation_coefficients is not None:
+            self.interpolation_coefficients = np.array( training_set.interpolation_coefficients )
+        else:
+            self.interpolation_coefficients = None
+
+    #==============================================================
+    def __repr__( self ):
+        return '<{0} {1} classes, {2} training samples, {3} features>'.format(
+            self.__class__.__name__, len( self.class_names ),
+            self.w_train_featspace.shape[0], self.num_features )
+
+    #==============================================================
+    def Predict( self, data_matrix ):
+        """Array form of WND5 results for a batch of samples.
+
+        data_matrix - array-like, shape (samples, features)
+
+        Returns: (normalization_factors, marginal_probabilities, predicted_class_indices)
+            as in WND5MarginalProbabilities()."""
+
+        data_matrix = np.asarray( data_matrix, dtype=self.weights.dtype )
+        if data_matrix.ndim != 2 or data_matrix.shape[1] != self.num_features:
+            raise ValueError( "Can't classify, expected samples with {0} features, got array with shape {1}".format( self.num_features, data_matrix.shape ) )
+
+        dist_mat = WND5SquaredDistances( data_matrix * self.weights, self.w_train_featspace,
+                self.distance_method, train_sq_norms=self.train_sq_norms )
+        sums, counts = WND5ClassSimilarities( dist_mat, self.class_sizes )
+        return WND5MarginalProbabilities( sums, counts )
+
+    #==============================================================
+    def PredictMany( self, data_matrix ):
+        """data_matrix - array-like, shape (samples, features)
+
+        Returns: list of SingleSampleClassification, one per row."""
+
+        norm_factors, marg_probs, class_indices = self.Predict( data_matrix )
+
+        results = []
+        for samp_index, class_index in enumerate( class_indices ):
+            result = SingleSampleClassification()
+            if class_index >= 0:
+                result.normalization_factor = norm_factors[ samp_index ]
+                result.marginal_probabilities = marg_probs[ samp_index ]
+                result.predicted_label = self.class_names[ class_index ]
+                if self.interpolation_coefficients is not None:
+                    result.predicted_value = \
+                        np.sum( result.marginal_probabilities * self.interpolation_coefficients )
+            results.append( result )
+        return results
+
+    #==============================================================
+    def PredictOne( self, values ):
+        """values - FeatureVector or 1-D array-like of feature values
+
+        Returns: SingleSampleClassification"""
+
+        from .FeatureVector import FeatureVector
+        feature_vector = None
+        if isinstance( values, FeatureVector ):
+            feature_vector = values
+            if feature_vector.feature_names is not None and \
+                    list( feature_vector.feature_names ) != self.feature_names:
+                raise ValueError( "Can't classify, features in feature vector don't match features in model. Try performing a FeatureReduce()" )
+            values = feature_vector.values
+
+        values = np.asarray( values, dtype=self.weights.dtype )
+        if values.ndim != 1:
+            raise ValueError( "Can't classify, expected a 1-D array of feature values, got array with shape {0}".format( values.shape ) )
+
+        result = self.PredictMany( values[ np.newaxis, : ] )[0]
+        if feature_vector is not None:
+            result.name = feature_vector.name
+            result.source_filepath = feature_vector.source_filepath
+            result.ground_truth_label = feature_vector.ground_truth_label
+            result.ground_truth_value = feature_vector.ground_truth_value
+            result.sample_group_id = feature_vector.sample_group_id
+            result.sample_sequence_id = feature_vector.sample_sequence_id
+        return result
+
 #=================================================================================
 class FeatureSpaceRegression( _FeatureSpacePrediction ):
     """Container for SingleSampleRegression instances.
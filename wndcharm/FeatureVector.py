@@ -26,6 +26,7 @@
 
 import wndcharm
 import numpy as np
+from collections import OrderedDict
 from . import feature_vector_major_version
 from . import feature_vector_minor_version_from_num_features
 from .utils import normalize_by_columns
@@ -36,6 +37,10 @@ class WrongFeatureSetVersionError( Exception ):
 class IncompleteFeatureSetError( Exception ):
     pass
 
+class SigFileBusyError( Exception ):
+    """Another process is calculating the features for this sig file, see WORMfile"""
+    pass
+
 from . import feature_vector_minor_version_from_num_features
 ver_to_num_feats_map = dict((v, k) for k, v in feature_vector_minor_version_from_num_features.iteritems())
 from . import feature_vector_num_features_from_vector_version
@@ -74,24 +79,431 @@ from . import feature_vector_num_features_from_vector_version
 # instead implement with a global dict to serve as feature plan cache
 
 plan_cache = {}
+# The same plans, keyed by the feature name list (or set) they were asked for, so samples
+# that share a feature list skip splitting every name into its group. Keys can hold
+# thousands of names, so only the feature_list_plan_cache_size most recently used
+# lists are kept.
+feature_list_plan_cache = OrderedDict()
+feature_list_plan_cache_size = 8
 
 def GenerateFeatureComputationPlan( feature_list, name='custom' ):
     """Takes list of feature strings and chops off bin number at the first
-    space on right, e.g., "feature alg (transform()) [bin]" """
+    space on right, e.g., "feature alg (transform()) [bin]"
+
+    Plans are memoized: the same plan object is returned for every feature list
+    that needs the same feature groups."""
+
+    global plan_cache, feature_list_plan_cache
+    if isinstance( feature_list, (set, frozenset) ):
+        list_key = frozenset( feature_list )
+    else:
+        list_key = tuple( feature_list )
+    obj = feature_list_plan_cache.pop( list_key, None )
+    if obj is None:
+        feature_groups = frozenset( [ feat.rsplit(" ",1)[0] for feat in feature_list ] )
+
+        if feature_groups in plan_cache:
+            obj = plan_cache[ feature_groups ]
+        else:
+            obj = wndcharm.FeatureComputationPlan( name )
+            for family in feature_groups:
+                obj.add( family )
+            plan_cache[ feature_groups ] = obj
 
-    global plan_cache
-    feature_groups = frozenset( [ feat.rsplit(" ",1)[0] for feat in feature_list ] )
+        if len( feature_list_plan_cache ) >= feature_list_plan_cache_size:
+            feature_list_plan_cache.popitem( last=False )
 
-    if feature_groups in plan_cache:
-        return plan_cache[ feature_groups ]
+    # (re)inserted as the most recently used
+    feature_list_plan_cache[ list_key ] = obj
+    return obj
 
-    obj = wndcharm.FeatureComputationPlan( name )
-    for family in feature_groups:
-        obj.add( family )
+#================================================================
+def NewFeatureComputationPlanExecutor( comp_plan, n_threads=None ):
+    """Returns an executor for the given wndcharm.FeatureComputationPlan.
+
+    n_threads - None or 1 for the serial executor, otherwise the number of threads the
+        concurrent executor uses on each image; True = one per online core."""
+
+    if n_threads is True:
+        return wndcharm.FeatureComputationPlanConcurrentExecutor( comp_plan, 0 )
+    if n_threads is not None and n_threads != 1:
+        return wndcharm.FeatureComputationPlanConcurrentExecutor( comp_plan, int( n_threads ) )
+    return wndcharm.FeatureComputationPlanExecutor( comp_plan )
+
+#================================================================
+#: numpy dtype of the per-node records from an instrumented feature computation, one
+#: per transform or feature group computed for a sample:
+#: sample - index of the sample (row); name - node name, e.g. 'Zernike Coefficients (Fourier ())';
+#: transform - True for image transforms, False for feature groups; wall_time and cpu_time
+#: in seconds; width, height - size of the node's input image; output_bytes - size of the
+#: transformed image or feature values the node produced.
+node_timing_dtype = np.dtype( [ ('sample', np.int64), ('name', object), ('transform', bool),
+        ('wall_time', np.float64), ('cpu_time', np.float64), ('width', np.uint32),
+        ('height', np.uint32), ('output_bytes', np.int64) ] )
+
+def PlanExecutorTimings( plan_exec ):
+    """Returns the records of the last run of an executor that had record_timings set,
+    as a numpy structured array of node_timing_dtype in execution order."""
+
+    transform_type = wndcharm.ComputationTask.ImageTransformTask
+    return np.array( [ ( t.feature_mat_row, t.node_name, t.task_type == transform_type,
+        t.wall_time, t.cpu_time, t.width, t.height, t.output_bytes ) for t in plan_exec.timings ],
+        dtype=node_timing_dtype )
+
+def SummarizeTimings( timings ):
+    """Aggregates records of node_timing_dtype (e.g., FeatureVector.timings or
+    FeatureSpace.timings) by node name, across samples.
+
+    Returns a numpy structured array with fields name, transform, count, wall_time,
+    cpu_time and output_bytes (totals), most wall time first."""
+
+    summary_dtype = np.dtype( [ ('name', object), ('transform', bool), ('count', np.int64),
+        ('wall_time', np.float64), ('cpu_time', np.float64), ('output_bytes', np.int64) ] )
+    totals = {}
+    for t in timings:
+        if t['name'] not in totals:
+            totals[ t['name'] ] = [ t['name'], t['transform'], 0, 0.0, 0.0, 0 ]
+        total = totals[ t['name'] ]
+        total[2] += 1
+        total[3] += t['wall_time']
+        total[4] += t['cpu_time']
+        total[5] += t['output_bytes']
+    summary = np.array( [ tuple( total ) for total in totals.itervalues() ], dtype=summary_dtype )
+    return summary[ np.argsort( -summary['wall_time'], kind='mergesort' ) ]
+
+#================================================================
+def FeatureGroupNodes( feature_name ):
+    """Returns the names of the feature computation plan nodes that have to run to
+    compute the given feature or feature group, in order of execution: the transform chain
+    followed by the feature group itself, i.e., the node names used in timing records.
+
+    E.g., 'Zernike Coefficients (Chebyshev (Fourier ())) [12]' ->
+    [ 'Fourier', 'Fourier->Chebyshev', 'Zernike Coefficients (Chebyshev (Fourier ()))' ]
+
+    Parses names the same way as the C++ FeatureNames::getGroupByName()."""
+
+    group_name = feature_name.split( '[' )[0].strip()
+    # Every segment followed by a '(' is a transform; whatever is in the inner-most
+    # parentheses is an optional channel.
+    transform_names = [ t.strip( ' ()' ) for t in group_name.split( '(' )[1:-1] ]
+    transform_names = [ t for t in reversed( transform_names ) if t ]
+    nodes = [ '->'.join( transform_names[ : i+1 ] ) for i in xrange( len( transform_names ) ) ]
+    nodes.append( group_name )
+    return nodes
+
+def FeatureNodeCosts( feature_names, timings=None, width=None, height=None ):
+    """Returns a dict mapping the name of every plan node needed to compute the given
+    features (see FeatureGroupNodes()) to its cost in seconds per sample.
+
+    timings - node_timing_dtype records or their SummarizeTimings(); measured mean wall
+        times are used for the nodes they contain.
+    width, height - size of the images to be computed; the remaining nodes are estimated
+        from the calibrated run-times of the C++ tasks (ComputationTask::cost_estimate())."""
+
+    node_costs = {}
+    if timings is not None and len( timings ) > 0:
+        if 'count' not in timings.dtype.names:
+            timings = SummarizeTimings( timings )
+        for t in timings:
+            node_costs[ t['name'] ] = t['wall_time'] / t['count']
+
+    group_names = set( [ name.split( '[' )[0].strip() for name in feature_names ] )
+    for group_name in group_names:
+        nodes = FeatureGroupNodes( group_name )
+        for i, node in enumerate( nodes ):
+            if node in node_costs:
+                continue
+            if width is None or height is None:
+                raise ValueError( 'No timings for "{0}" (needed by "{1}"), specify the image width and height to estimate its cost.'.format( node, group_name ) )
+            if i == len( nodes ) - 1:
+                task = wndcharm.FeatureNames.getFeatureAlgorithmByName( group_name.split( '(' )[0].strip() )
+            else:
+                task = wndcharm.FeatureNames.getTransformByName( node.rsplit( '->', 1 )[-1] )
+            if task is None:
+                raise ValueError( 'Unknown feature algorithm in "{0}"'.format( group_name ) )
+            node_costs[ node ] = task.cost_estimate( width, height )
+    return node_costs
+
+#================================================================
+# Every sample with a standard feature set version (e.g., "4.2") has the same
+# feature names in the same order. Instead of each FeatureVector holding its own list
+# of thousands of strings, they share one canonical list per version, which
+# also turns feature name comparisons into an identity check. A table is filled in
+# from the first complete feature vector seen for its version, whether loaded from
+# a sig file or computed via the StdFeatureComputationPlans.
+# N.B.: Interned tables are shared; never modify them in place.
+feature_name_tables = {}
+# Names joined by newlines, for fast comparisons against binary sig file text blocks
+feature_name_table_texts = {}
+
+def InternFeatureNames( feature_names, feature_set_version ):
+    """Returns the canonical list of feature names for the given standard feature
+    set version if feature_names matches it, otherwise returns feature_names
+    unchanged."""
+
+    global feature_name_tables, feature_name_table_texts
+    if feature_set_version not in feature_vector_num_features_from_vector_version:
+        return feature_names
+
+    table = feature_name_tables.get( feature_set_version )
+    if table is None:
+        if len( feature_names ) != \
+                feature_vector_num_features_from_vector_version[ feature_set_version ]:
+            return feature_names
+        table = feature_name_tables[ feature_set_version ] = list( feature_names )
+        feature_name_table_texts[ feature_set_version ] = '\n'.join( table )
+        return table
+
+    if feature_names is table or feature_names == table:
+        return table
+    return feature_names
+
+def IsInternedFeatureNames( feature_names ):
+    """True if feature_names is one of the shared canonical tables."""
+    return any( feature_names is table for table in feature_name_tables.itervalues() )
+
+# Name -> column index dicts for the interned tables, keyed by feature set version
+feature_name_table_indexes = {}
+
+def FeatureNameIndexMap( feature_names ):
+    """Returns a dict mapping each feature name to its (first) index in feature_names,
+    to look up columns without calling feature_names.index() over and over.
+    Maps for interned tables are computed once and cached."""
+
+    global feature_name_table_indexes
+    for version, table in feature_name_tables.iteritems():
+        if feature_names is table:
+            if version not in feature_name_table_indexes:
+                feature_name_table_indexes[ version ] = FeatureNameIndexMap( list( table ) )
+            return feature_name_table_indexes[ version ]
+
+    index_map = {}
+    for i, name in enumerate( feature_names ):
+        index_map.setdefault( name, i )
+    return index_map
+
+#================================================================
+# Binary signature (.bsig) files:
+#   magic               8 bytes, "WNDBSIG1" (last byte is the format version)
+#   header              "<4sIQ": numpy dtype string of the values padded with NULs,
+#                       number of features, length in bytes of the text block
+#   text block          newline-separated: feature set version, source file
+#                       path, then one feature name per line
+#   padding             NULs to the next multiple of 8 bytes
+#   values              contiguous block of n_features numbers of the given dtype
+binary_sig_magic = 'WNDBSIG1'
+binary_sig_header = '<4sIQ'
+
+def WriteBinarySigFile( path, feature_set_version, source_filepath, feature_names, values,
+        dtype=np.float64 ):
+    """Write features to a binary signature file, see format above.
+    dtype - np.float64 (default) or np.float32"""
+
+    import struct
+    dtype = np.dtype( dtype ).newbyteorder( '<' )
+    if len( feature_names ) != len( values ):
+        raise ValueError( "Can't write {0}: got {1} feature names but {2} values".format(
+            path, len( feature_names ), len( values ) ) )
+
+    text = '\n'.join( [ str( feature_set_version ), str( source_filepath ) ] + \
+            [ str( name ) for name in feature_names ] )
+    header = binary_sig_magic + struct.pack( binary_sig_header, dtype.str,
+            len( values ), len( text ) )
+    n_pad = -( len( header ) + len( text ) ) % 8
+
+    with open( path, 'wb' ) as out:
+        out.write( header )
+        out.write( text )
+        out.write( '\0' * n_pad )
+        np.asarray( values, dtype=dtype ).tofile( out )
+
+def ReadBinarySigFile( path ):
+    """Read a binary signature file written by WriteBinarySigFile().
+
+    Returns: (feature_set_version, source_filepath, feature_names, values)"""
+
+    import struct
+    with open( path, 'rb' ) as infile:
+        magic = infile.read( len( binary_sig_magic ) )
+        if magic != binary_sig_magic:
+            raise ValueError( "{0} is not a WND-CHARM binary signature file".format( path ) )
+        header_len = struct.calcsize( binary_sig_header )
+        dtype_str, n_features, text_len = \
+                struct.unpack( binary_sig_header, infile.read( header_len ) )
+        text = infile.read( text_len )
+        infile.seek( -( len( binary_sig_magic ) + header_len + text_len ) % 8, 1 )
+        values = np.fromfile( infile, dtype=np.dtype( dtype_str.rstrip( '\0' ) ),
+                count=n_features )
+
+    lines = text.split( '\n', 2 )
+    if len( lines ) < 2:
+        raise ValueError( "{0} has a corrupted header".format( path ) )
+    fs_version, source_filepath = lines[0], lines[1]
+    names_text = lines[2] if len( lines ) == 3 else ''
+
+    # Skip splitting out thousands of names if they're the same as a standard set's:
+    if feature_name_table_texts.get( fs_version ) == names_text:
+        names = feature_name_tables[ fs_version ]
+    else:
+        names = names_text.split( '\n' ) if n_features else []
+    if len( names ) != n_features:
+        raise IncompleteFeatureSetError( 'In file {0}, expecting {1} feature names, but got {2}'.format(
+            path, n_features, len( names ) ) )
+    if len( values ) != n_features:
+        raise IncompleteFeatureSetError( 'In file {0}, expecting {1} features, but got {2}'.format(
+            path, n_features, len( values ) ) )
+
+    return fs_version, source_filepath, names, values
+
+def WriteFileAtomically( path, write_function, mode=None ):
+    """Calls write_function( temp_path ) to write a temporary file in the same directory
+    as path, then renames it to path, so other processes see either the old file or the
+    complete new one, never a partial one. If the writer dies, only a hidden ".tmp"
+    file is left behind.
+
+    mode - permissions for the new file, default is what open() gives a new file"""
+
+    import os
+    from socket import gethostname
+
+    directory, filename = os.path.split( path )
+    # host and pid make the name unique among processes sharing the directory over NFS
+    temp_path = os.path.join( directory, '.{0}.{1}.{2}.tmp'.format(
+            filename, gethostname(), os.getpid() ) )
+    try:
+        write_function( temp_path )
+        if mode is not None:
+            os.chmod( temp_path, mode )
+        os.rename( temp_path, path )
+    except:
+        if os.path.exists( temp_path ):
+            os.unlink( temp_path )
+        raise
+
+class WORMfile( object ):
+    """Write-once-read-many file shared by concurrent processes, possibly on different
+    machines sharing a filesystem, where only one process writes. Uses the same fcntl
+    locks as the C++ WORMfile (src/wndchrm_src/WORMfile.h), so Python and wndchrm
+    processes can calculate features in the same directory at the same time.
+
+    The file is:
+        missing - the constructor creates it (empty) with a write lock, status = WR
+        busy - another process has a write lock on it, status = BUSY
+        stale - empty with no lock (its writer died); it's write locked, status = WR
+        finished - not empty and can be read locked, status = RD
+
+    With status WR, call finish( write_function ) to write the file (atomically, see
+    WriteFileAtomically()), or release() to give it up, which deletes it."""
+
+    RD = 'read'
+    WR = 'write'
+    BUSY = 'busy'
+
+    #: The C++ WORMfile marks finished files read-only (WORMfile::def_read_mode)
+    read_mode = 0444
+
+    def __init__( self, path, wait=False ):
+        """wait - If the file is busy, block until its writer is done with it,
+            then try again."""
+
+        self.path = path
+        self.status = None
+        self._fd = None
+        while True:
+            self._open()
+            if self.status != self.BUSY or not wait:
+                break
+            self._wait()
 
-    plan_cache[ feature_groups ] = obj
-    return obj
+    def _open( self ):
+        import os, errno, fcntl
 
+        # Can't read lock a file unless it's open for reading, and can't write lock it
+        # unless it's open for writing. Finished files are read-only, so try reading first.
+        try:
+            fd = os.open( self.path, os.O_RDONLY )
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            try:
+                try:
+                    fcntl.lockf( fd, fcntl.LOCK_SH | fcntl.LOCK_NB )
+                except IOError as e:
+                    if e.errno not in ( errno.EACCES, errno.EAGAIN ):
+                        raise
+                    self.status = self.BUSY
+                    return
+                if os.fstat( fd ).st_size > 0:
+                    self.status = self.RD
+                    return
+            finally:
+                os.close( fd )
+
+        # Missing or stale
+        fd = os.open( self.path, os.O_RDWR | os.O_CREAT, 0600 )
+        try:
+            fcntl.lockf( fd, fcntl.LOCK_EX | fcntl.LOCK_NB )
+        except IOError as e:
+            os.close( fd )
+            if e.errno not in ( errno.EACCES, errno.EAGAIN ):
+                raise
+            self.status = self.BUSY
+            return
+        # Lost the race to a writer that finished in the meantime?
+        if os.fstat( fd ).st_size > 0:
+            os.close( fd )
+            self.status = self.RD
+            return
+        self._fd = fd
+        self.status = self.WR
+
+    def _wait( self ):
+        import os, errno, fcntl
+        try:
+            fd = os.open( self.path, os.O_RDONLY )
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            # Blocks until the writer's lock is gone
+            fcntl.lockf( fd, fcntl.LOCK_SH )
+        finally:
+            os.close( fd )
+
+    def finish( self, write_function ):
+        """Writes the file with write_function( temp_path ) and releases the write lock."""
+        if self.status != self.WR:
+            raise ValueError( 'WORMfile "{0}" is not locked for writing (status {1})'.format(
+                self.path, self.status ) )
+        import os
+        try:
+            WriteFileAtomically( self.path, write_function, self.read_mode )
+        except:
+            self.release()
+            raise
+        # The lock was on the empty file that was just replaced
+        os.close( self._fd )
+        self._fd = None
+        self.status = self.RD
+
+    def release( self ):
+        """Gives up a write lock without writing the file, deleting the empty file."""
+        if self.status != self.WR:
+            return
+        import os
+        # Deleted while locked, so no other process can have started writing it
+        try:
+            os.unlink( self.path )
+        finally:
+            os.close( self._fd )
+            self._fd = None
+            self.status = None
+
+    def __del__( self ):
+        # Like the C++ WORMfile destructor
+        self.release()
 
 #############################################################################
 # class definition of FeatureVector
@@ -229,8 +641,8 @@ class FeatureVector( object ):
     r'(?P<color>-c)?',
     # long feature set:
     r'(?P<long>-l)?',
-    # extension: .sig or .pysig
-    r'\.(?:py)?sig$' ] ) )
+    # extension: .sig, .pysig or .bsig
+    r'\.(?:py|b)?sig$' ] ) )
 
     members_of_type_int = [ 'tile_row_index', 'tile_col_index', 'tile_num_rows', 'tile_num_cols', 'sample_group_id', 'sample_sequence_id', 'x','y','w','h','z','z_delta', 'downsample', 'pixel_intensity_mean', 'pixel_intensity_stdev',]
 
@@ -255,6 +667,10 @@ class FeatureVector( object ):
         self.preprocessed_local_px_plane = None
         #: str - Path to .sig file, in future hdf/sql file
         self.auxiliary_feature_storage = None
+        #: str - 'text' (default) or 'binary'. Format of the signature file written
+        #: by GenerateFeatures()/ToSigFile() when no path is given. A binary .bsig
+        #: file is always preferred over a text .sig when loading, if both exist.
+        self.sig_file_format = 'text'
         #: str - prefix string to which sampling options will be appended to form .sig filepath
         self.basename = None
         #: ground_truth_label is stringified ground truth
@@ -312,6 +728,9 @@ class FeatureVector( object ):
         self.long = None
         self.feature_set_version = None
         self.feature_computation_plan = None
+        #: numpy structured array of node_timing_dtype: per-node timings from
+        #: GenerateFeatures( record_timings=True ), None otherwise
+        self.timings = None
 
         self.Update( **kwargs )
 
@@ -401,7 +820,7 @@ class FeatureVector( object ):
                 minor = 0
             else:
                 # FIXME: If features are out of order, should have a minor version of 0
-                minor = feature_vector_minor_version_from_num_features[ len( self.feature_names ) ]
+                minor = feature_vector_minor_version_from_num_features[ self.num_features ]
         else:
             if not self.long:
                 if not self.color:
@@ -467,6 +886,12 @@ class FeatureVector( object ):
 			#  if a feature_computation_plan isFinal, then just copy the reference
             elif key == 'feature_computation_plan' and self_namespace[key].isFinalized():
                 new_obj_namespace[key] = self_namespace[key]
+            #  interned feature name tables are shared, not copied
+            elif key == 'feature_names' and IsInternedFeatureNames( self_namespace[key] ):
+                new_obj_namespace[key] = self_namespace[key]
+            #  pixel planes aren't modified once they're made, and may be big
+            elif key.endswith( '_px_plane' ):
+                new_obj_namespace[key] = self_namespace[key]
             else:
                 new_obj_namespace[key] = deepcopy( self_namespace[key] )
         return new_obj
@@ -478,9 +903,12 @@ class FeatureVector( object ):
         return self.Derive()
 
     #==============================================================
-    def GenerateSigFilepath( self ):
+    def GenerateSigFilepath( self, binary=None ):
         """The C implementation of wndchrm placed feature metadata
-        in the filename in a specific order, recreated here."""
+        in the filename in a specific order, recreated here.
+
+        binary - bool, use the binary ".bsig" extension instead of ".sig". Default
+            is to go by self.sig_file_format."""
 
         from os.path import splitext
 
@@ -528,6 +956,10 @@ class FeatureVector( object ):
         if self.long:
             base += '-l'
 
+        if binary is None:
+            binary = self.sig_file_format == 'binary'
+        if binary:
+            return base + '.bsig'
         return base + '.sig'
 
     #================================================================
@@ -665,15 +1097,74 @@ class FeatureVector( object ):
             self.preprocessed_local_px_plane = preprocessed_local_px_plane
         return preprocessed_local_px_plane
 
+    #================================================================
+    def GetFeatureComputationPlan( self ):
+        """Returns the wndcharm.FeatureComputationPlan that calculates the features
+        this sample asks for: the user-assigned self.feature_computation_plan if provided,
+        otherwise the plan for self.feature_set_version, which is then kept in
+        self.feature_computation_plan.
+
+        If self.feature_names is a reduced or custom list, the plan only contains the
+        feature groups (and their transforms) it needs, whatever the feature set version,
+        and replaces an assigned plan that calculates more than that, e.g., the
+        standard plan of the sample this one was derived from."""
+
+        std_num_features = feature_vector_num_features_from_vector_version.get( self.feature_set_version )
+        if self.feature_names and len( self.feature_names ) != std_num_features:
+            minimal_plan = GenerateFeatureComputationPlan( self.feature_names )
+            # If it takes every feature group anyway, the standard plan will do.
+            if minimal_plan.n_features != std_num_features:
+                # An assigned plan with fewer features is a plan for the features
+                # that LoadSigFile() couldn't find, keep it.
+                if self.feature_computation_plan is None or \
+                        self.feature_computation_plan.n_features > minimal_plan.n_features:
+                    self.feature_computation_plan = minimal_plan
+                return self.feature_computation_plan
+
+        # Use user-assigned feature computation plan, if provided:
+        if self.feature_computation_plan != None:
+            # I Commented the following out because the computation plan may only reflect
+            # the subset of features that haven't been calculated yet:
+            # comp_plan.feature_vec_type seems to only contain the minor version
+            # i.e., number after the '.'. Assume major version is the latest.
+            #self.feature_set_version = '{0}.{1}'.format( 
+            #        feature_vector_major_version, comp_plan.feature_vec_type )
+            return self.feature_computation_plan
+
+        major, minor = self.feature_set_version.split('.')
+        if minor == '0':
+            comp_plan = GenerateFeatureComputationPlan( self.feature_names )
+        elif minor == '1':
+            comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSet()
+        elif minor == '2':
+            comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSetLong()
+        elif minor == '3':
+            comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSetColor()
+        elif minor == '4':
+            comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSetLongColor()
+        else:
+            raise ValueError( "Not sure which features you want." )
+        self.feature_computation_plan = comp_plan
+        return comp_plan
+
     #================================================================
     def GenerateFeatures( self, write_to_disk=True, update_samp_opts_from_pathname=None,
-            cache=False, quiet=True ):
+            cache=False, quiet=True, n_threads=None, record_timings=False,
+            wait_for_sig_file=True ):
         """@brief Loads precalculated features, or calculates new ones, based on which instance
         attributes have been set, and what their values are.
 
         write_to_disk (bool) - save features to text file which by convention has extension ".sig"
         update_samp_opts_from_pathname (bool) - If a .sig file exists, don't overwrite
             self's sampling options from the sampling options in the .sig file pathname.
+        n_threads (int) - Number of threads used to execute the feature computation plan
+            on this one image. None or 1 = serial; True = one per online core.
+        record_timings (bool) - Keep the time, input image size and output size of every
+            transform and feature group calculated in self.timings (see node_timing_dtype)
+        wait_for_sig_file (bool) - With write_to_disk, the sig file is claimed first
+            (see WORMfile), so processes sharing the directory don't calculate the same
+            features. If another process has claimed it, wait for it to finish and load
+            its features, or if False, raise SigFileBusyError.
  
         Returns self for convenience."""
 
@@ -687,105 +1178,115 @@ class FeatureVector( object ):
         if self.values is not None and len( self.values ) != 0:
             return self
 
-        partial_load = False
-        try:
-            self.LoadSigFile( quiet=quiet, \
-                    update_samp_opts_from_pathname=update_samp_opts_from_pathname )
-            # FIXME: Here's where you'd calculate a small subset of features
-            # and see if they match what was loaded from file. The file could be corrupted
-            # incomplete, or calculated with different options, e.g., -S1441
+        def LoadExistingFeatures():
+            """Returns None if the features were loaded, otherwise the LoadSigFile() error"""
+            try:
+                self.LoadSigFile( quiet=quiet, \
+                        update_samp_opts_from_pathname=update_samp_opts_from_pathname )
+                # FIXME: Here's where you'd calculate a small subset of features
+                # and see if they match what was loaded from file. The file could be corrupted
+                # incomplete, or calculated with different options, e.g., -S1441
+                return None
+            except IOError:
+                # File doesn't exist
+                return IOError
+            except WrongFeatureSetVersionError:
+                # File has different feature version than desired
+                return WrongFeatureSetVersionError
+            except IncompleteFeatureSetError:
+                # LoadSigFile should create a FeatureComputationPlan
+                if not quiet:
+                    print 'Loaded {0} features from disk for sample "{1}"'.format(
+                            len( self.temp_names ), self.name )
+                return IncompleteFeatureSetError
+
+        load_error = LoadExistingFeatures()
+        if load_error is None:
             return self
-        except IOError:
-            # File doesn't exist
-            pass
-        except WrongFeatureSetVersionError:
-            # File has different feature version than desired
-            pass
-        except IncompleteFeatureSetError:
-            # LoadSigFile should create a FeatureComputationPlan
-            if not quiet:
-                print 'Loaded {0} features from disk for sample "{1}"'.format(
-                        len( self.temp_names ), self.name )
-            partial_load = True
-
-        # All hope is lost, calculate features.
-
-        # Use user-assigned feature computation plan, if provided=quiet:
-        if self.feature_computation_plan != None:
-            comp_plan = self.feature_computation_plan
 
-            # I Commented the following out because the computation plan may only reflect
-            # the subset of features that haven't been calculated yet:
-            # comp_plan.feature_vec_type seems to only contain the minor version
-            # i.e., number after the '.'. Assume major version is the latest.
-            #self.feature_set_version = '{0}.{1}'.format( 
-            #        feature_vector_major_version, comp_plan.feature_vec_type )
-        else:
-            major, minor = self.feature_set_version.split('.')
-            if minor == '0':
-                comp_plan = GenerateFeatureComputationPlan( self.feature_names )
-            elif minor == '1':
-                comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSet()
-            elif minor == '2':
-                comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSetLong()
-            elif minor == '3':
-                comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSetColor()
-            elif minor == '4':
-                comp_plan = wndcharm.StdFeatureComputationPlans.getFeatureSetLongColor()
-            else:
-                raise ValueError( "Not sure which features you want." )
-            self.feature_computation_plan = comp_plan
-
-        if self.rot is not None:
-            # void Rotate (const ImageMatrix &matrix_IN, double angle);
-            raise NotImplementedError( "FIXME: Implement rotations." )
+        # Claim the sig file before calculating, so processes sharing the directory
+        # don't calculate the same features.
+        wormfile = None
+        if write_to_disk:
+            wormfile = WORMfile( self.auxiliary_feature_storage or self.GenerateSigFilepath(),
+                    wait=wait_for_sig_file )
+            if wormfile.status == WORMfile.BUSY:
+                raise SigFileBusyError( 'Features for "{0}" are being calculated by another process'.format(
+                        wormfile.path ) )
+            if wormfile.status == WORMfile.RD and load_error is IOError:
+                # Another process wrote it since we looked
+                load_error = LoadExistingFeatures()
+                if load_error is None:
+                    return self
+            if wormfile.status != WORMfile.WR:
+                # A finished file with the wrong version or too few features, which is
+                # replaced below without a claim (see WriteFileAtomically())
+                wormfile = None
+        partial_load = load_error is IncompleteFeatureSetError
 
-        px_plane = self.GetPreprocessedLocalPixelPlane( cache=cache )
+        try:
+            # All hope is lost, calculate features.
 
-        # pre-allocate space where the features will be stored (C++ std::vector<double>)
-        tmp_vec = wndcharm.DoubleVector( comp_plan.n_features )
+            comp_plan = self.GetFeatureComputationPlan()
 
-        # Get an executor for this plan and run it
-        plan_exec = wndcharm.FeatureComputationPlanExecutor( comp_plan )
-        if not quiet:
-            print "CALCULATING FEATURES FROM", self.source_filepath, self
-        plan_exec.run( px_plane, tmp_vec, 0 )
+            if self.rot is not None:
+                # void Rotate (const ImageMatrix &matrix_IN, double angle);
+                raise NotImplementedError( "FIXME: Implement rotations." )
 
-        # get the feature names from the plan
-        comp_names = [ comp_plan.getFeatureNameByIndex(i) for i in xrange( comp_plan.n_features ) ]
+            px_plane = self.GetPreprocessedLocalPixelPlane( cache=cache )
 
-        # convert std::vector<double> to native python list of floats
-        comp_vals = np.array( list( tmp_vec ) )
+            # pre-allocate space where the features will be stored; the executor writes
+            # them straight into this numpy array (viewed as a 1 x n_features matrix)
+            comp_vals = np.empty( comp_plan.n_features )
 
-        # Feature Reduction/Reorder step:
-        # Feature computation may give more features than are asked for by user, or out of order.
-        if self.feature_names:
-            if self.feature_names != comp_names:
+            # Get an executor for this plan and run it
+            plan_exec = NewFeatureComputationPlanExecutor( comp_plan, n_threads )
+            plan_exec.record_timings = record_timings
+            if not quiet:
+                print "CALCULATING FEATURES FROM", self.source_filepath, self
+            plan_exec.run_to_array( px_plane, comp_vals.reshape( 1, -1 ), 0 )
+            if record_timings:
+                self.timings = PlanExecutorTimings( plan_exec )
+
+            # get the feature names from the plan
+            comp_names = InternFeatureNames( [ comp_plan.getFeatureNameByIndex(i) \
+                    for i in xrange( comp_plan.n_features ) ], self.feature_set_version )
+
+            # Feature Reduction/Reorder step:
+            # Feature computation may give more features than are asked for by user, or out of order.
+            if self.feature_names and \
+                    self.feature_names is not comp_names and self.feature_names != comp_names:
                 if partial_load:
                     # If we're here, we've already loaded some but not all of the features
                     # we need. Take what we've already loaded and slap it at the end 
                     # of what was calculated.  Doesn't matter if some of the features are
-                    # redundant, because the .index() method returns the first item it finds.
+                    # redundant, because the index map points to the first one it finds.
                     # FIXME: if there is overlap between what was loaded and what was 
                     # calculated, check to see that they match.
-                    comp_names.extend( self.temp_names )
+                    comp_names = comp_names + list( self.temp_names )
                     comp_vals = np.hstack( (comp_vals,  self.temp_values ))
                     del self.temp_names
                     del self.temp_values
-            comp_vals = np.array( [ comp_vals[ comp_names.index( name ) ] for name in self.feature_names ] )
-        self.feature_names = comp_names
-        self.values = comp_vals
-
-        if not quiet:
-            if len( comp_vals ) != len( self ):
-                print "CALCULATED {0} TOTAL FEATURES, REDUCED TO: {1}".format(
-                        len( comp_vals ), self )
+                name_index = FeatureNameIndexMap( comp_names )
+                comp_vals = comp_vals[ [ name_index[ name ] for name in self.feature_names ] ]
             else:
-                print "CALCULATED: " + str( self )
+                self.feature_names = comp_names
+            self.values = comp_vals
 
-        # FIXME: maybe write to disk BEFORE feature reduce? Provide flag to let user decide?
-        if write_to_disk:
-            self.ToSigFile( quiet=quiet )
+            if not quiet:
+                if len( comp_vals ) != len( self ):
+                    print "CALCULATED {0} TOTAL FEATURES, REDUCED TO: {1}".format(
+                            len( comp_vals ), self )
+                else:
+                    print "CALCULATED: " + str( self )
+
+            # FIXME: maybe write to disk BEFORE feature reduce? Provide flag to let user decide?
+            if write_to_disk:
+                self.ToSigFile( quiet=quiet, wormfile=wormfile )
+        finally:
+            # Unless the file was written, give up the claim
+            if wormfile is not None:
+                wormfile.release()
 
         # Feature names need to be modified for their sampling options.
         # Base case is that channel goes in the innermost parentheses, but really it's not
@@ -852,7 +1353,8 @@ class FeatureVector( object ):
             raise ValueError( err.format( self.__class__.__name__, self.name ) )
         else:
             # Recalculate my feature space according to maxima/minima in reference_features
-            if reference_features.feature_names != self.feature_names:
+            if reference_features.feature_names is not self.feature_names and \
+                    reference_features.feature_names != self.feature_names:
                 err_str = "Can't normalize {0} \"{1}\" against {2} \"{3}\": Features don't match.".format(
                   self.__class__.__name__, self.name,
                     reference_features.__class__.__name__, reference_features.name )
@@ -939,7 +1441,8 @@ class FeatureVector( object ):
         newdata[ 'feature_names' ] = requested_features
         newdata[ 'num_features' ] = num_features
 
-        new_order = [ self.feature_names.index( name ) for name in requested_features ]
+        name_index = FeatureNameIndexMap( self.feature_names )
+        new_order = [ name_index[ name ] for name in requested_features ]
 
         # N.B. 1-D version used here, contrast with FeatureSpace.FeatureReduce() implementation.
         newdata[ 'values' ] = self.values[ new_order ]
@@ -967,6 +1470,20 @@ class FeatureVector( object ):
             print "FEATURE VECTOR REDUCED (orig len {0}): {1}".format( orig_len, newfv )
         return newfv
 
+    #================================================================
+    def _CheckSigFileFeatureSetVersion( self, input_fs_version, path ):
+        """Raise WrongFeatureSetVersionError if the major version of the features
+        in a sig file is different from the desired one."""
+
+        if not self.feature_set_version:
+            return
+        input_fs_major_ver, input_fs_minor_ver = input_fs_version.split('.')
+        desired_fs_major_ver, desired_fs_minor_ver = self.feature_set_version.split('.')
+        if desired_fs_major_ver != input_fs_major_ver:
+            errstr = 'Desired feature set version "{0}" different from "{1}" in file {2}'
+            raise WrongFeatureSetVersionError(
+                    errstr.format( desired_fs_major_ver, input_fs_major_ver, path ) )
+
     #================================================================
     def LoadSigFile( self, sigfile_path=None, update_samp_opts_from_pathname=None,
             quiet=False ):
@@ -977,10 +1494,15 @@ class FeatureVector( object ):
 
         Compare what got loaded from file with desired.
 
+        Files with the extension ".bsig" are read as binary signature files (see
+        WriteBinarySigFile()). If no path is given, a binary signature file
+        is used in preference to the text one if it exists.
+
         update_samp_opts_from_pathname (bool) - If a .sig file exists, don't overwrite
             self's sampling options from the sampling options in the .sig file pathname"""
 
         import re
+        from os.path import exists, getsize
 
         if sigfile_path:
             path = sigfile_path
@@ -991,78 +1513,88 @@ class FeatureVector( object ):
             if update_samp_opts_from_pathname is None:
                 update_samp_opts_from_pathname = True
         else:
-            path = self.GenerateSigFilepath()
+            path = self.GenerateSigFilepath( binary=True )
+            if not exists( path ) or getsize( path ) == 0:
+                path = self.GenerateSigFilepath( binary=False )
             update_samp_opts_from_pathname = False
 
-        with open( path ) as infile:
-
-            # First, check to see feature set versions match:
-            firstline = infile.readline()
-            m = re.match( r'^(\S+)\s*(\S+)?$', firstline )
-            if not m:
-                # Deprecate old-style naming support anyway, those features are pretty buggy
-                # -CEC 20150104
-                raise ValueError( "Can't read a WND-CHARM feature set version from file {0}. File my be corrupted or calculated by an unsupported version of WND-CHARM. Recalculate features and try again.".format( path ) )
-                #input_major = 1
-                # For ANCIENT sig files, with features calculated YEARS ago
-                # Cleanup for legacy edge case:
-                # Set the minor version to the vector type based on # of features
-                # The minor versions should always specify vector types, but for
-                # version 1 vectors, the version is not written to the file.
-                #self.feature_set_version = "1." + str(
-                #feature_vector_minor_version_from_num_features_v1.get( len( self.values ),0 ) )
-                # This is really slow:
-                #for i, name in enumerate( names ):
-                #retval = wndcharm.FeatureNames.getFeatureInfoByName( name )
-                #if retval:
-                #    self.feature_names[i] = retval.name
-                #else:
-                # self.feature_names[i] = name
-                # Use pure Python for old-style name translation
-                #from wndcharm import FeatureNameMap
-                #self.feature_names = FeatureNameMap.TranslateToNewStyle( feature_names )
-            else:
-                class_id, input_fs_version = m.group( 1, 2 )
-                input_fs_major_ver, input_fs_minor_ver = input_fs_version.split('.')
-            if self.feature_set_version:
-                desired_fs_major_ver, desired_fs_minor_ver = self.feature_set_version.split('.')
-                if desired_fs_major_ver != input_fs_major_ver:
-                    errstr = 'Desired feature set version "{0}" different from "{1}" in file {2}'
-                    raise WrongFeatureSetVersionError(
-                            errstr.format( desired_fs_major_ver, input_fs_major_ver, path ) )
-
-            # 2nd line is path to original tiff file, which may be nonsense
-            # if sig file was moved post-feature calculation.
-            orig_source_tiff_path = infile.readline()
-            if self.source_filepath is None:
-                from os.path import exists
-                # FIXME: Maybe try a few directories?
-                if exists( orig_source_tiff_path ):
-                    self.source_filepath = orig_source_tiff_path
-
-            # Load data into local variables:
-            # Loading these sig files takes way too long.
-            # Try to speed up by being more explicit
-            # hardcode the num features check:
-            if input_fs_version in feature_vector_num_features_from_vector_version:
-                # We know exactly how long these feature vectors are gonna be
-                # so allocate just the right amount of memory:
-                vec_len = feature_vector_num_features_from_vector_version [input_fs_version]
-                values = np.zeros( vec_len )
-                names = [None] * vec_len
-                for i, line in enumerate( infile ):
-                    val, name = line.rstrip('\n').split( None, 1 )
-                    values[i] = float( val )
-                    names[i] = name
-                # Check that we read the correct number of features from the file
-                if i != vec_len - 1:
-                    raise IncompleteFeatureSetError( 'In file {}, expecting {} features, but got {}'.format (path,vec_len,i) )
-            else:
-                # If we're here, then we don't know for sure how many features are
-                # in this file, so do it the old, slow way:
-                values, names = \
-                    zip( *[ line.split( None, 1 ) for line in infile.read().splitlines() ] )
-                values = [ float(_) for _ in values ]
+        # Empty files are being written by another process (see WORMfile),
+        # or were left by a process that died before finishing them.
+        if exists( path ) and getsize( path ) == 0:
+            raise IOError( 'Signature file "{0}" is empty'.format( path ) )
+
+        if path.endswith( '.bsig' ):
+            input_fs_version, orig_source_tiff_path, names, values = ReadBinarySigFile( path )
+            self._CheckSigFileFeatureSetVersion( input_fs_version, path )
+            if self.source_filepath is None and exists( orig_source_tiff_path ):
+                self.source_filepath = orig_source_tiff_path
+        else:
+            with open( path ) as infile:
+
+                # First, check to see feature set versions match:
+                firstline = infile.readline()
+                m = re.match( r'^(\S+)\s*(\S+)?$', firstline )
+                if not m:
+                    # Deprecate old-style naming support anyway, those features are pretty buggy
+                    # -CEC 20150104
+                    raise ValueError( "Can't read a WND-CHARM feature set version from file {0}. File my be corrupted or calculated by an unsupported version of WND-CHARM. Recalculate features and try again.".format( path ) )
+                    #input_major = 1
+                    # For ANCIENT sig files, with features calculated YEARS ago
+                    # Cleanup for legacy edge case:
+                    # Set the minor version to the vector type based on # of features
+                    # The minor versions should always specify vector types, but for
+                    # version 1 vectors, the version is not written to the file.
+                    #self.feature_set_version = "1." + str(
+                    #feature_vector_minor_version_from_num_features_v1.get( len( self.values ),0 ) )
+                    # This is really slow:
+                    #for i, name in enumerate( names ):
+                    #retval = wndcharm.FeatureNames.getFeatureInfoByName( name )
+                    #if retval:
+                    #    self.feature_names[i] = retval.name
+                    #else:
+                    # self.feature_names[i] = name
+                    # Use pure Python for old-style name translation
+                    #from wndcharm import FeatureNameMap
+                    #self.feature_names = FeatureNameMap.TranslateToNewStyle( feature_names )
+                else:
+                    class_id, input_fs_version = m.group( 1, 2 )
+                self._CheckSigFileFeatureSetVersion( input_fs_version, path )
+
+                # 2nd line is path to original tiff file, which may be nonsense
+                # if sig file was moved post-feature calculation.
+                orig_source_tiff_path = infile.readline()
+                if self.source_filepath is None:
+                    # FIXME: Maybe try a few directories?
+                    if exists( orig_source_tiff_path ):
+                        self.source_filepath = orig_source_tiff_path
+
+                # Load data into local variables:
+                # Loading these sig files takes way too long.
+                # Try to speed up by being more explicit
+                # hardcode the num features check:
+                if input_fs_version in feature_vector_num_features_from_vector_version:
+                    # We know exactly how long these feature vectors are gonna be
+                    # so allocate just the right amount of memory:
+                    vec_len = feature_vector_num_features_from_vector_version [input_fs_version]
+                    values = np.zeros( vec_len )
+                    names = [None] * vec_len
+                    for i, line in enumerate( infile ):
+                        val, name = line.rstrip('\n').split( None, 1 )
+                        values[i] = float( val )
+                        names[i] = name
+                    # Check that we read the correct number of features from the file
+                    if i != vec_len - 1:
+                        raise IncompleteFeatureSetError( 'In file {}, expecting {} features, but got {}'.format (path,vec_len,i) )
+                else:
+                    # If we're here, then we don't know for sure how many features are
+                    # in this file, so do it the old, slow way:
+                    values, names = \
+                        zip( *[ line.split( None, 1 ) for line in infile.read().splitlines() ] )
+                    values = [ float(_) for _ in values ]
+                    names = list( names )
+
+        # Share the canonical name list if this is a standard feature set
+        names = InternFeatureNames( names, input_fs_version )
 
         # Re: converting read-in text to numpy array of floats, np.fromstring is a 3x PIG:
         # %timeit out = np.array( [ float(val) for val in thing ] )
@@ -1078,9 +1610,9 @@ class FeatureVector( object ):
 
         # Check to see that the sig file contains all of the desired features:
         if self.feature_names:
-            if self.feature_names == names:
-                # Perfect! Do nothing.
-                pass
+            if self.feature_names is names or self.feature_names == names:
+                # Perfect! Keep the (possibly interned) names that were loaded.
+                self.feature_names = names
             else:
                 features_we_want = set( self.feature_names )
                 features_we_have = set( names )
@@ -1098,12 +1630,13 @@ class FeatureVector( object ):
                 else:
                     # If you get to here, we loaded MORE features than asked for,
                     # or the features are out of desired order, or both.
-                    values = np.array( [ values[ names.index( name ) ] for name in self.feature_names ] )
+                    name_index = FeatureNameIndexMap( names )
+                    values = np.array( [ values[ name_index[ name ] ] for name in self.feature_names ] )
         else:
             # User didn't indicate what features they wanted.
             # It's a pretty dangerous assumption to make that the user just "got 
             # what they wanted" by loading the file, but danger is my ... middle name ;-)
-            self.feature_names = list( names )
+            self.feature_names = names
 
         #self.values = np.array( [ float( val ) for val in values ] )
         self.values = values
@@ -1134,13 +1667,24 @@ class FeatureVector( object ):
         return cls( source_filepath=image_path ).LoadSigFile( sigfile_path, quiet=quiet )
 
     #================================================================
-    def ToSigFile( self, path=None, quiet=False ):
-        """Write features C-WND-CHARM .sig file format
+    def ToSigFile( self, path=None, quiet=False, dtype=np.float64, wormfile=None ):
+        """Write features C-WND-CHARM .sig file format, or the binary signature file
+        format (see WriteBinarySigFile()) if the path ends in ".bsig".
 
         If filepath is specified, you get to name it whatever you want and put it
         wherever you want. Otherwise, it's named according to convention and placed 
-        next to the image file in its directory."""
+        next to the image file in its directory, as a text or binary file depending
+        on self.sig_file_format.
+
+        The file is written under a temporary name and renamed when complete, so
+        readers never see a partial file (see WriteFileAtomically()).
+
+        dtype - precision of the values in a binary file, np.float64 or np.float32
+        wormfile - WORMfile write-locked for the path (see GenerateFeatures()),
+            which is finished by writing the file"""
         from os.path import exists
+        if wormfile is not None:
+            path = wormfile.path
         if path:
             self.auxiliary_feature_storage = path
         elif self.auxiliary_feature_storage is not None:
@@ -1149,18 +1693,29 @@ class FeatureVector( object ):
             path = self.auxiliary_feature_storage = self.GenerateSigFilepath()
 
         if not quiet:
-            if exists( path ):
+            if exists( path ) and wormfile is None:
                 print "Overwriting {0}".format( path )
             else:
                 print 'Writing signature file "{0}"'.format( path )
-        
-        with open( path, "w" ) as out:
-            # FIXME: line 1 contains class membership and version
-            # Just hardcode the class membership for now.
-            out.write( "0\t{0}\n".format( self.feature_set_version ) )
-            out.write( "{0}\n".format( self.source_filepath ) )
-            for val, name in zip( self.values, self.feature_names ):
-                out.write( "{0:0.8g}\t{1}\n".format( val, name ) )
+
+        if path.endswith( '.bsig' ):
+            def write( temp_path ):
+                WriteBinarySigFile( temp_path, self.feature_set_version, self.source_filepath,
+                        self.feature_names, self.values, dtype )
+        else:
+            def write( temp_path ):
+                with open( temp_path, "w" ) as out:
+                    # FIXME: line 1 contains class membership and version
+                    # Just hardcode the class membership for now.
+                    out.write( "0\t{0}\n".format( self.feature_set_version ) )
+                    out.write( "{0}\n".format( self.source_filepath ) )
+                    for val, name in zip( self.values, self.feature_names ):
+                        out.write( "{0:0.8g}\t{1}\n".format( val, name ) )
+
+        if wormfile is not None:
+            wormfile.finish( write )
+        else:
+            WriteFileAtomically( path, write )
 
 # end definition class FeatureVector
 
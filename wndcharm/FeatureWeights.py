@@ -180,7 +180,8 @@ class FisherFeatureWeights( FeatureWeights ):
         oldsettings = np.seterr(all='ignore')
 
         # 1D matrix 1 * F
-        population_means = np.mean( fs.data_matrix, axis = 0 )
+        # N.B.: Accumulate in double precision even if fs is single precision
+        population_means = np.mean( fs.data_matrix, axis = 0, dtype=np.float64 )
 
         # WARNING, this only works in python27:
         # ====================================
@@ -207,9 +208,11 @@ class FisherFeatureWeights( FeatureWeights ):
 
         class_index = 0
         for class_feature_matrix in fs.data_list:
-            intra_class_means[ class_index ] = np.mean( class_feature_matrix, axis=0 )
+            intra_class_means[ class_index ] = np.mean( class_feature_matrix, axis=0,
+                    dtype=np.float64 )
             # Note that by default, numpy divides by N instead of the more common N-1, hence ddof=1.
-            intra_class_variances[ class_index ] = np.var( class_feature_matrix, axis=0, ddof=1 )
+            intra_class_variances[ class_index ] = np.var( class_feature_matrix, axis=0, ddof=1,
+                    dtype=np.float64 )
             class_index += 1
 
         # 1D matrix 1 * F
@@ -302,6 +305,97 @@ class FisherFeatureWeights( FeatureWeights ):
 
         return new_weights
 
+    #================================================================
+    def ThresholdByCost( self, time_budget, timings=None, width=None, height=None,
+            num_features_to_be_used=None, node_costs=None ):
+        """Returns an instance of a FisherFeatureWeights class with the features that
+        maximize the summed Fisher score while costing at most time_budget seconds per
+        sample to compute, in order of rank.
+
+        Features are computed a whole feature group at a time, and groups share the
+        transforms they're computed on, so the cost of a feature is the cost of the nodes
+        in its feature group's computation plan (see FeatureVector.FeatureGroupNodes())
+        that aren't already paid for by features selected before it. Features are selected
+        greedily by the Fisher score gained per second of added cost.
+
+        time_budget - seconds per sample
+        timings, width, height - cost profile, see FeatureVector.FeatureNodeCosts()
+        num_features_to_be_used - optional maximum number of features
+        node_costs - dict of node name -> seconds, used instead of timings/width/height"""
+
+        from .FeatureVector import FeatureGroupNodes, FeatureNodeCosts
+
+        if time_budget <= 0:
+            raise ValueError( 'Time budget must be positive (got {0})'.format( time_budget ) )
+        if num_features_to_be_used is None:
+            num_features_to_be_used = len( self.values )
+        elif num_features_to_be_used > len( self.values ) or num_features_to_be_used <= 0:
+            raise ValueError('Cannot reduce a set of {0} feature weights to requested {1} features.'.\
+                                  format( len( self.values ), num_features_to_be_used ) )
+        if node_costs is None:
+            node_costs = FeatureNodeCosts( self.feature_names, timings, width, height )
+
+        # Non-zero weighted features by feature group, best first
+        groups = {}
+        for val, name in sorted( zip( self.values, self.feature_names ), reverse=True ):
+            if val > 0:
+                groups.setdefault( name.split( '[' )[0].strip(), [] ).append( (val, name) )
+        group_nodes = dict( [ (group, FeatureGroupNodes( group )) for group in groups ] )
+        for group, nodes in group_nodes.iteritems():
+            for node in nodes:
+                if node not in node_costs:
+                    raise ValueError( 'No cost for "{0}" (needed by "{1}")'.format( node, group ) )
+
+        def SelectGreedily( groups ):
+            selected = []
+            paid_nodes = set()
+            spent = 0.0
+            remaining = dict( [ (group, list( feats )) for group, feats in groups.iteritems() ] )
+            while len( selected ) < num_features_to_be_used:
+                n_slots = num_features_to_be_used - len( selected )
+                best = None
+                for group, feats in sorted( remaining.iteritems() ):
+                    if not feats:
+                        continue
+                    cost = sum( [ node_costs[ node ] for node in group_nodes[ group ] if node not in paid_nodes ] )
+                    if spent + cost > time_budget:
+                        continue
+                    gain = sum( [ val for val, name in feats[ : n_slots ] ] )
+                    # Already paid for features are free
+                    ratio = gain / cost if cost > 0 else float( 'inf' )
+                    if best is None or (ratio, gain) > best[:2]:
+                        best = ( ratio, gain, group, cost )
+                if best is None:
+                    break
+                ratio, gain, group, cost = best
+                selected.extend( remaining[ group ][ : n_slots ] )
+                del remaining[ group ][ : n_slots ]
+                paid_nodes.update( group_nodes[ group ] )
+                spent += cost
+            return selected
+
+        selected = SelectGreedily( groups )
+        # The greedy choice can pass over a single group worth more than everything
+        # it picked instead, so also consider taking only the best group.
+        best_single = []
+        for group in groups:
+            feats = SelectGreedily( { group: groups[ group ] } )
+            if sum( [ v for v, n in feats ] ) > sum( [ v for v, n in best_single ] ):
+                best_single = feats
+        if sum( [ v for v, n in best_single ] ) > sum( [ v for v, n in selected ] ):
+            selected = best_single
+
+        if not selected:
+            raise ValueError( "Can't select any features from \"{0}\" within a budget of {1} seconds.".format( self.name, time_budget ) )
+
+        new_weights = self.__class__()
+        selected.sort( key=lambda a: a[0], reverse=True )
+        new_weights.values, new_weights.feature_names =\
+          [ list( unzipped_tuple ) for unzipped_tuple in zip( *selected ) ]
+        new_weights.associated_feature_space = self.associated_feature_space
+
+        return new_weights
+
 
     #================================================================
     @output_railroad_switch
@@ -39,10 +39,55 @@ class PicklableSwig(object):
 
 class ImageMatrix(_SWIG_ImageMatrix, PicklableSwig):
 
+    # ImageMatrix fields that go along with a shared pixel plane
+    shared_fields = ( 'source', 'bits', 'downsampled', 'norm_mean', 'norm_stdev' )
+    shared_pix_plane_count = 0
+
     def __init__(self, *args):
         self.args = args
         _SWIG_ImageMatrix.__init__(self)
 
+    def __getstate__(self):
+        """Pixels in POSIX shared memory (see share_pixels()) are pickled by name, so
+        they're mapped rather than copied when unpickled by another process on this
+        machine. Otherwise, only constructor args are pickled."""
+        state = PicklableSwig.__getstate__(self)
+        name = self.shared_pix_plane_name()
+        if name:
+            state['shared_pix_plane'] = ( name, self.width, self.height )
+            state['fields'] = dict( ( field, getattr( self, field ) ) for field in self.shared_fields )
+        return state
+
+    def __setstate__(self, state):
+        PicklableSwig.__setstate__(self, state)
+        if 'shared_pix_plane' in state:
+            name, width, height = state['shared_pix_plane']
+            if not self.open_shared_pix_plane( name, width, height ):
+                raise ValueError( 'Could not map shared pixel plane "{0}" ({1}x{2})'.format(
+                    name, width, height ) )
+            for field, value in state['fields'].iteritems():
+                setattr( self, field, value )
+
+    def share_pixels(self):
+        """Moves the grayscale pixel plane into POSIX shared memory, so other processes can
+        map it instead of getting a copy. Call unshare_pixels() when they're done with it.
+        Returns the name of the shared memory object, or None if the pixels can't be shared
+        (e.g. there aren't any, or it's a color image)."""
+        name = self.shared_pix_plane_name()
+        if name:
+            return name
+        from os import getpid
+        ImageMatrix.shared_pix_plane_count += 1
+        name = '/wndcharm-{0}-{1}'.format( getpid(), ImageMatrix.shared_pix_plane_count )
+        if not self.share_pix_plane( name ):
+            return None
+        return name
+
+    def unshare_pixels(self):
+        """Removes the name of the shared memory object holding the pixels, so no more
+        processes can map them. Processes that already have, and this one, keep them."""
+        return self.unlink_shared_pix_plane()
+
 class PyImageMatrix (ImageMatrix):
 	bytes_per_double = np.dtype(np.double).itemsize
 	def __init__(self):
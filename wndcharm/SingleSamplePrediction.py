@@ -253,7 +253,10 @@ class SingleSampleClassification( _SingleSamplePrediction ):
     def NewWND5( cls, training_set, feature_weights, test_samp, quiet=False ):
         """training_set - FeatureSpace
         feature_weights - FeatureWeights
-        test_samp - FeatureVector"""
+        test_samp - FeatureVector
+
+        When classifying many samples one at a time against the same training set,
+        build a FeatureSpacePrediction.WND5Model once and use its PredictOne() instead."""
 
         test_set = FeatureSpace.NewFromFeatureVector( test_samp )
         from .FeatureSpacePrediction import FeatureSpaceClassification
@@ -3,6 +3,9 @@
 %{
 /* Include in the generated wrapper file */
 /*typedef unsigned long size_t;*/
+#define SWIG_FILE_WITH_INIT
+#include <stdexcept>
+#include <new>
 #include "Tasks.h"
 %}
 /* Tell SWIG about size_t */
@@ -10,6 +13,42 @@
 
 %include "std_string.i"
 %include "std_vector.i"
+%include "numpy.i"
+%include "exception.i"
+
+%init %{
+   import_array();
+%}
+
+// FeatureComputationPlanExecutor::run_to_array() and run_rects_to_array() write features
+// directly into a C-contiguous 2-D numpy array of doubles
+%apply (double* INPLACE_ARRAY2, int DIM1, int DIM2) {(double *feature_mat_in, int n_rows, int n_cols)};
+// and raise ValueError if it's the wrong shape for the plan.  Errors computing the features,
+// including those from the worker threads of a concurrent executor, raise MemoryError or RuntimeError.
+%exception run_to_array {
+	try {
+		$action
+	} catch (const std::invalid_argument &e) {
+		SWIG_exception (SWIG_ValueError, e.what());
+	} catch (const std::bad_alloc &) {
+		SWIG_exception (SWIG_MemoryError, "Out of memory computing features");
+	} catch (const std::exception &e) {
+		SWIG_exception (SWIG_RuntimeError, e.what());
+	}
+}
+// run_rects_to_array() reads a N x 4 array of (x, y, width, height) regions
+%apply (int* IN_ARRAY2, int DIM1, int DIM2) {(int *rects_in, int n_rects, int rect_dims)};
+%exception run_rects_to_array {
+	try {
+		$action
+	} catch (const std::invalid_argument &e) {
+		SWIG_exception (SWIG_ValueError, e.what());
+	} catch (const std::bad_alloc &) {
+		SWIG_exception (SWIG_MemoryError, "Out of memory computing features");
+	} catch (const std::exception &e) {
+		SWIG_exception (SWIG_RuntimeError, e.what());
+	}
+}
 
 
 namespace std {
@@ -33,3 +72,8 @@ namespace std {
 }
 
 %include "Tasks.h"
+
+// FeatureComputationPlanExecutor::timings
+namespace std {
+   %template(NodeTimingVector) vector<NodeTiming>;
+}
@@ -220,10 +220,11 @@ def normalize_by_columns( feature_matrix, mins=None, maxs=None, means=None, stde
         nan_cols = (maxs - mins) == 0
     else:
         # Perform z-score normalization on feature space
+        # Accumulate in double precision even if feature_matrix is single precision
         if means is None:
-            means = feature_matrix.mean( axis=0 )
+            means = feature_matrix.mean( axis=0, dtype=np.float64 )
         if stdevs is None:
-            stdevs = feature_matrix.std( axis=0 )
+            stdevs = feature_matrix.std( axis=0, dtype=np.float64 )
         feature_matrix -= means
         feature_matrix /= stdevs
         nan_cols = stdevs == 0
@@ -390,51 +391,459 @@ def print_log_message( fv ):
     print outstr
     #logger.info( line )
 
-def WorkerFunction( fv ):
-    """Helper function used for parallel calculation of image features"""
-    fv.GenerateFeatures( write_to_disk=True, quiet=True )
+#: FeatureVector members that GenerateFeatures() may set, sent back from worker processes.
+#: Pixel planes and the feature computation plan stay behind in the worker.
+parallel_result_members = ( 'values', 'feature_names', 'name', 'source_filepath',
+    'auxiliary_feature_storage', 'original_px_plane_width', 'original_px_plane_height',
+    'preprocessed_full_px_plane_width', 'preprocessed_full_px_plane_height' )
+
+def WorkerResult( fv ):
+    """Helper function that packs up what parallel_compute() needs from a worker's sample"""
+    return dict( ( member, getattr( fv, member, None ) ) for member in parallel_result_members )
+
+def WorkerFunction( args ):
+    """Helper function used for parallel calculation of image features
+
+    Returns ( sample index, WorkerResult() or None, None or traceback string ).
+    Samples whose sig files another process is writing are skipped: ( index, None, None )."""
+    from .FeatureVector import SigFileBusyError
+    index, fv, write_to_disk = args
+    try:
+        fv.GenerateFeatures( write_to_disk=write_to_disk, quiet=True, wait_for_sig_file=False )
+    except SigFileBusyError:
+        return index, None, None
+    except Exception:
+        import traceback
+        return index, None, traceback.format_exc()
+    return index, WorkerResult( fv ), None
 
-def WorkerFunctionVerbose( fv ):
+def WorkerFunctionVerbose( args ):
     """Helper function used for parallel calculation of image features"""
+    from .FeatureVector import SigFileBusyError
+    index, fv, write_to_disk = args
     print_log_message( fv )
     try:
-        fv.GenerateFeatures( write_to_disk=True, quiet=False )
+        fv.GenerateFeatures( write_to_disk=write_to_disk, quiet=False, wait_for_sig_file=False )
+    except SigFileBusyError as e:
+        print e
+        return index, None, None
     except Exception:
-        import sys, traceback
-        print traceback.print_exc()
+        import traceback
+        error = traceback.format_exc()
+        print error
+        return index, None, error
+    return index, WorkerResult( fv ), None
 
-def parallel_compute( samples, n_jobs=True, quiet=True ):
-    """WND-CHARM implementation of symmetric multiprocessing, see:
-    https://en.wikipedia.org/wiki/Symmetric_multiprocessing"""
+def WorkerChunkFunction( args ):
+    """Helper function that runs a worker function on a chunk of tasks,
+    see imap_compute()"""
+    worker, tasks = args
+    return [ worker( task ) for task in tasks ]
 
-    from multiprocessing import cpu_count, Pool, log_to_stderr
+def print_progress( n_done, n_total, rate, eta ):
+    """Default progress callback for imap_compute()"""
+    print "Calculated features for {0}/{1} samples, {2:.2f} samples/s, {3:.0f} s left".format(
+            n_done, n_total, rate, eta )
 
-    import signal
-    if not quiet:
-        import logging
-        logger = log_to_stderr()
-        logger.setLevel(logging.INFO)
+#: The pool of worker processes shared by imap_compute()/parallel_compute() calls,
+#: and its number of processes
+feature_computation_pool = None
+feature_computation_pool_size = None
+
+def GetFeatureComputationPool( n_jobs=True ):
+    """Returns the module-level multiprocessing.Pool used to calculate features,
+    creating it if it doesn't exist yet or has a different number of processes.
+
+    n_jobs (int or bool, default True) - Number of worker processes, or one per CPU if True."""
+
+    global feature_computation_pool, feature_computation_pool_size
+    from multiprocessing import cpu_count, Pool
 
     if n_jobs == True:
         n_jobs = cpu_count()
+    if feature_computation_pool is not None and feature_computation_pool_size != n_jobs:
+        CloseFeatureComputationPool()
+    if feature_computation_pool is None:
+        feature_computation_pool = Pool( processes=n_jobs, initializer=init_worker )
+        feature_computation_pool_size = n_jobs
+    return feature_computation_pool
+
+def CloseFeatureComputationPool( terminate=False ):
+    """Shuts down the module-level feature computation pool, if there is one.
+    Its worker processes finish what they're doing first unless terminate is True."""
+
+    global feature_computation_pool, feature_computation_pool_size
+    pool = feature_computation_pool
+    feature_computation_pool = feature_computation_pool_size = None
+    if pool is None:
+        return
+    if terminate:
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+
+import atexit
+atexit.register( CloseFeatureComputationPool, True )
+
+def TiffDimensions( path ):
+    """Reads the width and height of the first image in a TIFF or BigTIFF file from
+    its header, without decoding any pixels.
+
+    Returns:
+        ( width, height ), or None if path isn't a TIFF file or has no image size."""
 
-    pool = Pool( processes=n_jobs, initializer=init_worker )
+    import struct
+
+    try:
+        with open( path, 'rb' ) as tif:
+            header = tif.read( 16 )
+            if header[:2] == 'II':
+                order = '<'
+            elif header[:2] == 'MM':
+                order = '>'
+            else:
+                return None
+            magic, = struct.unpack( order + 'H', header[2:4] )
+            if magic == 42:
+                offset, = struct.unpack( order + 'I', header[4:8] )
+                count_fmt, entry_fmt, entry_size = 'H', 'HHI4s', 12
+            elif magic == 43:
+                offset, = struct.unpack( order + 'Q', header[8:16] )
+                count_fmt, entry_fmt, entry_size = 'Q', 'HHQ8s', 20
+            else:
+                return None
+            tif.seek( offset )
+            count_size = struct.calcsize( count_fmt )
+            n_entries, = struct.unpack( order + count_fmt, tif.read( count_size ) )
+            entries = tif.read( n_entries * entry_size )
+    except ( IOError, struct.error ):
+        return None
+
+    # ImageWidth and ImageLength tags, SHORT, LONG or LONG8
+    value_fmts = { 3: 'H', 4: 'I', 16: 'Q' }
+    dims = {}
+    for i in xrange( len( entries ) // entry_size ):
+        tag, value_type, count, value = struct.unpack( order + entry_fmt,
+                entries[ i * entry_size : ( i + 1 ) * entry_size ] )
+        if tag in ( 256, 257 ) and value_type in value_fmts:
+            value_fmt = value_fmts[ value_type ]
+            dims[ tag ], = struct.unpack( order + value_fmt, value[ : struct.calcsize( value_fmt ) ] )
+    if 256 not in dims or 257 not in dims:
+        return None
+    return dims[256], dims[257]
+
+def EstimateSampleCost( fv, cache=None ):
+    """Estimates what it'll take a worker process to calculate a sample's features,
+    from the size of its image (read from the TIFF header if the pixels aren't in memory),
+    its preprocessing and tiling options, and its feature computation plan.
+
+    Arguments:
+        fv (wndcharm.FeatureVector):
+            The sample. It isn't modified.
+        cache (dict, default None):
+            Image sizes and plans looked up so far, pass the same dict when estimating
+            many samples.
+
+    Returns:
+        ( seconds, bytes ): The serial run-time predicted by the plan
+        (ComputationPlan::predicted_cost()), and the peak memory for the grayscale pixel
+        planes GenerateFeatures() makes and the plan's transforms
+        (ComputationPlan::predicted_peak_bytes()). ( 0, 0 ) if the features are already there
+        or will be loaded from a .sig file, None if the image size can't be determined."""
+
+    from os.path import exists
+
+    if cache is None:
+        cache = {}
+    if fv.values is not None and len( fv.values ) != 0:
+        return 0, 0
+    try:
+        if exists( fv.GenerateSigFilepath( binary=True ) ) or \
+                exists( fv.GenerateSigFilepath( binary=False ) ):
+            return 0, 0
+    except ValueError:
+        pass
+
+    # ImageMatrix pixels are doubles.
+    px_bytes = np.dtype( np.float64 ).itemsize
+
+    # Pixel planes already in memory don't cost the worker anything.
+    px_plane_bytes = 0
+    if fv.preprocessed_full_px_plane is not None:
+        width, height = fv.preprocessed_full_px_plane.width, fv.preprocessed_full_px_plane.height
+    else:
+        if fv.original_px_plane is not None:
+            width, height = fv.original_px_plane.width, fv.original_px_plane.height
+        elif isinstance( fv.source_filepath, basestring ):
+            if fv.source_filepath not in cache:
+                cache[ fv.source_filepath ] = TiffDimensions( fv.source_filepath )
+            if cache[ fv.source_filepath ] is None:
+                return None
+            width, height = cache[ fv.source_filepath ]
+            px_plane_bytes += width * height * px_bytes
+        else:
+            return None
+        if fv.downsample or fv.pixel_intensity_mean:
+            if fv.downsample:
+                d = float( fv.downsample ) / 100
+                width, height = int( width * d ), int( height * d )
+            px_plane_bytes += width * height * px_bytes
+
+    if fv.x is not None and fv.y is not None and fv.w is not None and fv.h is not None:
+        width, height = fv.w, fv.h
+        px_plane_bytes += width * height * px_bytes
+    elif ( fv.tile_num_cols and fv.tile_num_cols > 1 ) or \
+            ( fv.tile_num_rows and fv.tile_num_rows > 1 ):
+        width //= fv.tile_num_cols or 1
+        height //= fv.tile_num_rows or 1
+        px_plane_bytes += width * height * px_bytes
+
+    # Samples with the same feature names usually share the list, so look plans up by
+    # its identity. GetFeatureComputationPlan() keeps the plan it makes in the sample,
+    # which would then have to go through the wire, so put back what was there.
+    plan_key = ( id( fv.feature_names ), fv.feature_set_version, id( fv.feature_computation_plan ) )
+    if plan_key not in cache:
+        saved_plan = fv.feature_computation_plan
+        try:
+            cache[ plan_key ] = ( fv.GetFeatureComputationPlan(), fv.feature_names )
+        finally:
+            fv.feature_computation_plan = saved_plan
+    plan = cache[ plan_key ][0]
+
+    # The input to the plan is the last pixel plane counted above.
+    plan_bytes = plan.predicted_peak_bytes( width, height ) - width * height * px_bytes
+    return plan.predicted_cost( width, height ), px_plane_bytes + plan_bytes
+
+def memory_limited_imap( pool, pool_size, worker, tasks, task_bytes, memory_limit ):
+    """Like pool.imap_unordered( worker, tasks, 1 ), but starts a task only when the
+    estimated bytes of the tasks in progress, plus its own, are within memory_limit.
+    A task that needs more than memory_limit runs when nothing else is.
+
+    tasks is a list of ( sample index, ... ) worker arguments, task_bytes their estimates."""
+
+    from Queue import Queue, Empty
+
+    done = Queue()
+    in_progress = {}
+    bytes_in_progress = 0
+    next_task = 0
+    while next_task < len( tasks ) or in_progress:
+        while next_task < len( tasks ) and len( in_progress ) < pool_size and \
+                ( not in_progress or bytes_in_progress + task_bytes[ next_task ] <= memory_limit ):
+            index = tasks[ next_task ][0]
+            in_progress[ index ] = ( pool.apply_async( worker, ( tasks[ next_task ], ),
+                    callback=done.put ), task_bytes[ next_task ] )
+            bytes_in_progress += task_bytes[ next_task ]
+            next_task += 1
+        # A timeout, so Ctrl-C isn't blocked, and a failure in the pool machinery
+        # (as opposed to in the worker function, which catches its exceptions) isn't missed.
+        try:
+            result = done.get( True, 1 )
+        except Empty:
+            for async_result, n_bytes in in_progress.itervalues():
+                if async_result.ready() and not async_result.successful():
+                    async_result.get()
+            continue
+        bytes_in_progress -= in_progress.pop( result[0] )[1]
+        yield result
+
+def SharePixelPlanes( samples ):
+    """Puts the pixel planes that samples already hold in memory into POSIX shared
+    memory (see PyImageMatrix.share_pixels()), so they're mapped by the worker processes
+    instead of being pickled or read from the image file again.
+
+    Returns:
+        list of the PyImageMatrix instances shared by this call; unshare_pixels() them
+        when the workers are done."""
+
+    from .PyImageMatrix import PyImageMatrix
+
+    shared = []
+    seen = set()
+    try:
+        for fv in samples:
+            for attr in ( 'original_px_plane', 'preprocessed_full_px_plane',
+                    'preprocessed_local_px_plane' ):
+                px_plane = getattr( fv, attr, None )
+                if not isinstance( px_plane, PyImageMatrix ) or id( px_plane ) in seen:
+                    continue
+                seen.add( id( px_plane ) )
+                if px_plane.shared_pix_plane_name() or px_plane.width == 0:
+                    continue
+                if px_plane.share_pixels():
+                    shared.append( px_plane )
+    except BaseException:
+        # Don't leave the segments shared so far behind in /dev/shm
+        for px_plane in shared:
+            px_plane.unshare_pixels()
+        raise
+    return shared
+
+def imap_compute( samples, n_jobs=True, quiet=True, write_to_disk=True, chunksize=None,
+        progress=None, longest_first=False, memory_limit=None ):
+    """Calculates (or loads from .sig files) the features for a list of FeatureVectors
+    in the worker processes of the module-level feature computation pool, and yields
+    the results as they come in, in the order they're finished.
+
+    Arguments:
+        samples (list of wndcharm.FeatureVector):
+            Samples to calculate features for. They aren't modified, see parallel_compute().
+        n_jobs (int or bool, default True):
+            Number of worker processes, or one per CPU if True.
+        quiet (bool, default True):
+            Verbosity.
+        write_to_disk (bool, default True):
+            Workers also save the features they calculate to .sig files.
+        chunksize (int, default None):
+            Number of samples sent to a worker process at a time. If None, about 4 chunks
+            per process, so big jobs don't spend their time passing messages and small
+            ones are still spread over all the processes.
+            With longest_first, a chunk gets every n-th sample of the sorted list
+            rather than n consecutive ones.
+        progress (callable, default None):
+            Called as progress( n_done, n_total, rate, eta ) after each sample, with rate
+            in samples per second and eta in seconds. Defaults to print_progress()
+            if quiet is False.
+        longest_first (bool, default False):
+            Hand out the samples in order of decreasing EstimateSampleCost() so one
+            big image doesn't keep a worker busy long after the others are done.
+            Samples whose cost can't be estimated go first. The estimates read every
+            sample's image header before anything is sent, even for samples that
+            will just load their features from .sig files, so this only pays off
+            for jobs with images of very different sizes.
+        memory_limit (int, default None):
+            Bytes of memory the worker processes on this machine may use at once, going
+            by EstimateSampleCost(). Samples are then handed out one at a time, and
+            only when the estimates for the ones in progress leave room.
+
+    Grayscale pixel planes the samples hold in memory (e.g. one big image cut up
+    by a SlidingWindow) go to the workers through shared memory, see SharePixelPlanes().
+
+    Yields:
+        ( sample index, values, error ) tuples, where values is the WorkerResult() dict
+        holding the sample's features in 'values' and error is None, or values is None
+        and error is the traceback of the exception the worker process caught. Both are
+        None for samples skipped because another process, maybe on another machine, is
+        writing their sig file (see FeatureVector.WORMfile)."""
+
+    from time import time
+
+    n_total = len( samples )
+    if n_total == 0:
+        return
+    pool = GetFeatureComputationPool( n_jobs )
+    if chunksize is None:
+        chunksize = max( 1, n_total // ( 4 * feature_computation_pool_size ) )
+    if progress is None and not quiet:
+        progress = print_progress
 
     if quiet:
         worker = WorkerFunction
     else:
         worker = WorkerFunctionVerbose
 
+    shared_px_planes = SharePixelPlanes( samples )
     try:
-        result = pool.map_async( worker, samples, chunksize=1 )
-        pool.close()
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
-        result.get()
-        pool.join()
+        order = xrange( n_total )
+        if longest_first or memory_limit is not None:
+            cache = {}
+            estimates = [ EstimateSampleCost( fv, cache ) for fv in samples ]
+            known_bytes = [ estimate[1] for estimate in estimates if estimate is not None ]
+            max_bytes = max( known_bytes ) if known_bytes else 0
+            if longest_first:
+                order = sorted( order, key=lambda i: \
+                        -estimates[i][0] if estimates[i] is not None else float( '-inf' ) )
+
+        tasks = [ ( index, samples[ index ], write_to_disk ) for index in order ]
+        if memory_limit is not None:
+            task_bytes = [ estimates[ index ][1] if estimates[ index ] is not None else max_bytes \
+                    for index in order ]
+            results = memory_limited_imap( pool, feature_computation_pool_size, worker,
+                    tasks, task_bytes, memory_limit )
+        elif longest_first and chunksize > 1:
+            # Chunks of consecutive tasks would put the most expensive samples together in
+            # the first chunk, so deal the tasks out to the chunks like cards instead.
+            n_chunks = -( -n_total // chunksize )
+            chunks = [ ( worker, tasks[ i : : n_chunks ] ) for i in xrange( n_chunks ) ]
+            results = ( result for chunk_results in pool.imap_unordered( WorkerChunkFunction, chunks )
+                    for result in chunk_results )
+        else:
+            results = pool.imap_unordered( worker, tasks, chunksize )
+
+        start_time = time()
+        n_done = 0
+        try:
+            for index, values, error in results:
+                n_done += 1
+                if progress is not None:
+                    rate = n_done / max( time() - start_time, 1e-6 )
+                    progress( n_done, n_total, rate, ( n_total - n_done ) / rate )
+                yield index, values, error
+        except BaseException:
+            # KeyboardInterrupt, or the caller stopped early (GeneratorExit): the workers
+            # may still be busy with samples nobody is going to collect.
+            CloseFeatureComputationPool( terminate=True )
+            raise
+    finally:
+        for px_plane in shared_px_planes:
+            px_plane.unshare_pixels()
+
+def parallel_compute( samples, n_jobs=True, quiet=True, write_to_disk=True, chunksize=None,
+        progress=None, longest_first=False, memory_limit=None ):
+    """WND-CHARM implementation of symmetric multiprocessing, see:
+    https://en.wikipedia.org/wiki/Symmetric_multiprocessing
+
+    Calculates (or loads from .sig files) the features for a list of FeatureVectors
+    using imap_compute(). The workers send the feature values back through the pool's
+    result queue, and they're put into the samples in this process, so a subsequent
+    call to GenerateFeatures() on them doesn't have to do anything.
+
+    Arguments:
+        samples (list of wndcharm.FeatureVector):
+            Samples to calculate features for.
+        n_jobs, quiet, write_to_disk, chunksize, progress, longest_first, memory_limit:
+            See imap_compute().
+
+    Returns:
+        samples, for convenience. Samples whose features couldn't be calculated
+        in a worker process are left as they were, values = None, and the errors
+        are reported on stderr. So are samples whose sig files another process is
+        writing; GenerateFeatures() waits for and loads those."""
+
+    from .FeatureVector import InternFeatureNames
+
+    errors = {}
+    n_skipped = 0
+    try:
+        for index, fv_result, error in imap_compute( samples, n_jobs, quiet, write_to_disk,
+                chunksize, progress, longest_first, memory_limit ):
+            if error is not None:
+                errors[ index ] = error
+                continue
+            if fv_result is None:
+                n_skipped += 1
+                continue
+            fv = samples[ index ]
+            names = fv_result.pop( 'feature_names' )
+            # Keep the names the sample already had (they may be shared among many
+            # samples) if they came back unchanged
+            if not fv.feature_names or fv.feature_names != names:
+                fv.feature_names = InternFeatureNames( names, fv.feature_set_version )
+            for member, value in fv_result.iteritems():
+                setattr( fv, member, value )
     except KeyboardInterrupt:
-        print "Caught KeyboardInterrupt, terminating workers"
-        pool.terminate()
-        pool.join()
-    except Exception:
-        pool.terminate()
-        pool.join()
+        print "Caught KeyboardInterrupt, terminated workers"
+
+    if n_skipped and not quiet:
+        print "Skipped {0} samples whose sig files are being written by other processes.".format(
+                n_skipped )
+
+    if errors:
+        import sys
+        for index in sorted( errors ):
+            print >> sys.stderr, "Error calculating features for sample {0} ({1}):\n{2}".format(
+                    index, samples[ index ], errors[ index ] )
+        print >> sys.stderr, "Features for {0} of {1} samples couldn't be calculated in parallel.".format(
+                len( errors ), len( samples ) )
+    return samples